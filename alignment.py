@@ -0,0 +1,118 @@
+"""单词级时间戳与 segment 文本的线性时间对齐"""
+import string
+from typing import List, Optional
+
+# 规范化时去掉的标点（含常见中文标点）
+_PUNCTUATION = string.punctuation + '“”‘’…，。！？；：、（）《》'
+# 匹配失败时最多向前查看的单词数
+DEFAULT_LOOKAHEAD = 8
+# 判断跳词还是缺词时，向后确认的连续匹配长度
+DEFAULT_CONFIRM = 3
+
+
+def normalize_token(token: str) -> str:
+    """去掉首尾空白和标点并转为小写，用于单词匹配"""
+    return token.strip().strip(_PUNCTUATION).lower()
+
+
+def _match_run(tokens: List[str], i: int, words: List[str], k: int, limit: int) -> int:
+    """从 tokens[i] 与 words[k] 开始连续相等的个数（最多 limit 个）"""
+    run = 0
+    while (run < limit and i + run < len(tokens) and k + run < len(words)
+           and tokens[i + run] == words[k + run]):
+        run += 1
+    return run
+
+
+def _fill_gap(timings: List[Optional[dict]], tokens: List[str], first: int, last: int,
+              left: float, right: float) -> None:
+    """把 [first, last) 之间未匹配的单词均匀分布在 left 到 right 的空隙中"""
+    count = last - first
+    right = max(right, left)
+    step = (right - left) / count
+    for k in range(count):
+        start = left + k * step
+        timings[first + k] = {'word': tokens[first + k], 'start': start, 'end': start + step}
+
+
+def align_words_to_segments(words, segments, lookahead: int = DEFAULT_LOOKAHEAD,
+                            confirm: int = DEFAULT_CONFIRM) -> List[List[dict]]:
+    """为每个 segment 中的单词找到对应的单词级时间戳
+
+    所有 segment 的单词连成一条序列，与 words 各用一个只前进不后退的游标
+    同步遍历，因此重复出现的单词会对应到正确的位置。两边不一致时，在游标
+    之后 lookahead 个单词内寻找匹配，并用随后 confirm 个单词的连续匹配长度
+    判断是 words 多出了单词（跳过）还是 words 缺了这个单词（留空）。
+    每个单词的工作量有常数上界，整体复杂度为 O(单词数)。
+
+    未匹配的单词只在相邻已匹配单词之间的实际空隙内插值（segment 边界处
+    退回到 segment 的起止时间）。
+
+    返回与 segments 一一对应的列表，每项为 {'word', 'start', 'end'} 字典列表。
+    """
+    word_norms = [normalize_token(w.word) for w in words]
+
+    # 标点只规范化一次
+    segment_tokens = [segment.text.strip().split() for segment in segments]
+    token_norms = [normalize_token(token) for tokens in segment_tokens for token in tokens]
+    matched: List[Optional[int]] = [None] * len(token_norms)
+
+    cursor = 0
+    for i, norm in enumerate(token_norms):
+        if cursor < len(word_norms) and word_norms[cursor] == norm:
+            matched[i] = cursor
+            cursor += 1
+            continue
+
+        # 假设 words 多出了单词：在游标之后寻找当前单词
+        best_k, best_run = None, 0
+        for k in range(cursor + 1, min(cursor + lookahead, len(word_norms))):
+            if word_norms[k] == norm:
+                run = _match_run(token_norms, i, word_norms, k, confirm)
+                if run > best_run:
+                    best_k, best_run = k, run
+                    if run == confirm:
+                        break
+        # 假设 words 缺了当前（及随后若干个）单词：后面的单词应该从游标处接上
+        stay_skip, stay_run = None, 0
+        for d in range(1, lookahead):
+            if i + d >= len(token_norms):
+                break
+            run = _match_run(token_norms, i + d, word_norms, cursor, confirm)
+            if run > stay_run:
+                stay_skip, stay_run = d, run
+                if run == confirm:
+                    break
+        # 连续匹配更长的假设胜出；同样长时选位移更小的
+        if best_k is not None and (best_run > stay_run or
+                                   (best_run == stay_run and best_k - cursor <= stay_skip)):
+            matched[i] = best_k
+            cursor = best_k + 1
+
+    aligned = []
+    offset = 0
+    for segment, tokens in zip(segments, segment_tokens):
+        timings: List[Optional[dict]] = [None] * len(tokens)
+        for j, token in enumerate(tokens):
+            k = matched[offset + j]
+            if k is not None:
+                timings[j] = {'word': token, 'start': words[k].start, 'end': words[k].end}
+        offset += len(tokens)
+
+        # 为连续的未匹配单词插值
+        j = 0
+        while j < len(tokens):
+            if timings[j] is not None:
+                j += 1
+                continue
+            run_end = j
+            while run_end < len(tokens) and timings[run_end] is None:
+                run_end += 1
+            left = timings[j - 1]['end'] if j > 0 else segment.start
+            right = timings[run_end]['start'] if run_end < len(tokens) else segment.end
+            _fill_gap(timings, tokens, j, run_end, left, right)
+            j = run_end
+
+        aligned.append(timings)
+
+    return aligned
@@ -1,256 +1,144 @@
 import streamlit as st
-import tempfile
 import os
-import re
-import io
-from datetime import timedelta
-from typing import List, Tuple
-from openai import OpenAI
-import ffmpeg
-import imageio_ffmpeg
-try:
-    from moviepy.editor import VideoFileClip
-    HAS_MOVIEPY = True
-except ImportError:
-    HAS_MOVIEPY = False
+import tempfile
+import time
+import uuid
+from transcription import DEFAULT_CHUNK_SECONDS, DEFAULT_MAX_WORKERS
+from transcript_cache import TranscriptCache
+from metrics import REGISTRY, trace
+from subtitles import SUBTITLE_FORMATS, format_timestamp, iter_segment_cues, iter_word_cues, write_subtitles
+from audio_extraction import (
+    AUDIO_PROFILES, DEFAULT_EXTRACT_RANGES, PCM_BYTES_PER_SECOND, VIDEO_EXTENSIONS
+)
+from scheduler import SCHEDULER
+from prefetch import CLAIM_TIMEOUT, AudioPrefetch
+from jobs import (
+    CANCELLED, DONE, FAILED, FINAL_STATUSES, PARTIAL_FILE, POLL_SECONDS, QUEUED, RUNNING, JobService
+)
 
-def format_timestamp(seconds: float) -> str:
-    """将秒数转换为SRT格式的时间戳"""
-    td = timedelta(seconds=seconds)
-    hours = int(td.total_seconds() // 3600)
-    minutes = int((td.total_seconds() % 3600) // 60)
-    seconds = td.total_seconds() % 60
-    return f"{hours:02d}:{minutes:02d}:{seconds:06.3f}".replace(".", ",")
+def run_stage(name: str, key, compute):
+    """在 session_state 中缓存流水线阶段的结果，参数 key 不变时直接复用"""
+    stages = st.session_state.setdefault('pipeline_stages', {})
+    cached = stages.get(name)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    with trace() as stage_trace:
+        value = compute()
+    st.session_state.setdefault('run_metrics', []).extend(stage_trace.records)
+    stages[name] = (key, value)
+    return value
 
-def split_text_at_punctuation(text: str) -> List[str]:
-    """在句号和感叹号后面分割文本"""
-    # 使用正则表达式在 ". " 和 "! " 处分割
-    segments = re.split(r'([.!] )', text)
-    
-    result = []
-    current_segment = ""
-    
-    for i, segment in enumerate(segments):
-        if i % 2 == 0:  # 实际文本
-            current_segment += segment
-        else:  # 标点符号
-            current_segment += segment.rstrip()  # 移除末尾空格
-            if current_segment.strip():
-                result.append(current_segment.strip())
-            current_segment = ""
-    
-    # 添加最后一个段落（如果有的话）
-    if current_segment.strip():
-        result.append(current_segment.strip())
-    
-    return result
+def prefetch_audio(uploaded_file, key, **options):
+    """上传文件或提取参数变化时，取消之前的预先提取并在后台重新开始（见 prefetch.py）"""
+    if st.session_state.get('prefetch_key') == key:
+        return
+    previous = st.session_state.pop('prefetch', None)
+    if previous:
+        previous.cancel()
+    st.session_state['prefetch_key'] = key
+    if uploaded_file is not None:
+        st.session_state['prefetch'] = AudioPrefetch(key, uploaded_file, **options)
 
-def split_text_by_length(text: str, max_length: int = 26) -> List[str]:
-    """按长度分割文本，确保单词不被截断"""
-    words = text.split()
-    segments = []
-    current_segment = ""
-    
-    for word in words:
-        # 检查添加新单词是否会超过长度限制
-        test_segment = current_segment + (" " if current_segment else "") + word
-        
-        if len(test_segment) <= max_length:
-            current_segment = test_segment
-        else:
-            # 如果当前段落不为空，保存它
-            if current_segment:
-                segments.append(current_segment)
-                current_segment = word
-            else:
-                # 如果单个单词就超过了限制，强制添加
-                segments.append(word)
-                current_segment = ""
-    
-    # 添加最后一个段落
-    if current_segment:
-        segments.append(current_segment)
-    
-    return segments
+def format_bytes(size) -> str:
+    if not size:
+        return ""
+    return f"{size / 1024 / 1024:.2f} MB" if size >= 1024 * 1024 else f"{size / 1024:.1f} KB"
 
-def process_transcript_segments(segments, max_chars: int = 26) -> List[dict]:
-    """处理转录段落，按照指定规则分割"""
-    processed_segments = []
-    
-    for segment in segments:
-        text = segment.text.strip()
-        start_time = segment.start
-        end_time = segment.end
-        duration = end_time - start_time
-        
-        # 首先在标点符号处分割
-        punctuation_splits = split_text_at_punctuation(text)
-        
-        for i, punct_segment in enumerate(punctuation_splits):
-            # 然后按长度分割每个标点符号段落
-            length_splits = split_text_by_length(punct_segment, max_chars)
-            
-            # 为每个分割的段落计算时间
-            total_splits = len(length_splits)
-            segment_duration = duration / len(punctuation_splits)
-            
-            for j, split_text in enumerate(length_splits):
-                # 计算此子段落的开始和结束时间
-                subsegment_duration = segment_duration / total_splits
-                subsegment_start = start_time + (i * segment_duration) + (j * subsegment_duration)
-                subsegment_end = subsegment_start + subsegment_duration
-                
-                processed_segments.append({
-                    'text': split_text,
-                    'start': subsegment_start,
-                    'end': subsegment_end
-                })
-    
-    return processed_segments
+def metrics_rows(records) -> list:
+    """把阶段记录整理成表格行"""
+    return [{
+        '阶段': r['stage'],
+        '耗时 (s)': round(r['seconds'], 3),
+        '输入': format_bytes(r.get('bytes_in')),
+        '输出': format_bytes(r.get('bytes_out')),
+        '条目数': r.get('items', ''),
+        '状态': '✅' if r['ok'] else f"❌ {r.get('error', '')}",
+    } for r in records]
 
-def generate_raw_srt(transcript) -> str:
-    """生成原始SRT，每个单词一个字幕段，使用精确的单词级时间戳"""
-    srt_content = []
-    segment_number = 1
-    
-    # 检查是否有单词级时间戳
-    if hasattr(transcript, 'words') and transcript.words and len(transcript.words) > 0:
-        # 使用精确的单词级时间戳
-        for word_info in transcript.words:
-            srt_content.append(f"{segment_number}")
-            srt_content.append(f"{format_timestamp(word_info.start)} --> {format_timestamp(word_info.end)}")
-            srt_content.append(word_info.word)
-            srt_content.append("")
-            segment_number += 1
+@st.cache_resource
+def get_transcript_cache() -> TranscriptCache:
+    """进程内共享的转录缓存实例"""
+    return TranscriptCache()
+
+@st.cache_resource
+def get_job_service() -> JobService:
+    """进程内共享的后台任务服务，创建时重新提交上次进程退出时未完成的任务"""
+    service = JobService()
+    service.recover(os.getenv('OPENAI_API_KEY'))
+    return service
+
+@st.fragment(run_every=POLL_SECONDS)
+def show_job_progress(service: JobService, job_id: str):
+    """定时刷新后台任务的状态和进度，任务结束时重新运行整个页面以显示结果"""
+    job = service.status(job_id)
+    if job is None or job['status'] in FINAL_STATUSES:
+        st.rerun()
+    if job['status'] == QUEUED:
+        st.info(f"⏳ 任务排队中，前面还有 {job['ahead']} 个任务（所有用户共享 {service.workers} 个工作进程）")
     else:
-        # 回退到段落级处理（如果没有单词级时间戳）
-        segments = getattr(transcript, 'segments', [])
-        if segments:
-            for segment in segments:
-                words = segment.text.split()
-                if not words:
-                    continue
-                    
-                duration = segment.end - segment.start
-                word_duration = duration / len(words)
-                
-                for i, word in enumerate(words):
-                    word_start = segment.start + (i * word_duration)
-                    word_end = word_start + word_duration
-                    
-                    srt_content.append(f"{segment_number}")
-                    srt_content.append(f"{format_timestamp(word_start)} --> {format_timestamp(word_end)}")
-                    srt_content.append(word)
-                    srt_content.append("")
-                    
-                    segment_number += 1
-    
-    return "\n".join(srt_content)
+        st.info(f"⚙️ {job['stage']}...")
+        done_chunks, total_chunks = job['progress']
+        if total_chunks:
+            st.progress(done_chunks / total_chunks, text=f"已完成 {done_chunks}/{total_chunks} 块")
+        partial_segments = job.get('partial_segments')
+        if partial_segments:
+            st.write(f"⏳ 已生成 {partial_segments} 个字幕段（已转录到 {format_timestamp(job['covered_until'])}）")
+            for start, end, text in job.get('latest_cues', []):
+                st.write(f"`{format_timestamp(start)} --> {format_timestamp(end)}` {text}")
+            with open(service.store.path(job_id, PARTIAL_FILE), 'rb') as f:
+                st.download_button(
+                    label="📥 下载已生成的部分字幕",
+                    data=f.read(),
+                    file_name=f"{job['name'].rsplit('.', 1)[0]}_partial.srt",
+                    mime="text/plain",
+                    key=f"partial_srt_{partial_segments}",
+                    on_click="ignore"
+                )
+    st.caption(f"任务 ID：{job_id}。任务在后台运行，刷新或关闭页面不会中断，用当前链接可以随时回来查看")
+    if st.button("🛑 取消任务"):
+        service.cancel(job_id)
+        st.rerun()
 
-def generate_srt(segments) -> str:
-    """生成标准SRT字幕文件"""
-    srt_content = []
+def load_job_result(service: JobService, job: dict):
+    """把已完成任务的转录结果放入 session_state，每个会话只加载一次"""
+    stage = st.session_state.get('transcript_stage')
+    if stage and stage.get('job_id') == job['id']:
+        return
+    transcript = service.result(job['id'])
+    if transcript is None:
+        st.error("❌ 任务已完成，但找不到转录结果")
+        return
     
-    for i, segment in enumerate(segments, 1):
-        srt_content.append(f"{i}")
-        
-        # 兼容字典和对象两种格式
-        if hasattr(segment, 'start'):
-            # 对象格式
-            start_time = segment.start
-            end_time = segment.end
-            text = segment.text
-        else:
-            # 字典格式
-            start_time = segment['start']
-            end_time = segment['end']
-            text = segment['text']
-        
-        srt_content.append(f"{format_timestamp(start_time)} --> {format_timestamp(end_time)}")
-        srt_content.append(text)
-        srt_content.append("")
+    # 工作进程中收集的阶段记录，并入本进程的累计指标（每个任务只并入一次）
+    st.session_state['run_metrics'] = job.get('metrics', [])
+    if not job.get('metrics_merged'):
+        for record in st.session_state['run_metrics']:
+            REGISTRY.observe(record)
+        service.store.update(job['id'], metrics_merged=True)
     
-    return "\n".join(srt_content)
-
-def extract_audio_from_video(video_file) -> str:
-    """从视频文件提取音频"""
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as audio_file:
-        audio_path = audio_file.name
-    
-    with tempfile.NamedTemporaryFile(delete=False) as video_temp:
-        video_temp.write(video_file.read())
-        video_temp_path = video_temp.name
+    stats = job.get('stats') or {}
+    if stats.get('cached'):
+        st.info("⚡ 命中转录缓存，跳过 API 调用")
+    elif stats:
+        # 记录本次编码方案的体积和上传耗时，便于比较
+        compression_ratio = stats['duration'] * PCM_BYTES_PER_SECOND / max(stats['audio_bytes'], 1)
+        st.session_state.setdefault('profile_stats', []).append({
+            '编码': job['params']['profile'],
+            '时长 (s)': round(stats['duration'], 1),
+            '大小 (MB)': round(stats['audio_bytes'] / 1024 / 1024, 2),
+            '压缩比': round(compression_ratio, 1),
+            '上传+转录耗时 (s)': round(stats['request_seconds'], 2),
+        })
     
-    try:
-        # 获取ffmpeg路径并使用它
-        ffmpeg_exe = imageio_ffmpeg.get_ffmpeg_exe()
-        st.write(f"🔧 Using ffmpeg: {ffmpeg_exe}")
-        
-        # 检查ffmpeg是否可执行
-        if not os.path.exists(ffmpeg_exe):
-            raise FileNotFoundError(f"FFmpeg not found at: {ffmpeg_exe}")
-            
-        # 使用ffmpeg提取音频
-        stream = ffmpeg.input(video_temp_path)
-        stream = ffmpeg.output(stream, audio_path, acodec='pcm_s16le', ar=16000)
-        ffmpeg.run(stream, cmd=ffmpeg_exe, quiet=True, overwrite_output=True)
-        
-        os.unlink(video_temp_path)
-        return audio_path
-    except Exception as e:
-        if os.path.exists(video_temp_path):
-            os.unlink(video_temp_path)
-        
-        # 备用方案：尝试系统ffmpeg
-        st.warning(f"⚠️ imageio-ffmpeg failed: {e}")
-        st.info("🔄 Trying system ffmpeg...")
-        
-        try:
-            with tempfile.NamedTemporaryFile(delete=False) as video_temp2:
-                video_file.seek(0)
-                video_temp2.write(video_file.read())
-                video_temp2_path = video_temp2.name
-            
-            stream = ffmpeg.input(video_temp2_path)
-            stream = ffmpeg.output(stream, audio_path, acodec='pcm_s16le', ar=16000)
-            ffmpeg.run(stream, quiet=True, overwrite_output=True)
-            
-            os.unlink(video_temp2_path)
-            st.success("✅ System ffmpeg worked!")
-            return audio_path
-            
-        except Exception as e2:
-            if os.path.exists(audio_path):
-                os.unlink(audio_path)
-            
-            # 最终备用方案：MoviePy
-            if HAS_MOVIEPY:
-                st.info("🎬 Trying MoviePy as final option...")
-                try:
-                    with tempfile.NamedTemporaryFile(delete=False) as video_temp3:
-                        video_file.seek(0)
-                        video_temp3.write(video_file.read())
-                        video_temp3_path = video_temp3.name
-                    
-                    # 使用 MoviePy 提取音频
-                    video_clip = VideoFileClip(video_temp3_path)
-                    audio_clip = video_clip.audio
-                    audio_clip.write_audiofile(audio_path, verbose=False, logger=None)
-                    
-                    # 清理
-                    audio_clip.close()
-                    video_clip.close()
-                    os.unlink(video_temp3_path)
-                    
-                    st.success("✅ MoviePy worked!")
-                    return audio_path
-                    
-                except Exception as e3:
-                    raise Exception(f"All methods failed. imageio-ffmpeg: {e}, system ffmpeg: {e2}, moviepy: {e3}")
-            else:
-                raise Exception(f"Both ffmpeg methods failed. imageio-ffmpeg: {e}, system ffmpeg: {e2}")
-        
-        raise e
+    # 保存转录结果：之后调整分段或预览参数只重算下游阶段
+    st.session_state['transcript_stage'] = {
+        'job_id': job['id'],
+        'upload_key': (job['name'], job['size']),
+        'name': job['name'],
+        'run_id': time.time_ns(),
+        'transcript': transcript,
+    }
+    st.success("✅ 字幕生成完成！")
 
 def main():
     st.set_page_config(
@@ -293,366 +181,320 @@ def main():
             min_value=20,
             max_value=100,
             value=26,
-            help="每个字幕段的最大字符数限制"
+            help="每个字幕段的最大字符数限制（逐段分段时使用）"
+        )
+        
+        reflow_enabled = st.checkbox(
+            "最优重排（多行字幕）",
+            value=False,
+            help="用动态规划整体优化分段和换行，兼顾行宽、行数、阅读速度、显示时长和句子边界；"
+                 "调整规则只基于已保存的转录结果重新计算，不会再次调用 API"
+        )
+        layout = None
+        if reflow_enabled:
+            # 重排依赖 NumPy，勾选后才导入
+            from reflow import (
+                DEFAULT_LINE_CHARS, DEFAULT_MAX_CPS, DEFAULT_MAX_DURATION, DEFAULT_MAX_LINES, DEFAULT_MIN_DURATION,
+                LayoutRules
+            )
+            with st.expander("重排规则", expanded=True):
+                layout = LayoutRules(
+                    max_chars=st.slider("每行最大字符数", min_value=16, max_value=60, value=DEFAULT_LINE_CHARS),
+                    max_lines=st.slider("每段最多行数", min_value=1, max_value=3, value=DEFAULT_MAX_LINES),
+                    max_cps=st.slider("阅读速度上限（字符/秒）", min_value=10.0, max_value=30.0,
+                                      value=DEFAULT_MAX_CPS, step=1.0),
+                    min_duration=st.slider("最短显示时长（秒）", min_value=0.3, max_value=2.0,
+                                           value=DEFAULT_MIN_DURATION, step=0.01, format="%.2f"),
+                    max_duration=st.slider("最长时长（秒）", min_value=3.0, max_value=10.0,
+                                           value=DEFAULT_MAX_DURATION, step=0.5),
+                )
+        
+        audio_profile = st.selectbox(
+            "音频编码",
+            list(AUDIO_PROFILES),
+            index=1,
+            format_func=lambda key: AUDIO_PROFILES[key]["label"],
+            help="压缩编码可将上传体积减少 5-10 倍，缩短上传时间，并让单次请求容纳更长的音频；"
+                 "直接封装不解码，提取最快，但上传体积取决于原始音轨的码率"
+        )
+        
+        audio_language = st.text_input(
+            "音轨语言",
+            value="",
+            help="视频有多条音轨时优先选择该语言（ISO 639-2 代码，如 eng、chi、jpn）；留空则使用默认音轨"
+        ).strip().lower() or None
+        
+        trim_silences = st.checkbox(
+            "裁剪长静音后上传",
+            value=False,
+            help="删除超过 2 秒的静音（片头、停顿、空白段）再上传，减少上传体积和转录耗时；"
+                 "字幕时间戳会换算回原视频时间"
+        )
+        
+        use_cache = st.checkbox(
+            "使用转录缓存",
+            value=True,
+            help="相同音频、模型和参数的转录结果直接从本地缓存读取，不再调用 API"
+        )
+        
+        chunk_mode = st.selectbox(
+            "分块并行转录",
+            ["自动", "始终分块", "关闭"],
+            help="自动：音频超过 25 MB 上传上限时在静音处分块并发转录"
+        )
+        
+        max_workers = st.slider(
+            "并发请求数",
+            min_value=1,
+            max_value=8,
+            value=DEFAULT_MAX_WORKERS,
+            help="分块转录时同时发送的请求数量"
+        )
+        
+        extract_ranges = st.slider(
+            "并行解码进程数",
+            min_value=1,
+            max_value=max(os.cpu_count() or 1, 1),
+            value=DEFAULT_EXTRACT_RANGES,
+            help="长视频分成几个时间段同时解码再按顺序编码，听感与单进程解码相同，"
+                 "但不保证逐采样一致（MP4 拼接处精确，Matroska 可能错开几个采样）；"
+                 "短于 2 分钟的视频不拆分"
+        ) if (os.cpu_count() or 1) > 1 else 1
+        
+        chunk_minutes = st.slider(
+            "每块时长（分钟）",
+            min_value=1,
+            max_value=20,
+            value=int(DEFAULT_CHUNK_SECONDS // 60),
+            help="分块转录时每块音频的目标时长，实际切点会落在附近的静音处"
+        )
+        
+        stream_output = st.checkbox(
+            "边转录边显示字幕",
+            value=True,
+            help="每完成一块音频就分段显示，并可下载已生成的部分字幕；不分块转录时整段音频算作一块"
         )
     
     # 主界面
     col1, col2 = st.columns([2, 1])
+    service = get_job_service()
     
     with col1:
         st.header("上传视频文件")
         uploaded_file = st.file_uploader(
             "选择视频文件",
-            type=['mp4', 'avi', 'mov', 'mkv', 'wmv', 'flv'],
+            type=VIDEO_EXTENSIONS,
             help="支持常见的视频格式"
         )
         
+        # 本会话在共享队列中的标识
+        session_id = st.session_state.setdefault('session_id', uuid.uuid4().hex)
+        # 上传完成后立即在后台提取音频，不必等点击开始；换文件或改提取参数时重新开始
+        prefetch_key = (
+            (uploaded_file.file_id, audio_profile, audio_language, trim_silences, extract_ranges)
+            if uploaded_file else None
+        )
+        prefetch_audio(uploaded_file, prefetch_key, profile=audio_profile, language=audio_language,
+                       trim_silences=trim_silences, ranges=extract_ranges, owner=session_id)
+        
         if uploaded_file and api_key:
+            prefetch = st.session_state.get('prefetch')
+            if prefetch and prefetch.done and prefetch.audio_path:
+                st.caption("✅ 音频已在后台提取完成，点击开始后直接转录")
+            elif prefetch and not prefetch.done:
+                st.caption("⚙️ 正在后台提取音频...")
             if st.button("🚀 开始生成字幕", type="primary"):
-                try:
-                    # 初始化OpenAI客户端
-                    client = OpenAI(api_key=api_key)
-                    
-                    with st.spinner("正在提取音频..."):
-                        audio_path = extract_audio_from_video(uploaded_file)
-                        # 检查音频文件大小
-                        audio_size = os.path.getsize(audio_path)
-                        st.write(f"🎵 音频文件大小: {audio_size / 1024 / 1024:.2f} MB")
-                    
-                    with st.spinner("正在生成字幕..."):
-                        with open(audio_path, 'rb') as audio_file:
-                            transcript = client.audio.transcriptions.create(
-                                file=audio_file,
-                                model="whisper-1",
-                                response_format="verbose_json",
-                                timestamp_granularities=["word", "segment"]
-                            )
-                    
-                    # 清理临时音频文件
-                    os.unlink(audio_path)
-                    
-                    # 添加调试信息
-                    st.write("🔍 **调试信息：**")
-                    st.write(f"- transcript 类型: {type(transcript)}")
-                    st.write(f"- 是否有 words 属性: {hasattr(transcript, 'words')}")
-                    st.write(f"- 是否有 segments 属性: {hasattr(transcript, 'segments')}")
-                    
-                    if hasattr(transcript, 'words'):
-                        words_count = len(transcript.words) if transcript.words else 0
-                        st.write(f"- words 数量: {words_count}")
-                        if words_count > 0:
-                            st.write(f"- 第一个 word: {transcript.words[0]}")
-                    
-                    if hasattr(transcript, 'segments'):
-                        segments_count = len(transcript.segments) if transcript.segments else 0
-                        st.write(f"- segments 数量: {segments_count}")
-                        if segments_count > 0:
-                            st.write(f"- 第一个 segment: {transcript.segments[0]}")
-                    
-                    # 显示完整的 transcript 对象（前100个字符）
-                    st.write(f"- transcript 内容预览: {str(transcript)[:500]}...")
-                    
-                    with st.spinner("正在处理字幕段落..."):
-                        # 处理字幕段落，添加安全检查
-                        segments = getattr(transcript, 'segments', [])
-                        
-                        if segments and len(segments) > 0:
-                            st.write("✅ 使用API返回的segments数据")
-                            
-                            # 创建单词到时间戳的映射
-                            words_timing = {}
-                            if hasattr(transcript, 'words') and transcript.words:
-                                for word_info in transcript.words:
-                                    # 使用单词文本作为键，存储时间信息
-                                    word_key = word_info.word.strip()
-                                    if word_key not in words_timing:
-                                        words_timing[word_key] = []
-                                    words_timing[word_key].append({
-                                        'start': word_info.start,
-                                        'end': word_info.end,
-                                        'used': False
-                                    })
-                            
-                            # 处理每个segment，按字符数和标点分段
-                            class TempSegment:
-                                def __init__(self, text, start, end):
-                                    self.text = text
-                                    self.start = start
-                                    self.end = end
-                            
-                            processed_segments_list = []
-                            
-                            for segment in segments:
-                                segment_text = segment.text.strip()
-                                segment_words = segment_text.split()
-                                
-                                # 为segment中的每个单词找到对应的时间戳
-                                word_timings = []
-                                for word in segment_words:
-                                    clean_word = word.strip('.,!?;:"()[]')  # 移除标点符号进行匹配
-                                    
-                                    # 查找对应的时间戳
-                                    found_timing = None
-                                    if clean_word in words_timing:
-                                        for timing_info in words_timing[clean_word]:
-                                            if not timing_info['used']:
-                                                found_timing = timing_info
-                                                timing_info['used'] = True
-                                                break
-                                    
-                                    if found_timing:
-                                        word_timings.append({
-                                            'word': word,
-                                            'start': found_timing['start'],
-                                            'end': found_timing['end']
-                                        })
-                                    else:
-                                        # 如果找不到精确匹配，使用segment的时间进行估算
-                                        word_index = segment_words.index(word)
-                                        total_words = len(segment_words)
-                                        duration = segment.end - segment.start
-                                        word_duration = duration / total_words
-                                        estimated_start = segment.start + (word_index * word_duration)
-                                        estimated_end = estimated_start + word_duration
-                                        
-                                        word_timings.append({
-                                            'word': word,
-                                            'start': estimated_start,
-                                            'end': estimated_end
-                                        })
-                                
-                                # 首先按句子结束标点符号分段，然后按字符数分段
-                                current_words = []
-                                current_timings = []
-                                
-                                for i, (word, timing) in enumerate(zip(segment_words, word_timings)):
-                                    current_words.append(word)
-                                    current_timings.append(timing)
-                                    
-                                    # 分段条件（按优先级）
-                                    should_split = False
-                                    
-                                    # 1. 优先级最高：句子结束标点符号 + 下一个单词大写开头（真正的新句子）
-                                    # 排除常见缩写词
-                                    common_abbreviations = ['Dr.', 'Mr.', 'Mrs.', 'Ms.', 'Prof.', 'St.', 'Ave.', 'etc.', 'vs.', 'Inc.', 'Ltd.', 'Co.']
-                                    if (i < len(segment_words) - 1 and 
-                                        any(word.endswith(punct) for punct in ['.', '!', '?']) and
-                                        segment_words[i + 1][0].isupper() and
-                                        word not in common_abbreviations):
-                                        should_split = True
-                                    
-                                    # 2. 最后一个单词
-                                    elif i == len(segment_words) - 1:
-                                        should_split = True
-                                    
-                                    # 3. 超过26个字符且有多个单词时，在上一个单词处分段
-                                    elif len(' '.join(current_words)) > 26 and len(current_words) > 1:
-                                        # 回退一个单词，在前面分段
-                                        current_words.pop()
-                                        current_timings.pop()
-                                        
-                                        if current_timings:  # 确保有内容可以分段
-                                            current_text = ' '.join(current_words)
-                                            start_time = current_timings[0]['start']
-                                            end_time = current_timings[-1]['end']
-                                            
-                                            processed_segments_list.append(TempSegment(current_text, start_time, end_time))
-                                        
-                                        # 重新开始，包含当前单词
-                                        current_words = [word]
-                                        current_timings = [timing]
-                                        should_split = False
-                                    
-                                    if should_split and current_timings:
-                                        # 使用第一个和最后一个单词的精确时间戳
-                                        current_text = ' '.join(current_words)
-                                        start_time = current_timings[0]['start']
-                                        end_time = current_timings[-1]['end']
-                                        
-                                        processed_segments_list.append(TempSegment(current_text, start_time, end_time))
-                                        current_words = []
-                                        current_timings = []
-                            
-                            processed_segments = processed_segments_list
-                            
-                        elif hasattr(transcript, 'words') and transcript.words:
-                            st.write("⚠️ segments为空，使用words重新构建")
-                            # 原有的words重构逻辑保持不变
-                            # 创建一个临时的segment对象
-                            class TempSegment:
-                                def __init__(self, text, start, end):
-                                    self.text = text
-                                    self.start = start
-                                    self.end = end
-                            
-                            # 智能分段：基于句子结构和标点符号
-                            segments = []
-                            current_words = []
-                            segment_start = None
-                            
-                            def is_sentence_start(word_text):
-                                """判断是否是句子开始（首字母大写且不是常见缩写）"""
-                                if not word_text:
-                                    return False
-                                # 检查首字母是否大写
-                                return word_text[0].isupper() and len(word_text) > 1
-                            
-                            def has_sentence_ending(word_text):
-                                """判断单词是否包含句子结束标点"""
-                                return any(punct in word_text for punct in ['.', '!', '?'])
-                            
-
-                            
-                            for i, word in enumerate(transcript.words):
-                                if segment_start is None:
-                                    segment_start = word.start
-                                
-                                current_words.append(word.word)
-                                
-                                # 分段条件（按优先级）：
-                                should_segment = False
-                                
-                                # 1. 最后一个单词
-                                if i == len(transcript.words) - 1:
-                                    should_segment = True
-                                
-                                # 2. 当前单词有句子结束标点
-                                elif has_sentence_ending(word.word):
-                                    should_segment = True
-                                
-                                # 3. 下一个单词是新句子开始（大写字母），且当前段落有至少2个单词
-                                elif i + 1 < len(transcript.words) and len(current_words) >= 2:
-                                    next_word = transcript.words[i + 1]
-                                    if is_sentence_start(next_word.word):
-                                        should_segment = True
-                                
-                                # 4. 长时间停顿（超过1.2秒）
-                                elif i + 1 < len(transcript.words):
-                                    next_word = transcript.words[i + 1]
-                                    if next_word.start - word.end > 1.2:
-                                        should_segment = True
-                                
-                                # 5. 段落过长（超过12个单词）强制分段
-                                elif len(current_words) >= 12:
-                                    should_segment = True
-                                
-                                if should_segment:
-                                    # 保持Whisper原始文本不变
-                                    segment_text = ' '.join(current_words)
-                                    segments.append(TempSegment(segment_text, segment_start, word.end))
-                                    current_words = []
-                                    segment_start = None
-                            
-                            processed_segments = segments
-                        else:
-                            processed_segments = []
-                        
-                        # 生成SRT文件
-                        standard_srt = generate_srt(processed_segments)
-                        raw_srt = generate_raw_srt(transcript)
-                        
-                        # 添加SRT调试信息
-                        st.write("📝 **SRT生成调试信息：**")
-                        st.write(f"- 处理后的段落数: {len(processed_segments)}")
-                        st.write(f"- 标准SRT长度: {len(standard_srt)} 字符")
-                        st.write(f"- 原始SRT长度: {len(raw_srt)} 字符")
-                        if len(standard_srt) > 0:
-                            st.write(f"- 标准SRT预览: {standard_srt[:200]}...")
-                        if len(raw_srt) > 0:
-                            st.write(f"- 原始SRT预览: {raw_srt[:200]}...")
-                    
-                    st.success("✅ 字幕生成完成！")
-                    
-                    # 显示结果
-                    with col2:
-                        st.header("下载字幕")
-                        
-                        # 标准SRT下载
-                        st.download_button(
-                            label="📥 下载标准SRT字幕",
-                            data=standard_srt,
-                            file_name=f"{uploaded_file.name.rsplit('.', 1)[0]}.srt",
-                            mime="text/plain"
-                        )
-                        
-                        # 原始SRT下载
-                        st.download_button(
-                            label="📥 下载原始SRT字幕（调试用）",
-                            data=raw_srt,
-                            file_name=f"{uploaded_file.name.rsplit('.', 1)[0]}_raw.srt",
-                            mime="text/plain"
-                        )
-                        
-                        st.info(f"📊 共生成 {len(processed_segments)} 个字幕段")
-                    
-                    # 预览字幕
-                    st.header("字幕预览")
-                    
-                    # 选择预览类型
-                    preview_type = st.radio(
-                        "选择预览类型",
-                        ["标准字幕", "原始字幕（每个单词）"],
-                        horizontal=True
-                    )
-                    
-                    if preview_type == "标准字幕":
-                        preview_segments = processed_segments[:10]  # 只显示前10个段落
-                        st.write("**标准字幕预览（前10段）：**")
+                # 接管上传后在后台提取好的音频；快要完成时稍等片刻，否则不占着脚本线程
+                # 等待，取消后台提取，把视频交给工作进程提取
+                prefetched = None
+                if prefetch:
+                    with st.spinner("正在等待后台提取的音频..."):
+                        claimed = prefetch.claim(timeout=CLAIM_TIMEOUT)
+                    if claimed:
+                        prefetched = prefetch
                     else:
-                        # 为原始字幕创建预览段落
-                        raw_segments = []
-                        if hasattr(transcript, 'words') and transcript.words and len(transcript.words) > 0:
-                            # 使用精确的单词级时间戳（前20个单词）
-                            for word_info in transcript.words[:20]:
-                                raw_segments.append({
-                                    'text': word_info.word,
-                                    'start': word_info.start,
-                                    'end': word_info.end
-                                })
-                        else:
-                            # 回退到段落级处理
-                            segments = getattr(transcript, 'segments', [])
-                            if segments:
-                                for segment in segments[:3]:  # 只处理前3个原始段落
-                                    words = segment.text.split()
-                                    duration = segment.end - segment.start
-                                    word_duration = duration / len(words)
-                                    
-                                    for i, word in enumerate(words):
-                                        word_start = segment.start + (i * word_duration)
-                                        word_end = word_start + word_duration
-                                        raw_segments.append({
-                                            'text': word,
-                                            'start': word_start,
-                                            'end': word_end
-                                        })
-                        
-                        preview_segments = raw_segments
-                        st.write("**原始字幕预览（单词级精确时间戳）：**")
-                    
-                    for i, segment in enumerate(preview_segments, 1):
-                        # 兼容字典和对象两种格式
-                        if hasattr(segment, 'start'):
-                            # 对象格式
-                            start_time = format_timestamp(segment.start)
-                            end_time = format_timestamp(segment.end)
-                            text = segment.text
-                        else:
-                            # 字典格式
-                            start_time = format_timestamp(segment['start'])
-                            end_time = format_timestamp(segment['end'])
-                            text = segment['text']
-                        
-                        st.write(f"**{i}.** `{start_time} --> {end_time}`")
-                        st.write(f"   {text}")
-                        st.write("")
-                
+                        prefetch.cancel()
+                    st.session_state.pop('prefetch', None)
+                try:
+                    job_id = service.submit(uploaded_file, api_key, {
+                        'profile': audio_profile,
+                        'language': audio_language,
+                        'trim_silences': trim_silences,
+                        'ranges': extract_ranges,
+                        'model': model,
+                        'chunked': {"自动": None, "始终分块": True, "关闭": False}[chunk_mode],
+                        'chunk_seconds': chunk_minutes * 60,
+                        'max_workers': max_workers,
+                        'use_cache': use_cache,
+                        'stream_output': stream_output,
+                        'max_chars': max_chars,
+                    }, prefetched)
+                    # 任务 ID 写进页面链接，刷新或重新打开页面后仍能看到进度和结果
+                    st.query_params['job'] = job_id
                 except Exception as e:
-                    st.error(f"❌ 生成字幕时出错: {str(e)}")
+                    st.error(f"❌ 提交任务时出错: {str(e)}")
+                finally:
+                    if prefetched:
+                        prefetched.release()
         
         elif uploaded_file and not api_key:
             st.warning("⚠️ 请在侧边栏输入 OpenAI API Key")
         
+        # 任务在后台工作进程中运行，这里只按任务 ID 查询状态和结果
+        job_id = st.query_params.get('job')
+        job = service.status(job_id) if job_id else None
+        if job_id and job is None:
+            st.warning(f"⚠️ 找不到任务 {job_id}（可能已过期删除）")
+        elif job and job['status'] in (QUEUED, RUNNING):
+            show_job_progress(service, job_id)
+        elif job and job['status'] == DONE:
+            load_job_result(service, job)
+        elif job and job['status'] == FAILED:
+            st.error(f"❌ 生成字幕时出错: {job['error']}")
+            done_chunks, total_chunks = job['progress']
+            if total_chunks:
+                st.info(f"💾 进度已保存（已完成 {done_chunks}/{total_chunks} 块），点击重试即可从中断处继续")
+            if api_key and st.button("🔁 重试"):
+                try:
+                    service.retry(job_id, api_key)
+                except ValueError as e:
+                    # 例如另一个页面已经点了重试
+                    st.warning(f"⚠️ {e}")
+                else:
+                    st.rerun()
+        elif job and job['status'] == CANCELLED:
+            st.warning("🛑 任务已取消，需要字幕时请重新点击开始")
+        
+        transcript_stage = st.session_state.get('transcript_stage')
+        # 没有上传文件时（例如刷新页面后）也显示任务的结果
+        if transcript_stage and (not uploaded_file or transcript_stage['upload_key'] == (uploaded_file.name, uploaded_file.size)):
+            # 分段依赖 NumPy，有转录结果时才导入，不拖慢首次打开页面
+            from segmentation import build_word_arrays, segment_arrays, build_raw_preview_segments
+            from reflow import reflow_arrays
+            
+            transcript = transcript_stage['transcript']
+            run_id = transcript_stage['run_id']
+            
+            # 对齐 → 分段 → 序列化，每个阶段只在自身参数变化时重新计算
+            word_arrays = run_stage('word_arrays', run_id, lambda: build_word_arrays(transcript))
+            segment_key = (run_id, layout.key() if layout else max_chars)
+            processed_segments = run_stage(
+                'segment', segment_key,
+                lambda: reflow_arrays(*word_arrays, layout) if layout else segment_arrays(*word_arrays, max_chars)
+            )
+            
+            with col2:
+                st.header("下载字幕")
+                output_format = st.selectbox(
+                    "字幕格式",
+                    list(SUBTITLE_FORMATS),
+                    format_func=lambda key: SUBTITLE_FORMATS[key]["label"]
+                )
+            
+            # 字幕直接写入本会话的输出目录，下载时从文件读取
+            if 'output_dir' not in st.session_state:
+                st.session_state['output_dir'] = tempfile.mkdtemp(prefix="whisper_subtitles_")
+            extension = SUBTITLE_FORMATS[output_format]["extension"]
+            standard_path = os.path.join(st.session_state['output_dir'], f"standard{extension}")
+            raw_path = os.path.join(st.session_state['output_dir'], f"raw{extension}")
+            run_stage(
+                'standard_subtitles', (segment_key, output_format),
+                lambda: write_subtitles(iter_segment_cues(processed_segments), standard_path, output_format)
+            )
+            run_stage(
+                'raw_subtitles', (run_id, output_format),
+                lambda: write_subtitles(iter_word_cues(transcript), raw_path, output_format)
+            )
+            
+            # 显示结果
+            with col2:
+                base_name = transcript_stage['name'].rsplit('.', 1)[0]
+                
+                # 标准字幕下载
+                with open(standard_path, 'rb') as f:
+                    st.download_button(
+                        label=f"📥 下载标准{SUBTITLE_FORMATS[output_format]['label']}字幕",
+                        data=f,
+                        file_name=f"{base_name}{extension}",
+                        mime=SUBTITLE_FORMATS[output_format]["mime"]
+                    )
+                
+                # 原始字幕下载
+                with open(raw_path, 'rb') as f:
+                    st.download_button(
+                        label=f"📥 下载原始{SUBTITLE_FORMATS[output_format]['label']}字幕（每个单词）",
+                        data=f,
+                        file_name=f"{base_name}_raw{extension}",
+                        mime=SUBTITLE_FORMATS[output_format]["mime"]
+                    )
+                
+                st.info(f"📊 共生成 {len(processed_segments)} 个字幕段")
+            
+            # 预览字幕
+            st.header("字幕预览")
+            
+            # 选择预览类型
+            preview_type = st.radio(
+                "选择预览类型",
+                ["标准字幕", "原始字幕（每个单词）"],
+                horizontal=True
+            )
+            
+            if preview_type == "标准字幕":
+                preview_segments = processed_segments[:10]  # 只显示前10个段落
+                st.write("**标准字幕预览（前10段）：**")
+            else:
+                preview_segments = run_stage('raw_preview', run_id, lambda: build_raw_preview_segments(transcript))
+                st.write("**原始字幕预览（单词级精确时间戳）：**")
+            
+            for i, segment in enumerate(preview_segments, 1):
+                # 兼容字典和对象两种格式
+                if hasattr(segment, 'start'):
+                    # 对象格式
+                    start_time = format_timestamp(segment.start)
+                    end_time = format_timestamp(segment.end)
+                    text = segment.text
+                else:
+                    # 字典格式
+                    start_time = format_timestamp(segment['start'])
+                    end_time = format_timestamp(segment['end'])
+                    text = segment['text']
+                
+                st.write(f"**{i}.** `{start_time} --> {end_time}`")
+                # 多行字幕在 Markdown 中需要行尾两个空格才会换行
+                st.write("   " + text.replace("\n", "  \n"))
+                st.write("")
+    
+        if st.session_state.get('run_metrics'):
+            with st.expander("⏱️ 性能指标"):
+                st.write("**本次运行：**")
+                st.table(metrics_rows(st.session_state['run_metrics']))
+                st.write("**本进程累计（最近样本的 p50/p99）：**")
+                st.table(REGISTRY.summary())
+                st.download_button(
+                    label="📥 导出 Prometheus 指标",
+                    data=REGISTRY.to_prometheus(),
+                    file_name="whisper_subtitles_metrics.prom",
+                    mime="text/plain"
+                )
+        
+        with st.expander("🚦 共享队列"):
+            st.caption("所有用户共享的后台任务工作进程、ffmpeg 进程（预先提取和后台任务合计）和转录请求名额")
+            st.table(service.snapshot() + SCHEDULER.snapshot())
+        
+        with st.expander("🗄️ 转录缓存"):
+            cache_stats = get_transcript_cache().stats()
+            st.write(f"- 命中: {cache_stats['hits']}，未命中: {cache_stats['misses']}（命中率 {cache_stats['hit_rate']:.0%}）")
+            st.write(f"- 条目数: {cache_stats['entries']}，占用: {cache_stats['size_bytes'] / 1024 / 1024:.2f} MB")
+            st.write(f"- LRU 淘汰次数: {cache_stats['evictions']}")
+            if st.button("清空缓存"):
+                get_transcript_cache().clear()
+                st.rerun()
+        
+        if st.session_state.get('profile_stats'):
+            with st.expander("📊 音频编码统计"):
+                st.table(st.session_state['profile_stats'])
+        
         # 使用说明
         with st.expander("📋 使用说明"):
             st.write("""
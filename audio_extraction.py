@@ -0,0 +1,368 @@
+"""从视频文件中提取音频"""
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+from ffmpeg_backends import get_ffmpeg_exe, probe_backends
+from media_probe import STREAM_COPY_CONTAINERS, AudioStream, probe_audio_streams, probe_media, select_audio_stream
+from metrics import stage
+
+logger = logging.getLogger(__name__)
+
+# 支持的视频格式
+VIDEO_EXTENSIONS = ['mp4', 'avi', 'mov', 'mkv', 'wmv', 'flv']
+
+# 上传文件写入磁盘时每次读取的块大小
+SPOOL_CHUNK_SIZE = 8 * 1024 * 1024
+
+# 16kHz 单声道 16-bit PCM 每秒字节数，作为压缩比的基准
+PCM_BYTES_PER_SECOND = 16000 * 2
+
+# 分段并行解码：每段至少这么长（秒），更短的视频并行的启动开销不划算
+PARALLEL_MIN_RANGE_SECONDS = 60.0
+# 界面中单个视频默认的并行解码进程数
+DEFAULT_EXTRACT_RANGES = min(4, os.cpu_count() or 1)
+# 各段解码为该采样率的单声道 PCM，按采样数切分，拼接后与整段解码的采样位置一致
+_PARALLEL_SAMPLE_RATE = 16000
+# 每段从起点之前这么多采样处开始解码再丢掉，让解码器和重采样滤波器在拼接点前进入稳定状态
+_PARALLEL_PREROLL_SAMPLES = 1600
+
+# 音频提取编码方案：ffmpeg 为 ffmpeg-python 的输出参数，moviepy 为 write_audiofile 的参数
+# vn 去掉视频流，否则 Ogg/MP3/FLAC 容器会把视频（或封面图）一起编码进去
+# stream_copy 方案不解码：音轨编码可被转录接口直接接受时原样封装，否则按 fallback 方案转码
+AUDIO_PROFILES = {
+    "wav": {
+        "label": "WAV（PCM 16kHz 单声道，无压缩）",
+        "suffix": ".wav",
+        "ffmpeg": {"vn": None, "acodec": "pcm_s16le", "ac": 1, "ar": 16000},
+        "moviepy": {"codec": "pcm_s16le", "fps": 16000, "ffmpeg_params": ["-ac", "1"]},
+    },
+    "opus": {
+        "label": "Opus/OGG（单声道 24 kbps）",
+        "suffix": ".ogg",
+        # bitexact 固定 Ogg 流序列号，保证同一输入的输出字节一致（转录缓存按内容哈希）
+        "ffmpeg": {"vn": None, "acodec": "libopus", "ac": 1, "ar": 16000, "audio_bitrate": "24k", "application": "voip", "fflags": "+bitexact"},
+        "moviepy": {"codec": "libopus", "fps": 16000, "bitrate": "24k", "ffmpeg_params": ["-ac", "1", "-application", "voip", "-fflags", "+bitexact"]},
+    },
+    "mp3": {
+        "label": "MP3（单声道 32 kbps）",
+        "suffix": ".mp3",
+        "ffmpeg": {"vn": None, "acodec": "libmp3lame", "ac": 1, "ar": 16000, "audio_bitrate": "32k"},
+        "moviepy": {"codec": "libmp3lame", "fps": 16000, "bitrate": "32k", "ffmpeg_params": ["-ac", "1"]},
+    },
+    "flac": {
+        "label": "FLAC（单声道无损）",
+        "suffix": ".flac",
+        "ffmpeg": {"vn": None, "acodec": "flac", "ac": 1, "ar": 16000},
+        "moviepy": {"codec": "flac", "fps": 16000, "ffmpeg_params": ["-ac", "1"]},
+    },
+    "copy": {
+        "label": "原始音轨直接封装（不支持的编码转为 Opus）",
+        "stream_copy": True,
+        "fallback": "opus",
+    },
+}
+
+
+def transcode_profile(profile: str) -> dict:
+    """需要重新编码时实际使用的方案：直接封装的方案换成其 fallback"""
+    audio_profile = AUDIO_PROFILES[profile]
+    return AUDIO_PROFILES[audio_profile["fallback"]] if audio_profile.get("stream_copy") else audio_profile
+
+
+# 流复制的输出参数：去掉元数据并使用 bitexact，保证同一输入的输出字节一致（转录缓存按内容哈希）
+_STREAM_COPY_ARGS = {"vn": None, "acodec": "copy", "map_metadata": -1, "fflags": "+bitexact"}
+
+
+class LogReporter:
+    """没有界面时的进度输出，接口与 st.write/info/warning/success 一致"""
+
+    def write(self, message):
+        logger.debug(message)
+
+    def info(self, message):
+        logger.info(message)
+
+    def success(self, message):
+        logger.info(message)
+
+    def warning(self, message):
+        logger.warning(message)
+
+
+def spool_upload(video_file, chunk_size: int = SPOOL_CHUNK_SIZE, scratch_dir: Optional[str] = None) -> str:
+    """把上传文件按固定大小分块写入临时文件，内存占用与视频大小无关"""
+    suffix = os.path.splitext(getattr(video_file, 'name', '') or '')[1]
+    video_file.seek(0)
+    with stage('upload_spool') as record, \
+            tempfile.NamedTemporaryFile(delete=False, suffix=suffix, dir=scratch_dir) as video_temp:
+        try:
+            shutil.copyfileobj(video_file, video_temp, chunk_size)
+        except BaseException:
+            video_temp.close()
+            os.unlink(video_temp.name)
+            raise
+        record['bytes_out'] = video_temp.tell()
+        return video_temp.name
+
+
+def extract_audio_from_video(video_file, profile: str = "wav", reporter=None,
+                             language: str = None, audio_index: int = None,
+                             scratch_dir: Optional[str] = None, ranges: int = 1) -> str:
+    """从视频文件提取音频，profile 为 AUDIO_PROFILES 中的编码方案
+
+    video_file 可以是上传的文件对象或本地文件路径。上传文件只会写入磁盘
+    一次，所有备用方案共用同一个临时视频文件；本地路径则直接读取。
+    有多条音轨时按 audio_index、language（ISO 639-2，如 eng）、默认音轨的
+    顺序选择，见 media_probe.select_audio_stream。
+    reporter 用于输出进度信息（Streamlit 界面传入 st），默认写入日志。
+    scratch_dir 为任务的临时目录（scratch.ScratchJob.dir），上传落盘和提取
+    出的音频都写在其中，默认使用系统临时目录。
+    ranges 大于 1 时把长视频按时间分成多段，用多个 ffmpeg 进程并行解码后
+    拼接再统一编码（输出为单声道），见 plan_ranges。
+    """
+    reporter = reporter or LogReporter()
+    audio_profile = AUDIO_PROFILES[profile]
+    
+    owns_video = not isinstance(video_file, (str, os.PathLike))
+    video_path = spool_upload(video_file, scratch_dir=scratch_dir) if owns_video else os.fspath(video_file)
+    video_size = os.path.getsize(video_path)
+    
+    def attempt(backend: str):
+        """每个后端的尝试单独计时，成功时记录输出大小"""
+        return stage(f'extract.{backend}', bytes_in=video_size, profile=profile)
+    
+    try:
+        # 依次尝试本进程已探测到的后端：自带 ffmpeg → 系统 ffmpeg → MoviePy
+        backends = probe_backends()
+        if not backends:
+            raise Exception("No audio extraction backend available (ffmpeg or MoviePy)")
+        
+        stream = None
+        duration = None
+        if any(backend.exe for backend in backends):
+            with stage('probe_streams', bytes_in=video_size) as record:
+                duration, streams = probe_media(video_path)
+                record['items'] = len(streams)
+            if not streams:
+                raise Exception("No audio stream found in the video")
+            stream = select_audio_stream(streams, language=language, audio_index=audio_index)
+            if len(streams) > 1:
+                reporter.write(f"🎚️ Audio track {stream.describe()} (of {len(streams)})")
+        
+        if audio_profile.get("stream_copy"):
+            if stream is not None and stream.can_stream_copy:
+                audio_path = _temp_audio_path(STREAM_COPY_CONTAINERS[stream.codec], scratch_dir)
+                try:
+                    with attempt('stream_copy') as record:
+                        _copy_audio_stream(get_ffmpeg_exe(), video_path, audio_path, stream.audio_index)
+                        record['bytes_out'] = os.path.getsize(audio_path)
+                    reporter.write(f"⚡ Copied {stream.codec} audio without re-encoding")
+                    return audio_path
+                except Exception as e:
+                    os.unlink(audio_path)
+                    reporter.warning(f"⚠️ Stream copy failed, transcoding instead: {e}")
+            elif stream is not None:
+                reporter.write(f"🔧 {stream.codec} audio is not accepted as-is, transcoding")
+            audio_profile = transcode_profile(profile)
+        
+        audio_path = _temp_audio_path(audio_profile["suffix"], scratch_dir)
+        stream_index = stream.audio_index if stream is not None else None
+        
+        range_plan = plan_ranges(duration, ranges) if stream is not None and duration else []
+        if len(range_plan) > 1:
+            try:
+                with attempt('parallel') as record:
+                    _extract_parallel(get_ffmpeg_exe(), video_path, audio_path, audio_profile,
+                                      stream_index, range_plan, scratch_dir)
+                    record['items'] = len(range_plan)
+                    record['bytes_out'] = os.path.getsize(audio_path)
+                reporter.write(f"⚡ Decoded {len(range_plan)} ranges in parallel")
+                return audio_path
+            except Exception as e:
+                reporter.warning(f"⚠️ Parallel extraction failed, decoding in one pass: {e}")
+        
+        errors = []
+        for backend in backends:
+            if errors:
+                reporter.info(f"🔄 Trying {backend.label}...")
+            elif backend.exe:
+                reporter.write(f"🔧 Using ffmpeg: {backend.exe}")
+            try:
+                with attempt(backend.name) as record:
+                    if backend.exe:
+                        _extract_with_ffmpeg(backend.exe, video_path, audio_path, audio_profile, stream_index)
+                    else:
+                        _extract_with_moviepy(video_path, audio_path, audio_profile)
+                    record['bytes_out'] = os.path.getsize(audio_path)
+            except Exception as e:
+                reporter.warning(f"⚠️ {backend.label} failed: {e}")
+                errors.append(f"{backend.label}: {e}")
+                continue
+            if errors:
+                reporter.success(f"✅ {backend.label} worked!")
+            return audio_path
+        
+        if os.path.exists(audio_path):
+            os.unlink(audio_path)
+        raise Exception(f"All methods failed. {'; '.join(errors)}")
+    finally:
+        if owns_video and os.path.exists(video_path):
+            os.unlink(video_path)
+
+
+def extract_audio_tracks(video_file, profile: str = "opus", audio_indices: Optional[List[int]] = None,
+                         reporter=None, scratch_dir: Optional[str] = None) -> List[Tuple[AudioStream, str]]:
+    """一次 ffmpeg 调用提取多条音轨，返回 [(音轨, 音频路径), ...]
+
+    输入只读取、解析一次，每条音轨写到各自的输出文件。audio_indices 为
+    音频流序号列表，None 表示全部音轨。直接封装的方案对每条音轨单独判断
+    能否流复制。需要 ffmpeg，不支持 MoviePy。
+    """
+    import ffmpeg
+
+    reporter = reporter or LogReporter()
+    owns_video = not isinstance(video_file, (str, os.PathLike))
+    video_path = spool_upload(video_file, scratch_dir=scratch_dir) if owns_video else os.fspath(video_file)
+    video_size = os.path.getsize(video_path)
+    outputs = []
+    try:
+        with stage('probe_streams', bytes_in=video_size) as record:
+            streams = probe_audio_streams(video_path)
+            record['items'] = len(streams)
+        if not streams:
+            raise Exception("No audio stream found in the video")
+        if audio_indices is not None:
+            missing = [i for i in audio_indices if not 0 <= i < len(streams)]
+            if missing:
+                raise ValueError(f"音轨序号 {missing} 超出范围（共 {len(streams)} 条音轨）")
+            streams = [streams[i] for i in audio_indices]
+        
+        source = ffmpeg.input(video_path)
+        for stream in streams:
+            if AUDIO_PROFILES[profile].get("stream_copy") and stream.can_stream_copy:
+                suffix, output_args = STREAM_COPY_CONTAINERS[stream.codec], _STREAM_COPY_ARGS
+            else:
+                audio_profile = transcode_profile(profile)
+                suffix, output_args = audio_profile["suffix"], audio_profile["ffmpeg"]
+            audio_path = _temp_audio_path(suffix, scratch_dir)
+            outputs.append((stream, audio_path, ffmpeg.output(source[f"a:{stream.audio_index}"], audio_path, **output_args)))
+        
+        reporter.write(f"🎚️ Extracting {len(streams)} audio tracks: {', '.join(s.describe() for s in streams)}")
+        with stage('extract.multi_track', bytes_in=video_size, profile=profile, items=len(outputs)) as record:
+            ffmpeg.run(ffmpeg.merge_outputs(*[output for _, _, output in outputs]),
+                       cmd=get_ffmpeg_exe(), quiet=True, overwrite_output=True)
+            record['bytes_out'] = sum(os.path.getsize(path) for _, path, _ in outputs)
+        return [(stream, path) for stream, path, _ in outputs]
+    except BaseException:
+        for _, path, _ in outputs:
+            if os.path.exists(path):
+                os.unlink(path)
+        raise
+    finally:
+        if owns_video and os.path.exists(video_path):
+            os.unlink(video_path)
+
+
+def plan_ranges(duration: float, ranges: int,
+                min_range_seconds: float = PARALLEL_MIN_RANGE_SECONDS) -> List[Tuple[int, Optional[int]]]:
+    """把 [0, duration) 按采样数均分为最多 ranges 段，返回 [(起始采样, 采样数), ...]
+
+    最后一段的采样数为 None（解码到结尾），容器头中的时长不精确时也不会丢掉尾部。
+    """
+    count = max(1, min(ranges, int(duration // min_range_seconds)))
+    total = int(round(duration * _PARALLEL_SAMPLE_RATE))
+    bounds = [total * i // count for i in range(count + 1)]
+    return [(bounds[i], bounds[i + 1] - bounds[i] if i < count - 1 else None) for i in range(count)]
+
+
+def _extract_parallel(ffmpeg_exe: str, video_path: str, audio_path: str, audio_profile: dict,
+                      stream_index: int, range_plan: List[Tuple[int, Optional[int]]],
+                      scratch_dir: Optional[str] = None) -> None:
+    """各段并行解码为 PCM，按顺序首尾相接送入一个编码进程
+
+    每段从起始采样前一小段处定位（输入端 -ss），atrim 丢掉预解码的部分并
+    截取精确的采样数。容器时间戳精确到采样时（如 MP4），拼接处不重复也不
+    缺采样；Matroska 的时间戳只精确到毫秒，后面的段可能整体错开几个采样
+    （16 kHz 下不到 1 毫秒）。定位后解码器的状态与整段解码不同（例如 AAC
+    噪声替代的随机数），输出不保证与整段解码逐采样一致。编码进程与解码
+    并行，前面的段一完成就开始编码。
+    """
+    import ffmpeg
+
+    part_dir = tempfile.mkdtemp(prefix="ranges_", dir=scratch_dir)
+
+    def decode(index: int) -> str:
+        start, count = range_plan[index]
+        part_path = os.path.join(part_dir, f"part_{index:03d}.pcm")
+        preroll = min(start, _PARALLEL_PREROLL_SAMPLES)
+        audio_filter = f"aresample=osr={_PARALLEL_SAMPLE_RATE}:ochl=mono,atrim=start_sample={preroll}"
+        if count is not None:
+            audio_filter += f":end_sample={preroll + count}"
+        # 第一段不定位：-ss 0 会改变起始时间戳的处理，与整段解码相差几个采样
+        seek = {"ss": f"{(start - preroll) / _PARALLEL_SAMPLE_RATE:.7f}"} if start else {}
+        stream = ffmpeg.input(video_path, **seek)[f"a:{stream_index}"]
+        stream = ffmpeg.output(stream, part_path, af=audio_filter, ac=1, acodec="pcm_s16le", format="s16le")
+        ffmpeg.run(stream, cmd=ffmpeg_exe, quiet=True, overwrite_output=True)
+        return part_path
+
+    encoder = ffmpeg.input("pipe:", format="s16le", ar=_PARALLEL_SAMPLE_RATE, ac=1)
+    encoder = ffmpeg.output(encoder, audio_path, **audio_profile["ffmpeg"]).global_args("-loglevel", "error")
+    try:
+        with ThreadPoolExecutor(max_workers=len(range_plan)) as pool:
+            futures = [pool.submit(decode, index) for index in range(len(range_plan))]
+            process = subprocess.Popen(ffmpeg.compile(encoder, cmd=ffmpeg_exe, overwrite_output=True),
+                                       stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            try:
+                for future in futures:
+                    part_path = future.result()
+                    with open(part_path, 'rb') as part:
+                        shutil.copyfileobj(part, process.stdin, SPOOL_CHUNK_SIZE)
+                    os.unlink(part_path)
+            finally:
+                process.stdin.close()
+                stderr = process.stderr.read().decode("utf-8", errors="replace")
+                process.wait()
+            if process.returncode != 0:
+                raise RuntimeError(f"ffmpeg encoder failed ({process.returncode}): {stderr[-500:]}")
+    finally:
+        shutil.rmtree(part_dir, ignore_errors=True)
+
+
+def _temp_audio_path(suffix: str, scratch_dir: Optional[str] = None) -> str:
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix, dir=scratch_dir) as audio_file:
+        return audio_file.name
+
+
+def _copy_audio_stream(ffmpeg_exe: str, video_path: str, audio_path: str, stream_index: int) -> None:
+    """不解码，把第 stream_index 条音轨原样封装到 audio_path 对应的容器中"""
+    import ffmpeg
+    stream = ffmpeg.input(video_path)[f"a:{stream_index}"]
+    stream = ffmpeg.output(stream, audio_path, **_STREAM_COPY_ARGS)
+    ffmpeg.run(stream, cmd=ffmpeg_exe, quiet=True, overwrite_output=True)
+
+
+def _extract_with_ffmpeg(ffmpeg_exe: str, video_path: str, audio_path: str, audio_profile: dict,
+                         stream_index: int = None) -> None:
+    import ffmpeg
+    stream = ffmpeg.input(video_path)
+    if stream_index is not None:
+        stream = stream[f"a:{stream_index}"]
+    stream = ffmpeg.output(stream, audio_path, **audio_profile["ffmpeg"])
+    ffmpeg.run(stream, cmd=ffmpeg_exe, quiet=True, overwrite_output=True)
+
+
+def _extract_with_moviepy(video_path: str, audio_path: str, audio_profile: dict) -> None:
+    # MoviePy 导入很慢，只在前两种方案都失败时才导入
+    from moviepy.editor import VideoFileClip
+    video_clip = VideoFileClip(video_path)
+    audio_clip = video_clip.audio
+    try:
+        audio_clip.write_audiofile(audio_path, verbose=False, logger=None, **audio_profile["moviepy"])
+    finally:
+        audio_clip.close()
+        video_clip.close()
@@ -0,0 +1,117 @@
+"""对比单词时间戳对齐的旧实现与线性对齐引擎
+
+用法：python benchmarks/bench_alignment.py [--sizes 1000 10000 100000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from alignment import align_words_to_segments  # noqa: E402
+
+# 小词表 + 高频词，模拟重复性很强的口语
+VOCAB = ['the', 'and', 'so', 'you', 'know', 'like', 'I', 'mean', 'it', 'is', 'really', 'okay', 'right', 'yeah']
+
+
+def make_transcript(num_words: int, words_per_segment: int = 20, drop_rate: float = 0.01, seed: int = 0):
+    """生成合成的 words / segments
+
+    以 drop_rate 的概率从 words 中丢掉单词，模拟 API 返回的单词级
+    时间戳偶尔缺词的情况。返回 (完整单词, 提供给对齐的单词, segments)。
+    """
+    rng = random.Random(seed)
+    words = []
+    t = 0.0
+    for _ in range(num_words):
+        duration = rng.uniform(0.15, 0.5)
+        words.append(SimpleNamespace(word=rng.choice(VOCAB), start=t, end=t + duration))
+        t += duration + rng.uniform(0.0, 0.2)
+
+    segments = []
+    for i in range(0, num_words, words_per_segment):
+        chunk = words[i:i + words_per_segment]
+        tokens = [w.word for w in chunk]
+        tokens[-1] += '.'
+        segments.append(SimpleNamespace(text=' ' + ' '.join(tokens), start=chunk[0].start, end=chunk[-1].end))
+    kept = [w for w in words if rng.random() >= drop_rate]
+    return words, kept, segments
+
+
+def legacy_align(words, segments):
+    """旧版 main() 中基于字典 + used 标记的匹配方式"""
+    words_timing = {}
+    for word_info in words:
+        word_key = word_info.word.strip()
+        words_timing.setdefault(word_key, []).append(
+            {'start': word_info.start, 'end': word_info.end, 'used': False}
+        )
+
+    aligned = []
+    for segment in segments:
+        segment_words = segment.text.strip().split()
+        word_timings = []
+        for word in segment_words:
+            clean_word = word.strip('.,!?;:"()[]')
+            found_timing = None
+            if clean_word in words_timing:
+                for timing_info in words_timing[clean_word]:
+                    if not timing_info['used']:
+                        found_timing = timing_info
+                        timing_info['used'] = True
+                        break
+            if found_timing:
+                word_timings.append({'word': word, 'start': found_timing['start'], 'end': found_timing['end']})
+            else:
+                word_index = segment_words.index(word)
+                word_duration = (segment.end - segment.start) / len(segment_words)
+                start = segment.start + word_index * word_duration
+                word_timings.append({'word': word, 'start': start, 'end': start + word_duration})
+        aligned.append(word_timings)
+    return aligned
+
+
+def exact_ratio(truth, kept, aligned):
+    """在未被丢掉的单词中，对齐结果与真实时间戳完全一致的比例"""
+    kept_ids = {id(w) for w in kept}
+    flat = [t for seg in aligned for t in seg]
+    pairs = [(w, t) for w, t in zip(truth, flat) if id(w) in kept_ids]
+    hits = sum(1 for w, t in pairs if w.start == t['start'] and w.end == t['end'])
+    return hits / max(len(pairs), 1)
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - started, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--legacy-max', type=int, default=20000,
+                        help='超过该单词数时跳过旧实现（其耗时呈平方增长）')
+    parser.add_argument('--drop-rate', type=float, default=0.01,
+                        help='从单词级时间戳中随机丢掉单词的比例')
+    args = parser.parse_args()
+
+    print(f"{'words':>8}  {'legacy (s)':>11}  {'linear (s)':>11}  {'speedup':>8}  {'legacy exact':>12}  {'linear exact':>12}")
+    for size in args.sizes:
+        truth, words, segments = make_transcript(size, drop_rate=args.drop_rate)
+        linear_seconds, linear_result = timed(align_words_to_segments, words, segments)
+        if size <= args.legacy_max:
+            legacy_seconds, legacy_result = timed(legacy_align, words, segments)
+            speedup = f"{legacy_seconds / linear_seconds:.1f}x"
+            legacy_exact = f"{exact_ratio(truth, words, legacy_result):.1%}"
+            legacy_cell = f"{legacy_seconds:.3f}"
+        else:
+            legacy_cell, speedup, legacy_exact = 'skipped', '-', '-'
+        print(f"{size:>8}  {legacy_cell:>11}  {linear_seconds:>11.3f}  {speedup:>8}  "
+              f"{legacy_exact:>12}  {exact_ratio(truth, words, linear_result):>12.1%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+"""端到端基准测试：合成视频 → 音频提取 → 转录（本地模拟接口）→ 分段 → SRT
+
+用 ffmpeg 生成不同时长和编码的合成视频，依次经过各阶段，报告每个阶段的
+延迟、吞吐量（音频秒/秒）和峰值内存，便于在上线前发现某个阶段的性能回退。
+
+用法：
+    python benchmarks/bench_e2e.py --durations 60 600 --codecs h264_aac mpeg4_mp3 --profiles wav opus
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from audio_extraction import AUDIO_PROFILES, extract_audio_from_video  # noqa: E402
+from benchmarks.fake_whisper_server import FakeWhisperServer  # noqa: E402
+from segmentation import segment_transcript  # noqa: E402
+from subtitles import generate_raw_srt, generate_srt  # noqa: E402
+from transcription import get_ffmpeg_exe, probe_duration, transcribe_audio  # noqa: E402
+
+# 合成视频的编码组合：(扩展名, 视频编码参数, 音频编码参数)
+CODECS = {
+    'h264_aac': ('mp4', ['-c:v', 'libx264', '-preset', 'ultrafast'], ['-c:a', 'aac', '-b:a', '128k']),
+    'mpeg4_mp3': ('avi', ['-c:v', 'mpeg4'], ['-c:a', 'libmp3lame', '-b:a', '128k']),
+    'vp9_opus': ('mkv', ['-c:v', 'libvpx-vp9', '-deadline', 'realtime', '-cpu-used', '8'], ['-c:a', 'libopus', '-b:a', '96k']),
+}
+
+
+def make_video(path: str, duration: float, codec: str) -> str:
+    """生成带语音频段噪声和周期性静音的小分辨率合成视频"""
+    _, video_args, audio_args = CODECS[codec]
+    # 粉红噪声按 10 秒周期开关，模拟说话与停顿，便于静音检测切分
+    audio_filter = (
+        f"anoisesrc=color=pink:amplitude=0.3:sample_rate=44100:duration={duration},"
+        "volume='if(lt(mod(t,10),8.5),1,0)':eval=frame,aformat=channel_layouts=stereo"
+    )
+    subprocess.run(
+        [get_ffmpeg_exe(), '-hide_banner', '-loglevel', 'error', '-y',
+         '-f', 'lavfi', '-i', f'testsrc2=size=160x120:rate=10:duration={duration}',
+         '-f', 'lavfi', '-i', audio_filter,
+         *video_args, *audio_args, '-shortest', path],
+        check=True,
+    )
+    return path
+
+
+def max_rss_mb() -> tuple:
+    """(本进程, 已结束子进程) 的峰值常驻内存（MB）"""
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale)
+
+
+class StageTimer:
+    """记录每个阶段的耗时和 Python 堆内存峰值"""
+
+    def __init__(self):
+        self.results = {}
+
+    def run(self, name: str, func, *args, **kwargs):
+        tracemalloc.start()
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            self.results[name] = {'seconds': elapsed, 'py_peak_mb': peak / 1024 / 1024}
+
+
+def bench_one(client, video_path: str, profile: str, max_chars: int, max_workers: int) -> dict:
+    timer = StageTimer()
+    audio_path = timer.run('extract', extract_audio_from_video, video_path, profile)
+    try:
+        duration = probe_duration(audio_path)
+        audio_bytes = os.path.getsize(audio_path)
+        transcript = timer.run('transcribe', transcribe_audio, client, audio_path, max_workers=max_workers)
+    finally:
+        os.unlink(audio_path)
+    segments = timer.run('segment', segment_transcript, transcript, max_chars)
+    srt = timer.run('srt', generate_srt, segments)
+    raw_srt = timer.run('raw_srt', generate_raw_srt, transcript)
+
+    for stage in timer.results.values():
+        stage['audio_x_realtime'] = duration / max(stage['seconds'], 1e-9)
+    return {
+        'audio_seconds': duration,
+        'audio_bytes': audio_bytes,
+        'words': len(transcript.words),
+        'segments': len(segments),
+        'srt_chars': len(srt),
+        'raw_srt_chars': len(raw_srt),
+        'stages': timer.results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='端到端基准测试（本地模拟 Whisper 接口）')
+    parser.add_argument('--durations', type=float, nargs='+', default=[30, 300])
+    parser.add_argument('--codecs', nargs='+', choices=list(CODECS), default=['h264_aac'])
+    parser.add_argument('--profiles', nargs='+', choices=list(AUDIO_PROFILES), default=['wav', 'opus'])
+    parser.add_argument('--latency', type=float, default=0.2, help='模拟接口每个请求的固定延迟（秒）')
+    parser.add_argument('--latency-per-minute', type=float, default=0.1, help='每分钟音频额外增加的延迟（秒）')
+    parser.add_argument('--max-chars', type=int, default=26)
+    parser.add_argument('--max-workers', type=int, default=4, help='分块转录的并发请求数')
+    parser.add_argument('--json', help='把结果写入 JSON 文件，便于比较不同版本')
+    args = parser.parse_args()
+
+    from openai import OpenAI
+
+    work_dir = tempfile.mkdtemp(prefix='whisper_bench_')
+    rows = []
+    try:
+        with FakeWhisperServer(latency=args.latency, latency_per_minute=args.latency_per_minute) as server:
+            client = OpenAI(api_key='benchmark', base_url=server.base_url, max_retries=0)
+            for codec in args.codecs:
+                for duration in args.durations:
+                    ext = CODECS[codec][0]
+                    video = make_video(os.path.join(work_dir, f'{codec}_{int(duration)}.{ext}'), duration, codec)
+                    for profile in args.profiles:
+                        result = bench_one(client, video, profile, args.max_chars, args.max_workers)
+                        result.update({'codec': codec, 'duration': duration, 'profile': profile,
+                                       'video_bytes': os.path.getsize(video)})
+                        rows.append(result)
+                        print(f"\n== {codec} {duration:.0f}s profile={profile} "
+                              f"audio={result['audio_bytes'] / 1024 / 1024:.2f} MB "
+                              f"words={result['words']} segments={result['segments']}")
+                        print(f"   {'stage':<11}{'seconds':>10}{'x realtime':>13}{'py peak MB':>12}")
+                        for name, stage in result['stages'].items():
+                            print(f"   {name:<11}{stage['seconds']:>10.3f}{stage['audio_x_realtime']:>13.1f}"
+                                  f"{stage['py_peak_mb']:>12.2f}")
+            requests, uploaded = server.requests, server.bytes_received
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    self_rss, child_rss = max_rss_mb()
+    print(f"\n峰值 RSS: 本进程 {self_rss:.1f} MB，ffmpeg 子进程 {child_rss:.1f} MB；"
+          f"接口请求 {requests} 次，上传 {uploaded / 1024 / 1024:.2f} MB")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'runs': rows, 'peak_rss_mb': {'self': self_rss, 'children': child_rss},
+                       'requests': requests, 'uploaded_bytes': uploaded}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
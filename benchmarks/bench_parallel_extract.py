@@ -0,0 +1,68 @@
+"""并行分段解码基准测试：同一个视频分成不同段数提取音频的耗时，并检查输出
+
+各段数的输出解码为 PCM，报告采样数、与第一项相比不同的采样个数和最大差值。
+单段走整段解码路径，多段与它并不逐采样一致，差值取决于源文件：
+- MP4/AAC 的纯音调：拼接处一致，只有文件末尾约 20 毫秒不同（最大差值 13）；
+- AAC 编码的噪声类内容：定位后解码器的噪声替代与整段解码不同，差值可达上百；
+- Matroska：时间戳只精确到毫秒，后面的段整体错开几个采样；
+- 语音类 MP4 源用无损方案（wav/flac）时，只有舍入差异，实测差值为 0 或 1。
+采样数应与单段一致（Matroska 可能差几个），不同的采样应只出现在拼接处之后。
+
+用法：
+    python benchmarks/bench_parallel_extract.py long.mp4 --profile opus --ranges 1 2 4
+"""
+import argparse
+import array
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def decode_pcm(path: str) -> array.array:
+    from ffmpeg_backends import get_ffmpeg_exe
+
+    output = subprocess.run([get_ffmpeg_exe(), "-v", "error", "-i", path, "-f", "s16le", "-ac", "1", "-"],
+                            capture_output=True, check=True).stdout
+    return array.array("h", output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="并行分段解码基准测试")
+    parser.add_argument("video", help="测试用的视频文件，建议 10 分钟以上")
+    parser.add_argument("--profile", default="opus", help="音频编码方案（不能是直接封装方案）")
+    parser.add_argument("--ranges", nargs="+", type=int, default=[1, 2, 4], help="要比较的段数")
+    parser.add_argument("--repeat", type=int, default=3, help="每种段数的重复次数，取最小值")
+    args = parser.parse_args()
+
+    from audio_extraction import extract_audio_from_video, plan_ranges
+    from media_probe import probe_media
+
+    duration, _ = probe_media(args.video)
+    print(f"视频时长 {duration:.1f} 秒，CPU 核数 {os.cpu_count()}")
+    reference = None
+    baseline = None
+    for ranges in args.ranges:
+        timings = []
+        pcm = None
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            audio_path = extract_audio_from_video(args.video, args.profile, ranges=ranges)
+            timings.append(time.perf_counter() - started)
+            if pcm is None:
+                pcm = decode_pcm(audio_path)
+            os.unlink(audio_path)
+        best = min(timings)
+        baseline = baseline or best
+        reference = reference or pcm
+        deltas = [abs(a - b) for a, b in zip(pcm, reference)]
+        differing = sum(d > 0 for d in deltas) + abs(len(pcm) - len(reference))
+        print(f"{len(plan_ranges(duration, ranges))} 段: {best:.2f} 秒（加速 {baseline / best:.2f}x），"
+              f"{len(pcm)} 个采样，与第一项不同 {differing} 个（最大差值 {max(deltas, default=0)}）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""对比逐段贪心分段与动态规划重排：耗时和排版质量
+
+质量指标：
+- 句末断开：以句子结尾结束的字幕段比例（越高越好）
+- 短尾巴：只有 1-2 个单词的字幕段比例（越低越好）
+- 超速：阅读速度超过上限的字幕段比例（越低越好）
+- 行宽标准差：各行字符数的标准差（越低越整齐）
+
+用法：python benchmarks/bench_reflow.py [--sizes 1000 10000 100000]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from reflow import LayoutRules, reflow_arrays  # noqa: E402
+from segmentation import build_word_arrays, segment_arrays  # noqa: E402
+
+VOCAB = ['the', 'and', 'so', 'you', 'know', 'like', 'I', 'mean', 'it', 'is', 'really', 'okay', 'right',
+         'people', 'model', 'because', 'actually', 'important', 'something', 'different', 'what', 'we']
+
+
+def make_transcript(num_words: int, seed: int = 0):
+    """生成带句子结构（大写句首、逗号、句号）和自然停顿的合成转录结果"""
+    rng = random.Random(seed)
+    words = []
+    t = 0.0
+    sentence_left = 0
+    for _ in range(num_words):
+        word = rng.choice(VOCAB)
+        if sentence_left == 0:
+            sentence_left = rng.randint(4, 25)
+            word = word.capitalize()
+        sentence_left -= 1
+        pause = rng.uniform(0.0, 0.15)
+        if sentence_left == 0:
+            word += '.'
+            pause += rng.uniform(0.2, 1.5)
+        elif rng.random() < 0.08:
+            word += ','
+            pause += rng.uniform(0.1, 0.4)
+        duration = 0.08 + 0.05 * len(word)
+        words.append(SimpleNamespace(word=word, start=t, end=t + duration))
+        t += duration + pause
+    # 每 30 个单词一个 API segment
+    segments = []
+    for i in range(0, num_words, 30):
+        chunk = words[i:i + 30]
+        segments.append(SimpleNamespace(text=' ' + ' '.join(w.word for w in chunk),
+                                        start=chunk[0].start, end=chunk[-1].end))
+    return SimpleNamespace(words=words, segments=segments)
+
+
+def quality(segments, max_cps: float) -> dict:
+    lines = [len(line) for s in segments for line in s.text.split('\n')]
+    word_counts = [len(s.text.split()) for s in segments]
+    speeds = [len(s.text) / max(s.end - s.start, 1e-3) for s in segments]
+    return {
+        'cues': len(segments),
+        'sentence_end': sum(s.text.endswith(('.', '!', '?')) for s in segments) / len(segments),
+        'short': sum(c <= 2 for c in word_counts) / len(segments),
+        'too_fast': sum(v > max_cps for v in speeds) / len(segments),
+        'line_std': statistics.pstdev(lines),
+    }
+
+
+def timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="贪心分段与动态规划重排对比")
+    parser.add_argument("--sizes", nargs="+", type=int, default=[1000, 10000, 100000])
+    parser.add_argument("--max-chars", type=int, default=42, help="重排的每行字符数（贪心分段为每段字符数）")
+    args = parser.parse_args()
+
+    rules = LayoutRules(max_chars=args.max_chars)
+    print(f"{'单词数':>8} {'方法':<6} {'耗时(ms)':>9} {'段数':>7} {'句末断开':>8} {'短尾巴':>7} {'超速':>7} {'行宽标准差':>9}")
+    for size in args.sizes:
+        arrays, segment_last = build_word_arrays(make_transcript(size))
+        runs = [
+            ('贪心', lambda: segment_arrays(arrays, segment_last, args.max_chars)),
+            ('重排', lambda: reflow_arrays(arrays, segment_last, rules)),
+        ]
+        for name, fn in runs:
+            segments, seconds = timed(fn)
+            q = quality(segments, rules.max_cps)
+            print(f"{size:>8} {name:<6} {seconds * 1000:>9.1f} {q['cues']:>7} {q['sentence_end']:>8.1%} "
+                  f"{q['short']:>7.1%} {q['too_fast']:>7.1%} {q['line_std']:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
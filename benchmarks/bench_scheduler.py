@@ -0,0 +1,101 @@
+"""多个会话同时转录时，各自直接请求与经过共享调度器的对比
+
+模拟服务按时间窗口限流（超出返回 429）。每个会话像分块转录一样用线程池
+并发发出若干请求：
+- 直接请求：每个会话各自创建客户端，只靠 call_with_retries 的指数退避；
+- 共享调度器：所有会话共用客户端，请求按会话轮流经过令牌桶限流。
+
+报告总耗时、服务端返回 429 的次数、失败的请求数，以及各会话完成时间的
+中位数和最大值。
+
+用法：
+    python benchmarks/bench_scheduler.py --sessions 10 --requests 6 --rate-limit 20 --rate-window 5
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_whisper_server import FakeWhisperServer  # noqa: E402
+from ffmpeg_backends import get_ffmpeg_exe  # noqa: E402
+from scheduler import Scheduler  # noqa: E402
+from transcription import request_transcription  # noqa: E402
+
+
+def make_audio(path: str, seconds: float = 1.0) -> str:
+    subprocess.run([get_ffmpeg_exe(), "-v", "error", "-f", "lavfi", "-i", f"sine=frequency=440:duration={seconds}",
+                    "-ar", "16000", "-y", path], check=True)
+    return path
+
+
+def run_sessions(sessions: int, requests: int, workers: int, make_client, make_gate, audio_path: str) -> dict:
+    """所有会话同时开始，返回各会话的完成时间和失败的请求数"""
+    started = time.perf_counter()
+    failures = []
+
+    def session(index: int) -> float:
+        client, gate = make_client(), make_gate(f"session-{index}")
+
+        def one(_):
+            try:
+                request_transcription(client, audio_path, gate=gate, audio_seconds=1.0)
+            except Exception as e:
+                failures.append(e)
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(one, range(requests)))
+        return time.perf_counter() - started
+
+    with ThreadPoolExecutor(max_workers=sessions) as pool:
+        finished = list(pool.map(session, range(sessions)))
+    return {'elapsed': time.perf_counter() - started, 'finished': finished, 'failed': len(failures)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="共享调度器对比基准测试")
+    parser.add_argument("--sessions", type=int, default=10, help="同时开始的会话数")
+    parser.add_argument("--requests", type=int, default=6, help="每个会话的请求数（分块数）")
+    parser.add_argument("--workers", type=int, default=4, help="每个会话的并发请求数")
+    parser.add_argument("--rate-limit", type=int, default=20, help="模拟服务每个时间窗口接受的请求数")
+    parser.add_argument("--rate-window", type=float, default=5.0, help="模拟服务限流的时间窗口（秒）")
+    parser.add_argument("--latency", type=float, default=0.2, help="模拟服务每个请求的延迟（秒）")
+    args = parser.parse_args()
+
+    from openai import OpenAI
+
+    with tempfile.TemporaryDirectory() as tmp:
+        audio_path = make_audio(os.path.join(tmp, "tone.wav"))
+        print(f"{'方式':<10} {'总耗时(s)':>9} {'429 次数':>8} {'失败':>5} {'完成时间中位数(s)':>16} {'最大(s)':>8}")
+        for name in ("直接请求", "共享调度器"):
+            with FakeWhisperServer(latency=args.latency, rate_limit=args.rate_limit,
+                                   rate_window=args.rate_window) as server:
+                if name == "直接请求":
+                    def make_client():
+                        return OpenAI(api_key="benchmark", base_url=server.base_url, max_retries=0)
+
+                    def make_gate(owner):
+                        return None
+                else:
+                    # 限流设置略低于服务端的真实上限，留出余量
+                    scheduler = Scheduler(requests_per_minute=args.rate_limit * 60 / args.rate_window * 0.9,
+                                          audio_seconds_per_minute=0, max_requests=args.workers * 2)
+
+                    def make_client():
+                        return scheduler.client("benchmark", base_url=server.base_url)
+
+                    make_gate = scheduler.gate
+                result = run_sessions(args.sessions, args.requests, args.workers, make_client, make_gate, audio_path)
+                print(f"{name:<10} {result['elapsed']:>9.1f} {server.rate_limited:>8} {result['failed']:>5} "
+                      f"{statistics.median(result['finished']):>16.1f} {max(result['finished']):>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
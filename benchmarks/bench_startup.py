@@ -0,0 +1,119 @@
+"""启动时间基准测试：冷启动导入、首次脚本运行和每次重新运行的耗时
+
+Streamlit 每次交互都会重新执行 app.py，这里分别测量：
+- 冷启动：新进程中 import app 的耗时，以及 app 直接导入的各模块的累计耗时；
+- 脚本运行：用 streamlit.testing 的 AppTest 执行一次页面脚本（首次）和多次重新运行；
+- 后端探测：首次探测音频提取后端和之后读取缓存的耗时。
+
+用法：
+    python benchmarks/bench_startup.py --runs 5 --reruns 20
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_IMPORT_SNIPPET = "import time; t = time.perf_counter(); import app; print(time.perf_counter() - t)"
+_IMPORTTIME_RE = re.compile(r"import time:\s+\d+ \|\s+(\d+) \|( +)(\S+)")
+
+
+def cold_import_seconds(runs: int) -> list:
+    """每次在新进程中导入 app，返回各次耗时（秒）"""
+    timings = []
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, "-c", _IMPORT_SNIPPET], cwd=ROOT,
+                                capture_output=True, text=True, check=True)
+        timings.append(float(result.stdout.strip().splitlines()[-1]))
+    return timings
+
+
+def import_breakdown(top: int = 10) -> list:
+    """python -X importtime 中 app 直接导入的模块，按累计耗时（毫秒）从大到小"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"], cwd=ROOT,
+                            capture_output=True, text=True, check=True)
+    # 输出中子模块排在父模块之前：顶层模块缩进 1 个空格，其直接导入的模块缩进 3 个空格
+    children = []
+    for line in result.stderr.splitlines():
+        match = _IMPORTTIME_RE.match(line)
+        if not match:
+            continue
+        depth = len(match.group(2))
+        if depth == 3:
+            children.append((match.group(3), int(match.group(1)) / 1000))
+        elif depth == 1:
+            if match.group(3) == "app":
+                return sorted(children, key=lambda m: -m[1])[:top]
+            children = []
+    return []
+
+
+def script_run_seconds(reruns: int) -> tuple:
+    """(首次运行耗时, 每次重新运行的耗时列表)"""
+    from streamlit.testing.v1 import AppTest
+
+    started = time.perf_counter()
+    app_test = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=60).run()
+    first = time.perf_counter() - started
+    timings = []
+    for _ in range(reruns):
+        started = time.perf_counter()
+        app_test.run()
+        timings.append(time.perf_counter() - started)
+    if app_test.exception:
+        raise RuntimeError(f"app.py 运行出错: {app_test.exception}")
+    return first, timings
+
+
+def backend_probe_seconds() -> tuple:
+    """(首次探测耗时, 读取缓存耗时, 后端列表)"""
+    from ffmpeg_backends import probe_backends
+
+    started = time.perf_counter()
+    backends = probe_backends()
+    first = time.perf_counter() - started
+    started = time.perf_counter()
+    probe_backends()
+    cached = time.perf_counter() - started
+    return first, cached, [b.name for b in backends]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="启动时间基准测试")
+    parser.add_argument("--runs", type=int, default=5, help="冷启动导入的重复次数")
+    parser.add_argument("--reruns", type=int, default=20, help="脚本重新运行的次数")
+    parser.add_argument("--json", help="把结果写入 JSON 文件，便于比较不同版本")
+    args = parser.parse_args()
+
+    imports = cold_import_seconds(args.runs)
+    print(f"冷启动 import app: 中位数 {statistics.median(imports) * 1000:.0f} ms，"
+          f"最小 {min(imports) * 1000:.0f} ms（{args.runs} 次）")
+    breakdown = import_breakdown()
+    for name, ms in breakdown:
+        print(f"   {name:<24}{ms:>8.1f} ms")
+
+    probe_first, probe_cached, backends = backend_probe_seconds()
+    print(f"后端探测: 首次 {probe_first * 1000:.1f} ms，缓存 {probe_cached * 1000:.3f} ms（{', '.join(backends) or '无'}）")
+
+    first_run, reruns = script_run_seconds(args.reruns)
+    print(f"脚本运行: 首次 {first_run * 1000:.0f} ms，重新运行中位数 {statistics.median(reruns) * 1000:.1f} ms，"
+          f"p90 {sorted(reruns)[int(len(reruns) * 0.9) - 1] * 1000:.1f} ms（{args.reruns} 次）")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({
+                'cold_import_s': imports,
+                'import_breakdown_ms': dict(breakdown),
+                'backend_probe_s': {'first': probe_first, 'cached': probe_cached, 'backends': backends},
+                'script_run_s': {'first': first_run, 'reruns': reruns},
+            }, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+"""本地模拟的 OpenAI 兼容转录接口，用于离线基准测试
+
+实现 POST /v1/audio/transcriptions：根据上传音频的实际时长生成逼真的
+verbose_json（含单词级和段落级时间戳），并按配置模拟服务端延迟、随机
+失败和限流（429）。
+
+独立运行：python benchmarks/fake_whisper_server.py --port 8765 --latency 0.5
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from transcription import probe_duration  # noqa: E402
+
+VOCAB = (
+    'we are going to look at how the model learns from data and why this matters for '
+    'everyone who works with audio signals every day so let us start with a simple example'
+).split()
+ABBREVIATIONS = ['Dr.', 'Mr.', 'etc.']
+
+
+def fake_verbose_json(duration: float, words_per_second: float = 2.5, seed: int = 0) -> dict:
+    """生成时长为 duration 的 verbose_json：单词间有短停顿和偶尔的长停顿，句子以大写开头、标点结尾"""
+    rng = random.Random(seed)
+    words = []
+    segments = []
+    t = 0.0
+    sentence_left = 0
+    segment_words = []
+    mean_word = 1.0 / words_per_second
+
+    while True:
+        length = rng.uniform(0.5, 1.2) * mean_word * 0.8
+        if t + length > duration:
+            break
+        if sentence_left == 0:
+            sentence_left = rng.randint(5, 18)
+            token = rng.choice(VOCAB).capitalize()
+            if rng.random() < 0.05:
+                token = rng.choice(ABBREVIATIONS)
+        else:
+            token = rng.choice(VOCAB)
+        sentence_left -= 1
+        text = token + ('.' if sentence_left == 0 else (',' if rng.random() < 0.08 else ''))
+
+        # verbose_json 中单词不带标点，段落文本带标点
+        words.append({'word': token.rstrip('.'), 'start': round(t, 3), 'end': round(t + length, 3)})
+        segment_words.append(text)
+        t += length + (rng.uniform(1.3, 3.0) if rng.random() < 0.02 else rng.uniform(0.02, 0.2))
+
+        if sentence_left == 0 and len(segment_words) >= 8:
+            segments.append(segment_words)
+            segment_words = []
+
+    if segment_words:
+        segments.append(segment_words)
+
+    segment_objects = []
+    index = 0
+    for i, seg in enumerate(segments):
+        first, last = words[index], words[index + len(seg) - 1]
+        segment_objects.append({
+            'id': i, 'seek': 0, 'start': first['start'], 'end': last['end'],
+            'text': ' ' + ' '.join(seg), 'tokens': [], 'temperature': 0.0,
+            'avg_logprob': -0.2, 'compression_ratio': 1.4, 'no_speech_prob': 0.01,
+        })
+        index += len(seg)
+
+    return {
+        'task': 'transcribe',
+        'language': 'english',
+        'duration': duration,
+        'text': ' '.join(s['text'].strip() for s in segment_objects),
+        'words': words,
+        'segments': segment_objects,
+    }
+
+
+def _extract_multipart_file(body: bytes, content_type: str) -> bytes:
+    """从 multipart/form-data 请求体中取出 name="file" 的内容"""
+    boundary = content_type.split('boundary=', 1)[1].strip('"').encode()
+    for part in body.split(b'--' + boundary):
+        header, _, content = part.partition(b'\r\n\r\n')
+        if b'name="file"' in header:
+            return content[:-2] if content.endswith(b'\r\n') else content
+    raise ValueError('multipart 请求中没有 file 字段')
+
+
+class FakeWhisperServer:
+    """在后台线程中运行的模拟服务
+
+    延迟 = latency + latency_per_minute × 音频分钟数；requests / bytes_received
+    记录收到的请求数和上传字节数。rate_limit 不为 0 时模拟限流：任意
+    rate_window 秒内超过 rate_limit 个请求就返回 429 和 Retry-After，
+    rate_limited 记录返回 429 的次数。
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0,
+                 latency: float = 0.0, latency_per_minute: float = 0.0, fail_rate: float = 0.0,
+                 rate_limit: int = 0, rate_window: float = 60.0):
+        self.latency = latency
+        self.latency_per_minute = latency_per_minute
+        self.fail_rate = fail_rate
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.requests = 0
+        self.rate_limited = 0
+        self.bytes_received = 0
+        self._recent = deque()
+        self._lock = threading.Lock()
+        self._rng = random.Random(0)
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}/v1'
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, status: int, payload: dict, headers: Optional[dict] = None):
+                data = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                if not self.path.rstrip('/').endswith('/audio/transcriptions'):
+                    self._send_json(404, {'error': {'message': 'not found'}})
+                    return
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                with server._lock:
+                    server.requests += 1
+                    server.bytes_received += len(body)
+                    should_fail = server._rng.random() < server.fail_rate
+                    retry_after = server._check_rate_limit()
+                if retry_after is not None:
+                    self._send_json(429, {'error': {'message': 'rate limited', 'type': 'requests'}},
+                                    {'Retry-After': f'{retry_after:.3f}'})
+                    return
+
+                audio = _extract_multipart_file(body, self.headers.get('Content-Type', ''))
+                with tempfile.NamedTemporaryFile(suffix='.audio', delete=False) as f:
+                    f.write(audio)
+                try:
+                    duration = probe_duration(f.name)
+                finally:
+                    os.unlink(f.name)
+
+                time.sleep(server.latency + server.latency_per_minute * duration / 60)
+                if should_fail:
+                    self._send_json(503, {'error': {'message': 'simulated failure', 'type': 'server_error'}})
+                    return
+                self._send_json(200, fake_verbose_json(duration, seed=len(audio)))
+
+        return Handler
+
+    def _check_rate_limit(self) -> Optional[float]:
+        """超出限流时返回建议等待的秒数，否则记录本次请求并返回 None（持有 _lock 时调用）"""
+        if not self.rate_limit:
+            return None
+        now = time.monotonic()
+        while self._recent and now - self._recent[0] >= self.rate_window:
+            self._recent.popleft()
+        if len(self._recent) >= self.rate_limit:
+            self.rate_limited += 1
+            return self.rate_window - (now - self._recent[0])
+        self._recent.append(now)
+        return None
+
+    def start(self) -> 'FakeWhisperServer':
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地模拟的 OpenAI 转录接口')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.5, help='每个请求的固定延迟（秒）')
+    parser.add_argument('--latency-per-minute', type=float, default=0.5, help='每分钟音频额外增加的延迟（秒）')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='随机返回 503 的比例')
+    parser.add_argument('--rate-limit', type=int, default=0, help='每个时间窗口内最多接受的请求数，超出返回 429')
+    parser.add_argument('--rate-window', type=float, default=60.0, help='限流的时间窗口（秒）')
+    args = parser.parse_args()
+
+    server = FakeWhisperServer(args.host, args.port, args.latency, args.latency_per_minute, args.fail_rate,
+                               args.rate_limit, args.rate_window)
+    print(f'Fake Whisper API listening on {server.base_url}')
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,339 @@
+"""批量生成字幕的命令行入口
+
+用法：
+    python cli.py videos/ "lectures/**/*.mp4" --profile opus --concurrency 4
+
+音频提取（ffmpeg，CPU 密集）在进程池中并行执行，转录请求（网络等待）
+在有界线程池中并发执行，三个阶段通过有界队列组成流水线相互重叠，
+生成的字幕（默认 .srt，可用 --formats 指定多种格式）写在输入视频旁边。
+"""
+import argparse
+import glob
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Callable, List, Optional, Sequence, Tuple
+
+from audio_extraction import AUDIO_PROFILES, VIDEO_EXTENSIONS, extract_audio_tracks
+from job_steps import adopt_audio, extract_to_journal, transcribe_journal
+from journal import JobJournal, make_job_key, path_fingerprint
+from media_probe import AudioStream, probe_audio_streams, track_suffixes
+from metrics import REGISTRY, trace
+from pipeline import PipelineJob, Stage, run_pipeline_sync
+from reflow import (
+    DEFAULT_MAX_CPS, DEFAULT_MAX_DURATION, DEFAULT_MAX_LINES, DEFAULT_MIN_DURATION, LayoutRules, reflow_transcript
+)
+from scheduler import SCHEDULER
+from scratch import SCRATCH, estimate_job_bytes
+from segmentation import segment_transcript
+from silence_trim import OffsetMap
+from subtitles import SUBTITLE_FORMATS, iter_segment_cues, iter_word_cues, write_subtitles
+from transcript_cache import TranscriptCache
+from transcription import DEFAULT_CHUNK_SECONDS, DEFAULT_MAX_WORKERS
+
+logger = logging.getLogger("whisper_subtitles")
+
+
+def collect_videos(inputs: List[str], recursive: bool = False) -> List[str]:
+    """把目录、通配符和文件路径展开为视频文件列表（去重并保持顺序）"""
+    extensions = {f".{ext}" for ext in VIDEO_EXTENSIONS}
+    found = []
+    for item in inputs:
+        if os.path.isdir(item):
+            pattern = os.path.join(item, "**", "*") if recursive else os.path.join(item, "*")
+            candidates = sorted(glob.glob(pattern, recursive=recursive))
+        elif glob.has_magic(item):
+            candidates = sorted(glob.glob(item, recursive=True))
+        else:
+            candidates = [item]
+        for path in candidates:
+            if os.path.isfile(path) and os.path.splitext(path)[1].lower() in extensions:
+                found.append(os.path.abspath(path))
+    return list(dict.fromkeys(found))
+
+
+def subtitle_path_for(video_path: str, fmt: str = "srt", suffix: str = "") -> str:
+    return f"{os.path.splitext(video_path)[0]}{suffix}{SUBTITLE_FORMATS[fmt]['extension']}"
+
+
+def _track_job(journal: JobJournal, suffix: str = "") -> dict:
+    offset_map = OffsetMap.from_dict(journal.offset_map)
+    return {'audio_path': journal.audio_path, 'duration': journal.duration,
+            'source_duration': offset_map.duration if offset_map else journal.duration,
+            'job_dir': journal.job_dir, 'suffix': suffix}
+
+
+def _select_tracks(video_path: str, tracks: List[int]) -> Tuple[List[AudioStream], List[str]]:
+    """多音轨模式要处理的音轨及各自输出文件名的后缀（空列表表示全部音轨）"""
+    streams = all_streams = probe_audio_streams(video_path)
+    if tracks:
+        missing = [i for i in tracks if not 0 <= i < len(streams)]
+        if missing:
+            raise ValueError(f"音轨序号 {missing} 超出范围（共 {len(streams)} 条音轨）")
+        streams = [streams[i] for i in tracks]
+    if not streams:
+        raise Exception("No audio stream found in the video")
+    # 只有一条音轨的视频不加后缀
+    suffixes = [""] if len(all_streams) == 1 else track_suffixes(streams)
+    return streams, suffixes
+
+
+def has_subtitles(video_path: str, formats: Sequence[str] = ("srt",), tracks: Optional[List[int]] = None) -> bool:
+    """字幕是否都已生成：每种请求的格式都存在才算，多音轨模式下还要求每条音轨都有"""
+    if tracks is None:
+        suffixes = [""]
+    else:
+        try:
+            _, suffixes = _select_tracks(video_path, tracks)
+        except Exception:
+            # 音轨无法探测或序号无效时照常处理，错误在流水线中报告
+            return False
+    return all(os.path.exists(subtitle_path_for(video_path, fmt, suffix))
+               for fmt in formats for suffix in suffixes)
+
+
+def _extract_tracks(video_path: str, profile: str, model: str, trim_silences: bool,
+                    tracks: List[int]) -> List[dict]:
+    """多音轨模式：一次 ffmpeg 调用提取所有尚未提取的音轨，每条音轨一个任务日志"""
+    streams, suffixes = _select_tracks(video_path, tracks)
+    fingerprint = path_fingerprint(video_path)
+    journals = [
+        JobJournal.open(make_job_key(
+            fingerprint, profile=profile, language=None, audio_index=stream.audio_index,
+            trim_silences=trim_silences, model=model, chunk_seconds=DEFAULT_CHUNK_SECONDS
+        ))
+        for stream in streams
+    ]
+    pending = [i for i, journal in enumerate(journals) if not journal.audio_path]
+    if len(pending) < len(journals):
+        logger.info("♻️ %s: 复用 %d 条已提取的音轨", video_path, len(journals) - len(pending))
+    if pending:
+        try:
+            with SCRATCH.job(estimate_job_bytes(os.path.getsize(video_path), spooled=False)) as scratch:
+                extracted = extract_audio_tracks(video_path, profile, [streams[i].audio_index for i in pending],
+                                                 scratch_dir=scratch.dir)
+                for i, (_, audio_path) in zip(pending, extracted):
+                    adopt_audio(journals[i], audio_path, profile, trim_silences, scratch.dir, label=video_path)
+        except BaseException:
+            for i in pending:
+                journals[i].finish()
+            raise
+    return [_track_job(journal, suffix) for journal, suffix in zip(journals, suffixes)]
+
+
+def extract_job(video_path: str, profile: str, model: str, language: Optional[str] = None,
+                audio_index: Optional[int] = None, trim_silences: bool = False,
+                tracks: Optional[List[int]] = None, ranges: int = 1) -> dict:
+    """提取阶段（进程池）：提取音频并获取时长，trim_silences 时再裁剪长静音
+
+    tracks 不为 None 时为多音轨模式（空列表表示全部音轨），每条音轨生成
+    一份字幕，文件名带语言或音轨序号后缀。ranges 大于 1 时长视频分时间段
+    并行解码（只对单音轨模式有效）。
+    音频保存在任务日志目录中，上次中断的同一任务直接复用已提取的音频。
+    子进程中的阶段记录随结果一起返回，由主进程并入 REGISTRY。
+    """
+    with trace() as extract_trace:
+        if tracks is not None:
+            track_jobs = _extract_tracks(video_path, profile, model, trim_silences, tracks)
+        else:
+            journal = JobJournal.open(make_job_key(
+                path_fingerprint(video_path), profile=profile, language=language, audio_index=audio_index,
+                trim_silences=trim_silences, model=model, chunk_seconds=DEFAULT_CHUNK_SECONDS
+            ))
+            if journal.audio_path:
+                logger.info("♻️ 从上次中断处继续: %s（已完成 %d/%d 块）", video_path, *journal.progress())
+            else:
+                try:
+                    extract_to_journal(journal, video_path, profile, language=language, audio_index=audio_index,
+                                       trim_silences=trim_silences, ranges=ranges)
+                except BaseException:
+                    journal.finish()
+                    raise
+            track_jobs = [_track_job(journal)]
+    return {'video': video_path, 'tracks': track_jobs, 'metrics': extract_trace.records}
+
+
+def _transcribe_track(track: dict, client, cache: Optional[TranscriptCache], model: str, chunk_workers: int) -> None:
+    journal = JobJournal(track.pop('job_dir'))
+    track['transcript'], _ = transcribe_journal(journal, client, model, cache=cache, max_workers=chunk_workers,
+                                                gate=SCHEDULER.gate(track['audio_path']))
+
+
+def transcribe_job(job: dict, client, cache: Optional[TranscriptCache], model: str, chunk_workers: int) -> dict:
+    """转录阶段（线程池）：优先读取缓存；成功后删除任务日志，失败时保留以便下次继续
+
+    多音轨时各音轨并发转录，总耗时接近最长的一条音轨。
+    """
+    for record in job.pop('metrics', []):
+        REGISTRY.observe(record)
+    transcribe = partial(_transcribe_track, client=client, cache=cache, model=model, chunk_workers=chunk_workers)
+    if len(job['tracks']) == 1:
+        transcribe(job['tracks'][0])
+    else:
+        with ThreadPoolExecutor(max_workers=len(job['tracks'])) as pool:
+            list(pool.map(transcribe, job['tracks']))
+    return job
+
+
+def write_subtitles_job(job: dict, max_chars: int, formats: List[str], write_raw: bool,
+                        layout: Optional[LayoutRules] = None) -> dict:
+    """分段阶段：分段并把各格式的字幕写在视频旁边；指定 layout 时按排版规则重排"""
+    video_path = job['video']
+    job['segments'] = 0
+    for track in job['tracks']:
+        transcript = track.pop('transcript')
+        if layout is not None:
+            segments = reflow_transcript(transcript, layout)
+        else:
+            segments = segment_transcript(transcript, max_chars)
+        for fmt in formats:
+            write_subtitles(iter_segment_cues(segments), subtitle_path_for(video_path, fmt, track['suffix']), fmt)
+            if write_raw:
+                write_subtitles(iter_word_cues(transcript),
+                                subtitle_path_for(video_path, fmt, f"{track['suffix']}_raw"), fmt)
+        job['segments'] += len(segments)
+    return job
+
+
+def run_batch(videos: List[str], args, on_done: Optional[Callable[[PipelineJob], None]] = None) -> int:
+    """提取 → 转录 → 分段流水线，各阶段重叠执行，返回失败的文件数
+
+    on_done 在每个文件处理完成（或失败）时调用，用于记录处理状态。
+    转录请求经过进程内共享的调度器限流（见 scheduler.py），各文件轮流发出请求。
+    """
+    client = SCHEDULER.client(args.api_key)
+    cache = None if args.no_cache else TranscriptCache()
+    totals = {'done': 0, 'failed': 0, 'audio_seconds': 0.0}
+
+    def report(job: PipelineJob) -> None:
+        if on_done:
+            on_done(job)
+        if job.error is not None:
+            totals['failed'] += 1
+            logger.error("❌ %s失败 %s: %s", job.failed_stage, job.source, job.error)
+            if job.failed_stage == "转录":
+                logger.info("💾 已完成的分块已保存，重新运行同一命令会从中断处继续")
+            return
+        totals['done'] += 1
+        tracks = job.value['tracks']
+        totals['audio_seconds'] += sum(track['source_duration'] for track in tracks)
+        timings = "，".join(f"{name} {seconds:.1f}s" for name, seconds in job.timings.items())
+        outputs = "、".join(subtitle_path_for(job.source, args.formats[0], track['suffix']) for track in tracks)
+        logger.info("✅ %s（%d 段；%s）", outputs, job.value['segments'], timings)
+
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.extract_workers) as extract_pool, \
+            ThreadPoolExecutor(max_workers=args.concurrency) as transcribe_pool:
+        stages = [
+            Stage("提取", partial(extract_job, profile=args.profile, model=args.model,
+                                  language=args.audio_language, audio_index=args.audio_track,
+                                  trim_silences=args.trim_silences, tracks=args.tracks,
+                                  ranges=args.extract_ranges),
+                  workers=args.extract_workers, executor=extract_pool, queue_depth=args.extract_workers),
+            # 队列容量限制已提取、等待转录的音频数量
+            Stage("转录", partial(transcribe_job, client=client, cache=cache, model=args.model,
+                                  chunk_workers=args.chunk_workers),
+                  workers=args.concurrency, executor=transcribe_pool, queue_depth=args.queue_depth),
+            Stage("分段", partial(write_subtitles_job, max_chars=args.max_chars, formats=args.formats,
+                                  write_raw=args.raw, layout=layout_rules(args)),
+                  queue_depth=args.queue_depth),
+        ]
+        run_pipeline_sync(videos, stages, on_result=report)
+
+    elapsed_minutes = max(time.perf_counter() - started, 1e-6) / 60
+    print(
+        f"\n完成 {totals['done']}/{len(videos)} 个文件，失败 {totals['failed']} 个，用时 {elapsed_minutes:.2f} 分钟\n"
+        f"吞吐量: {totals['done'] / elapsed_minutes:.2f} 文件/分钟，"
+        f"{totals['audio_seconds'] / 3600 / elapsed_minutes:.3f} 音频小时/分钟"
+    )
+    logger.debug("各阶段耗时：\n%s", "\n".join(
+        f"  {row['stage']:<24} n={row['count']:<5} p50={row['p50_s']:.3f}s p99={row['p99_s']:.3f}s"
+        for row in REGISTRY.summary()
+    ))
+    if args.metrics_out:
+        with open(args.metrics_out, "w", encoding="utf-8") as f:
+            f.write(REGISTRY.to_prometheus())
+    return totals['failed']
+
+
+def layout_rules(args) -> Optional[LayoutRules]:
+    """--reflow 时按命令行参数构造重排规则，否则为 None（逐段贪心分段）"""
+    if not args.reflow:
+        return None
+    return LayoutRules(max_chars=args.max_chars, max_lines=args.max_lines, min_duration=args.min_duration,
+                       max_duration=args.max_duration, max_cps=args.max_cps)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="使用 OpenAI Whisper 批量为视频生成 SRT 字幕")
+    parser.add_argument("inputs", nargs="+", help="视频文件、目录或通配符（如 'videos/**/*.mp4'）")
+    parser.add_argument("-r", "--recursive", action="store_true", help="递归扫描目录")
+    parser.add_argument("--api-key", default=os.getenv("OPENAI_API_KEY"), help="默认读取 OPENAI_API_KEY 环境变量")
+    parser.add_argument("--model", default="whisper-1")
+    parser.add_argument("--profile", choices=list(AUDIO_PROFILES), default="opus", help="音频编码方案")
+    parser.add_argument("--audio-language", help="有多条音轨时优先选择的语言（ISO 639-2，如 eng）")
+    parser.add_argument("--audio-track", type=int, help="按序号选择音轨（从 0 开始，优先于 --audio-language）")
+    parser.add_argument("--tracks", nargs="*", type=int,
+                        help="多音轨模式：一次读取视频提取多条音轨并发转录，每条音轨一份字幕（文件名带 .eng 或 "
+                             ".track1 后缀）；不带序号时处理全部音轨")
+    parser.add_argument("--trim-silences", action="store_true",
+                        help="上传前删除超过 2 秒的静音，字幕时间戳换算回原视频时间")
+    parser.add_argument("--max-chars", type=int, default=26, help="每段字幕最大字符数（--reflow 时为每行最大字符数）")
+    parser.add_argument("--reflow", action="store_true",
+                        help="用动态规划整体优化分段和换行（多行字幕，考虑阅读速度和显示时长），"
+                             "代替逐段贪心分段；建议配合 --max-chars 42")
+    parser.add_argument("--max-lines", type=int, default=DEFAULT_MAX_LINES, help="--reflow 时每段字幕最多行数")
+    parser.add_argument("--max-cps", type=float, default=DEFAULT_MAX_CPS, help="--reflow 时阅读速度上限（字符/秒）")
+    parser.add_argument("--min-duration", type=float, default=DEFAULT_MIN_DURATION, help="--reflow 时每段字幕最短显示时长（秒）")
+    parser.add_argument("--max-duration", type=float, default=DEFAULT_MAX_DURATION, help="--reflow 时每段字幕最长时长（秒）")
+    parser.add_argument("--extract-workers", type=int, default=os.cpu_count() or 1,
+                        help="并行 ffmpeg 提取进程数（默认等于 CPU 核数）")
+    parser.add_argument("--extract-ranges", type=int, default=1,
+                        help="单个长视频分成几个时间段并行解码；批量处理时多个文件已经并行，"
+                             "文件少而视频很长时再调大")
+    parser.add_argument("--concurrency", type=int, default=4, help="同时进行的转录请求数")
+    parser.add_argument("--queue-depth", type=int, default=2,
+                        help="阶段之间的队列容量：已提取但尚未转录的音频最多排队的数量")
+    parser.add_argument("--chunk-workers", type=int, default=DEFAULT_MAX_WORKERS,
+                        help="单个长音频分块转录时的并发请求数")
+    parser.add_argument("--formats", nargs="+", choices=list(SUBTITLE_FORMATS), default=["srt"],
+                        help="输出的字幕格式，可同时指定多个")
+    parser.add_argument("--raw", action="store_true", help="同时输出每个单词一段的原始字幕（_raw 后缀）")
+    parser.add_argument("--overwrite", action="store_true", help="覆盖已存在的字幕文件")
+    parser.add_argument("--no-cache", action="store_true", help="不使用转录缓存")
+    parser.add_argument("--metrics-out", help="结束时把各阶段指标以 Prometheus 文本格式写入该文件")
+    parser.add_argument("-v", "--verbose", action="store_true", help="输出调试日志，包括每个阶段的 JSON 计时记录")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        format="%(asctime)s %(message)s",
+        datefmt="%H:%M:%S",
+    )
+
+    if not args.api_key:
+        logger.error("❌ 未提供 API Key：请设置 OPENAI_API_KEY 环境变量或使用 --api-key")
+        return 2
+
+    videos = collect_videos(args.inputs, args.recursive)
+    if not args.overwrite:
+        skipped = [v for v in videos if has_subtitles(v, args.formats, args.tracks)]
+        if skipped:
+            logger.info("⏭️ 跳过 %d 个已有字幕的文件（使用 --overwrite 重新生成）", len(skipped))
+        videos = [v for v in videos if v not in skipped]
+    if not videos:
+        logger.info("没有需要处理的视频文件")
+        return 0
+
+    logger.info("📂 共 %d 个视频文件", len(videos))
+    return 1 if run_batch(videos, args) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
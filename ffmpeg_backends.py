@@ -0,0 +1,84 @@
+"""音频提取后端的发现与缓存
+
+可用的后端按优先级为：imageio-ffmpeg 自带的 ffmpeg、PATH 中的系统 ffmpeg、
+MoviePy。每个进程只探测一次（运行 ffmpeg -version 做健康检查），结果缓存
+在模块中；缓存的可执行文件不存在时重新探测。imageio_ffmpeg 只在探测时
+导入，MoviePy 只检查是否已安装，真正提取时才导入。
+"""
+import importlib.util
+import logging
+import os
+import shutil
+import subprocess
+import threading
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 健康检查的超时时间（秒）
+HEALTH_CHECK_TIMEOUT = 10
+
+
+class Backend:
+    """一个音频提取后端；exe 为 ffmpeg 可执行文件路径，MoviePy 为 None"""
+
+    def __init__(self, name: str, label: str, exe: Optional[str] = None):
+        self.name = name
+        self.label = label
+        self.exe = exe
+
+    def __repr__(self):
+        return f"Backend({self.name!r}, {self.exe!r})"
+
+
+_lock = threading.Lock()
+_backends: Optional[List[Backend]] = None
+
+
+def _ffmpeg_works(exe: str) -> bool:
+    try:
+        result = subprocess.run([exe, "-version"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                timeout=HEALTH_CHECK_TIMEOUT)
+    except (OSError, subprocess.SubprocessError):
+        return False
+    return result.returncode == 0
+
+
+def _discover() -> List[Backend]:
+    backends = []
+    try:
+        import imageio_ffmpeg
+        bundled = imageio_ffmpeg.get_ffmpeg_exe()
+    except Exception as e:
+        logger.debug("imageio-ffmpeg 不可用: %s", e)
+        bundled = None
+    if bundled and _ffmpeg_works(bundled):
+        backends.append(Backend("imageio_ffmpeg", "imageio-ffmpeg", bundled))
+
+    system = shutil.which("ffmpeg")
+    if system and system != bundled and _ffmpeg_works(system):
+        backends.append(Backend("system_ffmpeg", "system ffmpeg", system))
+
+    if importlib.util.find_spec("moviepy") is not None:
+        backends.append(Backend("moviepy", "MoviePy"))
+
+    logger.debug("可用的音频提取后端: %s", backends)
+    return backends
+
+
+def probe_backends(refresh: bool = False) -> List[Backend]:
+    """返回可用的后端列表（按优先级），同一进程内只探测一次"""
+    global _backends
+    with _lock:
+        stale = _backends is not None and any(b.exe and not os.path.exists(b.exe) for b in _backends)
+        if _backends is None or refresh or stale:
+            _backends = _discover()
+        return list(_backends)
+
+
+def get_ffmpeg_exe() -> str:
+    """第一个可用的 ffmpeg 可执行文件，都不可用时返回 "ffmpeg" 交给系统查找"""
+    for backend in probe_backends():
+        if backend.exe:
+            return backend.exe
+    return "ffmpeg"
@@ -0,0 +1,108 @@
+"""命令行（cli.py）和后台任务（jobs.py）共用的任务步骤
+
+一个任务的音频保存在任务日志（journal.JobJournal）中：提取出的音频先探测
+时长、按需裁剪长静音，再移入任务日志；转录时优先读取缓存，未命中时按
+任务日志中的分块计划转录（中断后只转录尚未完成的分块），成功后把时间
+换算回原视频并删除任务日志。
+"""
+import logging
+import os
+import time
+from contextlib import nullcontext
+from types import SimpleNamespace
+from typing import Callable, Optional, Tuple
+
+from audio_extraction import extract_audio_from_video
+from journal import JobJournal
+from scratch import SCRATCH, estimate_job_bytes
+from silence_trim import OffsetMap, remap_transcript, trim_silence
+from transcript_cache import TranscriptCache
+from transcription import (
+    DEFAULT_CHUNK_SECONDS, DEFAULT_MAX_WORKERS, probe_duration, transcribe_audio, transcript_from_dict, transcript_to_dict
+)
+
+logger = logging.getLogger(__name__)
+
+
+def adopt_audio(journal: JobJournal, audio_path: str, profile: str, trim_silences: bool,
+                scratch_dir: str, label: str = '', on_stage: Optional[Callable[[str], None]] = None) -> None:
+    """探测时长、按需裁剪长静音，然后把音频移入任务日志
+
+    label 为日志中显示的任务名称，on_stage 在开始裁剪静音时以阶段名调用。
+    """
+    duration = probe_duration(audio_path)
+    offset_map = None
+    if trim_silences:
+        if on_stage:
+            on_stage('裁剪静音')
+        audio_path, offset_map = trim_silence(audio_path, profile, duration, scratch_dir=scratch_dir)
+    if offset_map:
+        logger.info("✂️ %s: 裁剪了 %.1f 秒静音", label, offset_map.removed_seconds)
+        duration = offset_map.compact_duration
+    journal.adopt_audio(audio_path, duration, offset_map.to_dict() if offset_map else None)
+
+
+def extract_to_journal(journal: JobJournal, video_path: str, profile: str, language: Optional[str] = None,
+                       audio_index: Optional[int] = None, trim_silences: bool = False, ranges: int = 1,
+                       label: str = '', scheduler=None, owner: str = '',
+                       on_stage: Optional[Callable[[str], None]] = None) -> None:
+    """从视频提取音频并移入任务日志
+
+    提取在按视频大小申请的临时目录中进行；给出 scheduler 时先占用 ranges 个
+    ffmpeg 名额。出错时任务日志由调用方处理。
+    """
+    slot = scheduler.slot('ffmpeg', owner, weight=ranges) if scheduler else nullcontext()
+    with SCRATCH.job(estimate_job_bytes(os.path.getsize(video_path), spooled=False)) as scratch, slot:
+        audio_path = extract_audio_from_video(video_path, profile, language=language, audio_index=audio_index,
+                                              scratch_dir=scratch.dir, ranges=ranges)
+        adopt_audio(journal, audio_path, profile, trim_silences, scratch.dir, label=label or video_path,
+                    on_stage=on_stage)
+
+
+def transcribe_journal(journal: JobJournal, client, model: str, cache: Optional[TranscriptCache] = None,
+                       audio_hash: Optional[str] = None, chunked: Optional[bool] = None,
+                       chunk_seconds: float = DEFAULT_CHUNK_SECONDS, max_workers: int = DEFAULT_MAX_WORKERS,
+                       on_chunk: Optional[Callable[[tuple], None]] = None,
+                       gate=None) -> Tuple[SimpleNamespace, dict]:
+    """转录任务日志中的音频，返回 (按原视频时间的转录结果, 统计信息)
+
+    优先读取缓存（audio_hash 为已算好的音频哈希，省去再读一遍文件）。
+    成功后删除任务日志；转录失败时保留，下次从中断处继续。统计信息包括
+    duration、audio_bytes、request_seconds 和 cached。
+    """
+    audio_path, duration = journal.audio_path, journal.duration
+    stats = {'duration': duration, 'audio_bytes': os.path.getsize(audio_path), 'request_seconds': None}
+    data = None
+    if cache:
+        cache_key = cache.make_key(
+            audio_path,
+            model,
+            audio_hash=audio_hash,
+            response_format="verbose_json",
+            timestamp_granularities=["word", "segment"]
+        )
+        data = cache.get(cache_key)
+
+    if data is not None:
+        transcript = transcript_from_dict(data)
+        stats['cached'] = True
+    else:
+        # 分块音频所需的临时空间不超过整段音频的大小
+        with SCRATCH.job(stats['audio_bytes']) as scratch:
+            request_started = time.perf_counter()
+            transcript = transcribe_audio(client, audio_path, model=model, chunked=chunked,
+                                          chunk_seconds=chunk_seconds, max_workers=max_workers,
+                                          journal=journal, duration=duration, on_chunk=on_chunk,
+                                          scratch_dir=scratch.dir, gate=gate)
+            stats['request_seconds'] = time.perf_counter() - request_started
+        if cache:
+            cache.put(cache_key, transcript_to_dict(transcript))
+        stats['cached'] = False
+
+    # 缓存中保存的是裁剪后音频的时间，换算回原视频时间
+    offset_map = OffsetMap.from_dict(journal.offset_map)
+    if offset_map:
+        transcript = transcript_from_dict(remap_transcript(transcript_to_dict(transcript), offset_map))
+    # 任务完成，删除任务日志和其中的音频文件
+    journal.finish()
+    return transcript, stats
@@ -0,0 +1,489 @@
+"""后台任务服务：字幕任务在工作进程池中执行，与 Streamlit 的脚本运行解耦
+
+界面点击开始后只提交任务并立即返回，提取、转录都在工作进程中完成：
+脚本重新运行、浏览器标签页关闭都不会中断任务，长时间的转录也不占用
+会话的脚本线程。同时运行的任务数等于工作进程数（WHISPER_MAX_ACTIVE_JOBS），
+与打开了多少个浏览器会话无关，多出的任务排队等待。
+
+任务的状态、进度和结果保存在 JobStore 中（每个任务一个目录）：
+- job.json：状态、当前阶段、分块进度、参数、错误信息和各阶段耗时记录；
+- 输入视频（或上传后预先提取好的音频，见 prefetch.py），任务结束后删除；
+  失败的任务保留输入，重试时沿用任务日志中已完成的分块；已取消的任务
+  连同任务日志一起删除，不能重试；
+- partial.srt：边转录边生成的部分字幕；transcript.json：转录结果。
+
+界面按任务 ID 轮询状态、获取结果，任务 ID 也写在页面链接中，刷新或
+重新打开页面后仍能看到进度。服务所在进程重启时，未完成的任务重新排队。
+
+工作进程用 spawn 方式启动（不继承 Streamlit 进程中的线程和锁），通过
+scheduler.RemoteScheduler 使用服务进程中的调度器：请求限流、429 暂停和
+ffmpeg 名额与界面中的预先提取共用一份。
+"""
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from typing import Dict, List, Optional
+
+from audio_extraction import SPOOL_CHUNK_SIZE
+from job_steps import extract_to_journal, transcribe_journal
+from journal import JOB_MAX_AGE_SECONDS, JobJournal, make_job_key, upload_fingerprint, write_json
+from metrics import trace
+from scheduler import SCHEDULER, RemoteScheduler, Scheduler
+from scratch import pid_alive
+from silence_trim import OffsetMap, remap_chunk
+from transcript_cache import DEFAULT_CACHE_DIR, TranscriptCache
+from transcription import transcript_from_dict, transcript_to_dict
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_JOBS_DIR = os.getenv('WHISPER_JOBS_DIR', os.path.join(DEFAULT_CACHE_DIR, 'service'))
+# 同时运行的任务数（工作进程数）
+MAX_ACTIVE_JOBS = int(os.getenv('WHISPER_MAX_ACTIVE_JOBS', 4))
+# 界面轮询任务状态的间隔（秒）
+POLL_SECONDS = 2.0
+# 任务记录中保存最新的几条字幕，供界面预览
+PREVIEW_CUES = 5
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+STATUS_LABELS = {
+    QUEUED: '排队中',
+    RUNNING: '运行中',
+    DONE: '已完成',
+    FAILED: '失败',
+    CANCELLED: '已取消',
+}
+FINAL_STATUSES = (DONE, FAILED, CANCELLED)
+
+_STATE_FILE = 'job.json'
+_CANCEL_FILE = 'cancel'
+RESULT_FILE = 'transcript.json'
+PARTIAL_FILE = 'partial.srt'
+
+
+class JobCancelled(Exception):
+    """任务被用户取消"""
+
+
+class JobStore:
+    """任务目录的读写：每个任务一个目录，job.json 保存状态
+
+    job.json 只由提交任务的服务进程和执行任务的工作进程写入（原子替换）；
+    取消请求单独写一个标记文件，不会和工作进程的状态更新互相覆盖。
+    """
+
+    def __init__(self, root: str = DEFAULT_JOBS_DIR):
+        self.root = root
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, job_id: str, *parts: str) -> str:
+        return os.path.join(self.root, job_id, *parts)
+
+    def create(self) -> str:
+        """新建任务目录，返回任务 ID（写入 job.json 之前不会出现在任务列表中）"""
+        job_id = uuid.uuid4().hex
+        os.makedirs(self.path(job_id))
+        return job_id
+
+    def save(self, job_id: str, job: dict) -> None:
+        job['updated'] = time.time()
+        write_json(self.path(job_id, _STATE_FILE), job)
+
+    def load(self, job_id: str) -> Optional[dict]:
+        # 任务 ID 来自页面链接，只接受 create 生成的格式
+        if not job_id or not job_id.isalnum():
+            return None
+        try:
+            with open(self.path(job_id, _STATE_FILE), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def update(self, job_id: str, **fields) -> dict:
+        with self._lock:
+            job = self.load(job_id) or {}
+            job.update(fields)
+            self.save(job_id, job)
+            return job
+
+    def list(self) -> List[dict]:
+        """所有任务，按提交时间排序"""
+        jobs = [self.load(name) for name in os.listdir(self.root)]
+        return sorted((job for job in jobs if job), key=lambda job: job['created'])
+
+    def request_cancel(self, job_id: str) -> None:
+        open(self.path(job_id, _CANCEL_FILE), 'w').close()
+
+    def cancel_requested(self, job_id: str) -> bool:
+        return os.path.exists(self.path(job_id, _CANCEL_FILE))
+
+    def clear_cancel(self, job_id: str) -> None:
+        try:
+            os.unlink(self.path(job_id, _CANCEL_FILE))
+        except FileNotFoundError:
+            pass
+
+    def discard_input(self, job_id: str) -> None:
+        """删除输入视频或预先提取的音频"""
+        job = self.load(job_id) or {}
+        for name in filter(None, (job.get('input'), (job.get('audio') or {}).get('file'))):
+            try:
+                os.unlink(self.path(job_id, name))
+            except FileNotFoundError:
+                pass
+
+    def prune(self, max_age: float = JOB_MAX_AGE_SECONDS) -> int:
+        """删除结束后长时间未更新的任务，以及没写入 job.json 的残留目录，返回删除的数量"""
+        removed = 0
+        now = time.time()
+        for name in os.listdir(self.root):
+            job = self.load(name)
+            try:
+                age = now - (job['updated'] if job else os.path.getmtime(self.path(name)))
+            except OSError:
+                continue
+            if age > max_age and (job is None or job['status'] in FINAL_STATUSES):
+                shutil.rmtree(self.path(name), ignore_errors=True)
+                removed += 1
+        return removed
+
+
+# ---- 工作进程 ----
+
+_scheduler: Optional[Scheduler] = None
+_cache: Optional[TranscriptCache] = None
+
+
+def _init_worker(address: str, authkey: bytes) -> None:
+    """工作进程的初始化：连接服务进程中的调度器"""
+    global _scheduler
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(processName)s %(message)s")
+    _scheduler = RemoteScheduler(address, authkey)
+
+
+def _transcript_cache() -> TranscriptCache:
+    global _cache
+    if _cache is None:
+        _cache = TranscriptCache()
+    return _cache
+
+
+def _check_cancel(store: JobStore, job_id: str) -> None:
+    if store.cancel_requested(job_id):
+        raise JobCancelled()
+
+
+def _prepare_audio(store: JobStore, job: dict, journal: JobJournal, scheduler: Scheduler) -> Optional[str]:
+    """把音频放进任务日志：复用上次中断留下的、接管预先提取的，或者从视频提取
+
+    返回预先算好的音频哈希（只有接管预先提取的音频时才有）。
+    """
+    job_id, params = job['id'], job['params']
+    if journal.audio_path:
+        logger.info("♻️ 任务 %s 从上次中断处继续（已完成 %d/%d 块）", job_id, *journal.progress())
+        return None
+    audio = job.get('audio')
+    if audio and os.path.exists(store.path(job_id, audio['file'])):
+        journal.adopt_audio(store.path(job_id, audio['file']), audio['duration'], audio['offset_map'])
+        return audio['audio_hash']
+    if not job.get('input'):
+        raise FileNotFoundError("任务的输入文件已不存在，请重新上传")
+    store.update(job_id, stage='提取音频')
+    extract_to_journal(journal, store.path(job_id, job['input']), params['profile'], language=params['language'],
+                       trim_silences=params['trim_silences'], ranges=params['ranges'], label=job_id,
+                       scheduler=scheduler, owner=job_id, on_stage=lambda stage: store.update(job_id, stage=stage))
+    return None
+
+
+def _process(store: JobStore, job: dict, api_key: str):
+    """提取 → 转录（优先读取缓存），返回 (转录结果, 统计信息)"""
+    job_id, params = job['id'], job['params']
+    scheduler = _scheduler or SCHEDULER
+    key = make_job_key(
+        job['fingerprint'],
+        profile=params['profile'],
+        language=params['language'],
+        trim_silences=params['trim_silences'],
+        model=params['model'],
+        chunked=params['chunked'],
+        chunk_seconds=params['chunk_seconds']
+    )
+    waiting = False
+
+    def on_wait():
+        nonlocal waiting
+        if not waiting:
+            store.update(job_id, stage='等待相同的任务')
+            waiting = True
+        _check_cancel(store, job_id)
+
+    # 同一视频、同样参数的任务共用一个任务日志：同时运行时后一个等前一个结束，
+    # 前一个完成时结果通常已在缓存中，失败时从它的进度继续
+    with JobJournal.exclusive(key, on_wait=on_wait) as journal:
+        return _process_journal(store, job, journal, scheduler, api_key)
+
+
+def _process_journal(store: JobStore, job: dict, journal: JobJournal, scheduler: Scheduler, api_key: str):
+    """在已独占的任务日志上执行 _process"""
+    job_id, params = job['id'], job['params']
+    offset_map = None
+    progressive = None
+
+    def on_chunk(chunk):
+        nonlocal progressive
+        fields = {'progress': list(journal.progress())}
+        if params['stream_output']:
+            if progressive is None:
+                from progressive import ProgressiveSubtitles
+                progressive = ProgressiveSubtitles(store.path(job_id, PARTIAL_FILE), params['max_chars'])
+            progressive.add_chunk(remap_chunk(chunk, offset_map))
+            fields.update(partial_segments=len(progressive.segments), covered_until=progressive.covered_until,
+                          latest_cues=[[segment.start, segment.end, segment.text]
+                                       for segment in progressive.segments[-PREVIEW_CUES:]])
+        store.update(job_id, **fields)
+        _check_cancel(store, job_id)
+
+    try:
+        audio_hash = _prepare_audio(store, job, journal, scheduler)
+        _check_cancel(store, job_id)
+        store.update(job_id, stage='转录', progress=list(journal.progress()))
+        offset_map = OffsetMap.from_dict(journal.offset_map)
+        return transcribe_journal(
+            journal,
+            scheduler.client(api_key),
+            params['model'],
+            cache=_transcript_cache() if params['use_cache'] else None,
+            audio_hash=audio_hash,
+            chunked=params['chunked'],
+            chunk_seconds=params['chunk_seconds'],
+            max_workers=params['max_workers'],
+            on_chunk=on_chunk,
+            gate=scheduler.gate(job_id)
+        )
+    except JobCancelled:
+        # 取消的任务不再续传，删除任务日志和已移入的音频
+        journal.finish()
+        raise
+    except BaseException:
+        # 音频已移入任务日志时保留，重试时从中断处继续；否则没有可续传的内容
+        if not journal.audio_path:
+            journal.finish()
+        raise
+
+
+def run_job(root: str, job_id: str, api_key: Optional[str]) -> str:
+    """在工作进程中执行一个任务，返回最终状态；出错时错误信息写入任务状态"""
+    store = JobStore(root)
+    job = store.load(job_id)
+    if job is None or job['status'] != QUEUED:
+        return job['status'] if job else CANCELLED
+    if store.cancel_requested(job_id):
+        store.update(job_id, status=CANCELLED, stage=STATUS_LABELS[CANCELLED], finished=time.time())
+        store.discard_input(job_id)
+        return CANCELLED
+    store.update(job_id, status=RUNNING, stage='准备中', worker_pid=os.getpid(), started=time.time())
+    fields = {}
+    with trace() as job_trace:
+        try:
+            if not api_key:
+                raise ValueError("缺少 OpenAI API Key")
+            transcript, fields['stats'] = _process(store, job, api_key)
+            write_json(store.path(job_id, RESULT_FILE), transcript_to_dict(transcript))
+            status = DONE
+        except JobCancelled:
+            logger.info("任务 %s 已取消", job_id)
+            status = CANCELLED
+        except Exception as e:
+            logger.exception("任务 %s 失败", job_id)
+            status, fields['error'] = FAILED, str(e)
+    # 失败的任务保留输入，重试时不必重新上传
+    if status != FAILED:
+        store.discard_input(job_id)
+    store.update(job_id, status=status, stage=STATUS_LABELS[status], finished=time.time(),
+                 metrics=job_trace.records, **fields)
+    return status
+
+
+# ---- 服务 ----
+
+class JobService:
+    """把任务交给工作进程池执行，按任务 ID 查询状态和结果
+
+    工作进程池在第一次提交任务时才创建。同一个服务进程中的所有会话共用
+    一个实例（界面中通过 st.cache_resource 获取）。工作进程使用 scheduler
+    限流和分配名额。
+    """
+
+    def __init__(self, store: Optional[JobStore] = None, workers: int = MAX_ACTIVE_JOBS,
+                 scheduler: Scheduler = SCHEDULER):
+        self.store = store or JobStore()
+        self.workers = max(1, workers)
+        self.scheduler = scheduler
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._futures: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=self.scheduler.serve()
+            )
+        return self._executor
+
+    def _dispatch(self, job_id: str, api_key: Optional[str]) -> None:
+        with self._lock:
+            try:
+                future = self._pool().submit(run_job, self.store.root, job_id, api_key)
+            except BrokenProcessPool:
+                # 工作进程异常退出后进程池不可再用，换一个新的
+                self._executor = None
+                future = self._pool().submit(run_job, self.store.root, job_id, api_key)
+            self._futures[job_id] = future
+        future.add_done_callback(partial(self._settle, job_id))
+
+    def _settle(self, job_id: str, future: Future) -> None:
+        with self._lock:
+            self._futures.pop(job_id, None)
+        if future.cancelled() or future.exception() is None:
+            return
+        # run_job 自身不抛出异常，到这里说明工作进程异常退出（如内存不足被结束）
+        error = future.exception()
+        logger.error("任务 %s 的工作进程异常退出: %s", job_id, error)
+        if isinstance(error, BrokenProcessPool):
+            with self._lock:
+                self._executor = None
+        job = self.store.load(job_id)
+        if job and job['status'] == RUNNING and job.get('worker_pid'):
+            # 退出的工作进程来不及释放名额，由服务进程收回，否则名额永远被占用
+            self.scheduler.reclaim(job['worker_pid'])
+        self.store.update(job_id, status=FAILED, stage=STATUS_LABELS[FAILED],
+                          error=f"工作进程异常退出: {error}", finished=time.time())
+
+    def submit(self, upload, api_key: str, params: dict, prefetched=None) -> str:
+        """提交一个任务，返回任务 ID
+
+        upload 为上传的文件对象；prefetched 为已接管的 prefetch.AudioPrefetch，
+        给出时把提取好的音频移入任务目录，工作进程不再提取。
+        """
+        job_id = self.store.create()
+        job = {
+            'id': job_id,
+            'name': getattr(upload, 'name', ''),
+            'size': getattr(upload, 'size', None),
+            'status': QUEUED,
+            'stage': STATUS_LABELS[QUEUED],
+            'progress': [0, 0],
+            'params': params,
+            'created': time.time(),
+            'service_pid': os.getpid(),
+        }
+        try:
+            if prefetched:
+                name = 'prefetched' + os.path.splitext(prefetched.audio_path)[1]
+                shutil.move(prefetched.audio_path, self.store.path(job_id, name))
+                job['fingerprint'] = prefetched.fingerprint
+                job['audio'] = {
+                    'file': name,
+                    'duration': prefetched.duration,
+                    'offset_map': prefetched.offset_map.to_dict() if prefetched.offset_map else None,
+                    'audio_hash': prefetched.audio_hash,
+                }
+            else:
+                job['fingerprint'] = upload_fingerprint(upload)
+                job['input'] = 'input' + os.path.splitext(job['name'])[1]
+                upload.seek(0)
+                with open(self.store.path(job_id, job['input']), 'wb') as f:
+                    shutil.copyfileobj(upload, f, SPOOL_CHUNK_SIZE)
+            self.store.save(job_id, job)
+        except BaseException:
+            shutil.rmtree(self.store.path(job_id), ignore_errors=True)
+            raise
+        self._dispatch(job_id, api_key)
+        logger.info("提交任务 %s: %s", job_id, job['name'])
+        return job_id
+
+    def status(self, job_id: str) -> Optional[dict]:
+        """任务状态；排队中的任务带有 ahead（前面排队的任务数）"""
+        job = self.store.load(job_id)
+        if job and job['status'] == QUEUED:
+            job['ahead'] = sum(
+                other['status'] == QUEUED and other['created'] < job['created'] for other in self.store.list()
+            )
+        return job
+
+    def result(self, job_id: str):
+        """已完成任务的转录结果，未完成时为 None"""
+        try:
+            with open(self.store.path(job_id, RESULT_FILE), 'r', encoding='utf-8') as f:
+                return transcript_from_dict(json.load(f))
+        except (OSError, ValueError):
+            return None
+
+    def cancel(self, job_id: str) -> None:
+        """取消任务：排队中的直接取消，运行中的在下一个分块完成时停止"""
+        self.store.request_cancel(job_id)
+        with self._lock:
+            future = self._futures.get(job_id)
+        if future is not None and future.cancel():
+            self.store.discard_input(job_id)
+            self.store.update(job_id, status=CANCELLED, stage=STATUS_LABELS[CANCELLED], finished=time.time())
+
+    def retry(self, job_id: str, api_key: str) -> None:
+        """重新提交失败的任务，已完成的分块保存在任务日志中，不会重新转录
+
+        取消时输入和任务日志已经删除，已取消的任务不能重试，只能重新提交。
+        """
+        job = self.store.load(job_id)
+        if job is None or job['status'] != FAILED:
+            status = STATUS_LABELS.get(job['status'], job['status']) if job else '不存在'
+            raise ValueError(f"只能重试失败的任务（任务 {job_id} {status}），请重新上传并提交")
+        self.store.clear_cancel(job_id)
+        self.store.update(job_id, status=QUEUED, stage=STATUS_LABELS[QUEUED], error=None,
+                          created=time.time(), service_pid=os.getpid())
+        self._dispatch(job_id, api_key)
+
+    def recover(self, api_key: Optional[str] = None) -> int:
+        """重新提交上一个服务进程留下的未完成任务，返回数量
+
+        API Key 不写入磁盘，没有 api_key（如未设置环境变量）时这些任务
+        标记为失败，用户在界面中点击重试即可继续。
+        """
+        self.store.prune()
+        recovered = 0
+        for job in self.store.list():
+            if job['status'] in FINAL_STATUSES or pid_alive(job.get('service_pid')):
+                continue
+            if job['status'] == RUNNING and pid_alive(job.get('worker_pid')):
+                # 上一个服务进程的工作进程还没退出，任务仍在执行
+                continue
+            if api_key:
+                self.store.update(job['id'], status=QUEUED, stage=STATUS_LABELS[QUEUED], service_pid=os.getpid())
+                self._dispatch(job['id'], api_key)
+                recovered += 1
+            else:
+                self.store.update(job['id'], status=FAILED, stage=STATUS_LABELS[FAILED],
+                                  error="服务重启，请重试", finished=time.time())
+        if recovered:
+            logger.info("重新提交了 %d 个未完成的任务", recovered)
+        return recovered
+
+    def snapshot(self) -> List[dict]:
+        """后台任务的运行和排队情况，格式与 Scheduler.snapshot 相同"""
+        statuses = [job['status'] for job in self.store.list()]
+        return [{'资源': '后台任务', '占用': statuses.count(RUNNING), '上限': self.workers,
+                 '排队': statuses.count(QUEUED)}]
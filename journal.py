@@ -0,0 +1,223 @@
+"""转录任务日志：记录提取出的音频、分块计划和已完成的分块结果
+
+长视频转录中途失败（请求超时、会话断开、进程退出）时，日志目录保留在
+磁盘上；用同样的输入和参数再次运行会复用已提取的音频，并只转录尚未
+完成的分块。任务成功后删除整个目录。
+
+同样的输入和参数会得到同一个任务键；可能同时运行的使用方（后台任务的
+工作进程）用 JobJournal.exclusive 打开，后到的等前一个结束再继续，不会
+删掉对方正在使用的目录。
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+from transcript_cache import DEFAULT_CACHE_DIR
+
+try:
+    import fcntl
+except ImportError:  # Windows 上没有 fcntl，不加锁
+    fcntl = None
+
+DEFAULT_JOURNAL_DIR = os.path.join(DEFAULT_CACHE_DIR, 'jobs')
+# 超过该时长未更新的任务视为废弃，打开新任务时顺带清理
+JOB_MAX_AGE_SECONDS = 7 * 24 * 3600
+# 计算上传文件指纹时读取的首尾字节数
+_FINGERPRINT_SAMPLE_BYTES = 1024 * 1024
+_STATE_FILE = 'job.json'
+# 任务目录旁边的锁文件后缀：目录被 finish 删除后锁仍然有效
+_LOCK_SUFFIX = '.lock'
+# 等待锁时的检查间隔（秒）
+_LOCK_POLL = 0.5
+
+
+def upload_fingerprint(upload) -> str:
+    """上传文件的指纹：文件名、大小以及首尾各 1 MB 的哈希，不必读完整个文件"""
+    digest = hashlib.sha256()
+    size = upload.seek(0, os.SEEK_END)
+    upload.seek(0)
+    digest.update(upload.read(_FINGERPRINT_SAMPLE_BYTES))
+    if size > _FINGERPRINT_SAMPLE_BYTES:
+        upload.seek(max(_FINGERPRINT_SAMPLE_BYTES, size - _FINGERPRINT_SAMPLE_BYTES))
+        digest.update(upload.read(_FINGERPRINT_SAMPLE_BYTES))
+    upload.seek(0)
+    return f"{getattr(upload, 'name', '')}:{size}:{digest.hexdigest()}"
+
+
+def path_fingerprint(path: str) -> str:
+    """本地文件的指纹：绝对路径、大小和修改时间"""
+    stat = os.stat(path)
+    return f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def make_job_key(source: str, **params) -> str:
+    """根据输入指纹和影响转录结果的参数（编码、模型、分块时长等）生成任务键"""
+    payload = json.dumps({'source': source, 'params': params}, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def write_json(path: str, data) -> None:
+    """先写临时文件再原子替换，进程中途退出也不会留下半个文件"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+class JobJournal:
+    """单个转录任务的持久化日志
+
+    目录结构：job.json 保存音频路径、时长和分块计划；每个完成的分块
+    单独写一个 chunk_XXXX.json，并发完成的分块互不覆盖。
+    """
+
+    def __init__(self, job_dir: str):
+        self.job_dir = job_dir
+        self._lock = threading.Lock()
+        os.makedirs(job_dir, exist_ok=True)
+        try:
+            with open(os.path.join(job_dir, _STATE_FILE), 'r', encoding='utf-8') as f:
+                self.state = json.load(f)
+        except (OSError, ValueError):
+            self.state = {'created': time.time()}
+
+    @classmethod
+    def open(cls, key: str, journal_dir: str = DEFAULT_JOURNAL_DIR) -> 'JobJournal':
+        prune_stale_jobs(journal_dir)
+        return cls(os.path.join(journal_dir, key))
+
+    @classmethod
+    @contextmanager
+    def exclusive(cls, key: str, journal_dir: str = DEFAULT_JOURNAL_DIR,
+                  on_wait: Optional[Callable[[], None]] = None):
+        """独占打开任务日志，with 块结束时释放
+
+        同一任务键已被其他进程持有时等待，期间每次检查前调用 on_wait（可以
+        抛出异常放弃等待）。拿到锁后才读取日志：前一个持有者失败时从它
+        留下的进度继续，已完成时得到一个空日志。
+        """
+        os.makedirs(journal_dir, exist_ok=True)
+        with open(os.path.join(journal_dir, key + _LOCK_SUFFIX), 'a') as lock_file:
+            if fcntl:
+                while True:
+                    try:
+                        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        break
+                    except BlockingIOError:
+                        if on_wait:
+                            on_wait()
+                        time.sleep(_LOCK_POLL)
+            try:
+                # 刷新修改时间，使用中的锁文件不会被当作过期清理
+                os.utime(lock_file.name)
+                yield cls.open(key, journal_dir)
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _save(self) -> None:
+        self.state['updated'] = time.time()
+        write_json(os.path.join(self.job_dir, _STATE_FILE), self.state)
+
+    @property
+    def audio_path(self) -> Optional[str]:
+        """已保存的音频路径，文件不存在时为 None"""
+        path = self.state.get('audio')
+        return os.path.join(self.job_dir, path) if path and os.path.exists(os.path.join(self.job_dir, path)) else None
+
+    @property
+    def duration(self) -> Optional[float]:
+        return self.state.get('duration')
+
+    @property
+    def offset_map(self) -> Optional[dict]:
+        """裁剪静音时的偏移表（silence_trim.OffsetMap.to_dict()），未裁剪时为 None"""
+        return self.state.get('offset_map')
+
+    def adopt_audio(self, audio_path: str, duration: float, offset_map: Optional[dict] = None) -> str:
+        """把提取出的音频移入任务目录，返回新路径
+
+        音频要在进程退出后保留以便续传，所以不能留在临时目录中；任务目录
+        的实际大小由 scratch.ScratchSpace 计入磁盘配额。
+        """
+        name = 'audio' + os.path.splitext(audio_path)[1]
+        target = os.path.join(self.job_dir, name)
+        shutil.move(audio_path, target)
+        with self._lock:
+            self.state['audio'] = name
+            self.state['duration'] = duration
+            self.state['offset_map'] = offset_map
+            self._save()
+        return target
+
+    @property
+    def chunks(self) -> Optional[List[Tuple[float, float]]]:
+        chunks = self.state.get('chunks')
+        return [tuple(c) for c in chunks] if chunks is not None else None
+
+    def plan(self, chunks: List[Tuple[float, float]]) -> None:
+        """记录分块计划，恢复时必须沿用同一个计划，已完成的分块才能对上"""
+        with self._lock:
+            self.state['chunks'] = [list(c) for c in chunks]
+            self._save()
+
+    def _chunk_path(self, index: int) -> str:
+        return os.path.join(self.job_dir, f"chunk_{index:04d}.json")
+
+    def completed(self) -> Dict[int, Tuple[float, dict]]:
+        """已完成的分块：{下标: (音频偏移, 转录字典)}"""
+        done = {}
+        for index in range(len(self.chunks or [])):
+            try:
+                with open(self._chunk_path(index), 'r', encoding='utf-8') as f:
+                    entry = json.load(f)
+            except (OSError, ValueError):
+                continue
+            done[index] = (entry['offset'], entry['data'])
+        return done
+
+    def complete_chunk(self, index: int, offset: float, data: dict) -> None:
+        write_json(self._chunk_path(index), {'offset': offset, 'data': data})
+
+    def progress(self) -> Tuple[int, int]:
+        """(已完成分块数, 总分块数)"""
+        return len(self.completed()), len(self.chunks or [])
+
+    def finish(self) -> None:
+        """任务完成，删除日志目录（包括保存的音频）"""
+        shutil.rmtree(self.job_dir, ignore_errors=True)
+
+
+def prune_stale_jobs(journal_dir: str = DEFAULT_JOURNAL_DIR, max_age: float = JOB_MAX_AGE_SECONDS) -> int:
+    """删除长时间未更新的任务目录和锁文件，返回删除的数量"""
+    if not os.path.isdir(journal_dir):
+        return 0
+    removed = 0
+    now = time.time()
+    for name in os.listdir(journal_dir):
+        job_dir = os.path.join(journal_dir, name)
+        try:
+            stale = now - os.stat(job_dir).st_mtime > max_age
+        except OSError:
+            continue
+        if stale:
+            if os.path.isdir(job_dir):
+                shutil.rmtree(job_dir, ignore_errors=True)
+            else:
+                try:
+                    os.unlink(job_dir)
+                except FileNotFoundError:
+                    continue
+            removed += 1
+    return removed
@@ -0,0 +1,138 @@
+"""探测媒体文件中的音频流
+
+imageio-ffmpeg 只附带 ffmpeg 而没有 ffprobe，这里解析 `ffmpeg -i` 输出的
+流信息，得到每个音频流的编码、采样率、声道、语言和是否为默认音轨。
+"""
+import re
+import subprocess
+from typing import List, Optional, Tuple
+
+from ffmpeg_backends import get_ffmpeg_exe
+
+# 转录接口可以直接接受的音频编码，以及流复制时使用的容器扩展名
+STREAM_COPY_CONTAINERS = {
+    'aac': '.m4a',
+    'mp3': '.mp3',
+    'opus': '.ogg',
+    'vorbis': '.ogg',
+    'flac': '.flac',
+}
+
+_DURATION_RE = re.compile(r"Duration:\s*(\d+):(\d+):(\d+(?:\.\d+)?)")
+_STREAM_RE = re.compile(r"Stream #\d+:(\d+)(?:\[\w+\])?(?:\((\w+)\))?: Audio: (\w+)(.*)")
+_SAMPLE_RATE_RE = re.compile(r"(\d+) Hz")
+_CHANNELS_RE = re.compile(r"Hz, ([^,]+)")
+_BITRATE_RE = re.compile(r"(\d+) kb/s")
+
+
+class AudioStream:
+    """一个音频流；index 为在文件所有流中的序号，audio_index 为在音频流中的序号"""
+
+    def __init__(self, index: int, audio_index: int, codec: str, language: Optional[str] = None,
+                 sample_rate: Optional[int] = None, channels: Optional[str] = None,
+                 bitrate_kbps: Optional[int] = None, default: bool = False):
+        self.index = index
+        self.audio_index = audio_index
+        self.codec = codec
+        self.language = language
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.bitrate_kbps = bitrate_kbps
+        self.default = default
+
+    @property
+    def can_stream_copy(self) -> bool:
+        return self.codec in STREAM_COPY_CONTAINERS
+
+    def describe(self) -> str:
+        parts = [f"#{self.audio_index}", self.codec]
+        if self.language and self.language != 'und':
+            parts.append(self.language)
+        if self.channels:
+            parts.append(self.channels)
+        if self.bitrate_kbps:
+            parts.append(f"{self.bitrate_kbps} kb/s")
+        return " ".join(parts)
+
+    def __repr__(self):
+        return f"AudioStream({self.describe()})"
+
+
+def parse_audio_streams(ffmpeg_output: str) -> List[AudioStream]:
+    """从 `ffmpeg -i` 的输出中解析音频流"""
+    streams = []
+    for line in ffmpeg_output.splitlines():
+        match = _STREAM_RE.search(line)
+        if not match:
+            continue
+        index, language, codec, rest = match.groups()
+        sample_rate = _SAMPLE_RATE_RE.search(rest)
+        channels = _CHANNELS_RE.search(rest)
+        bitrate = _BITRATE_RE.search(rest)
+        streams.append(AudioStream(
+            index=int(index),
+            audio_index=len(streams),
+            codec=codec,
+            language=language,
+            sample_rate=int(sample_rate.group(1)) if sample_rate else None,
+            channels=channels.group(1).strip() if channels else None,
+            bitrate_kbps=int(bitrate.group(1)) if bitrate else None,
+            default='(default)' in rest,
+        ))
+    return streams
+
+
+def parse_duration(ffmpeg_output: str) -> Optional[float]:
+    """容器头中记录的时长（秒），未知（如直播流）时为 None"""
+    match = _DURATION_RE.search(ffmpeg_output)
+    if not match:
+        return None
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def probe_media(path: str) -> Tuple[Optional[float], List[AudioStream]]:
+    """读取文件头，返回 (时长, 音频流列表)，不解码"""
+    # 只给输入不给输出时 ffmpeg 会以非零状态退出，流信息照常写在 stderr
+    result = subprocess.run(
+        [get_ffmpeg_exe(), "-hide_banner", "-nostdin", "-i", path],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+    )
+    output = result.stderr.decode("utf-8", errors="replace")
+    return parse_duration(output), parse_audio_streams(output)
+
+
+def probe_audio_streams(path: str) -> List[AudioStream]:
+    """列出文件中的音频流（不解码）"""
+    return probe_media(path)[1]
+
+
+def select_audio_stream(streams: List[AudioStream], language: Optional[str] = None,
+                        audio_index: Optional[int] = None) -> Optional[AudioStream]:
+    """选择要转录的音轨
+
+    优先级：指定的音频流序号 → 指定语言（ISO 639-2，如 eng、chi）的音轨 →
+    标记为默认的音轨 → 第一条音轨。
+    """
+    if not streams:
+        return None
+    if audio_index is not None:
+        if not 0 <= audio_index < len(streams):
+            raise ValueError(f"音轨序号 {audio_index} 超出范围（共 {len(streams)} 条音轨）")
+        return streams[audio_index]
+    if language:
+        matches = [s for s in streams if s.language == language]
+        if matches:
+            return next((s for s in matches if s.default), matches[0])
+    return next((s for s in streams if s.default), streams[0])
+
+
+def track_suffixes(streams: List[AudioStream]) -> List[str]:
+    """多音轨输出时每条音轨的文件名后缀：语言代码唯一时用 .eng 这样的后缀，否则用 .track1"""
+    languages = [s.language for s in streams]
+    return [
+        f".{s.language}" if s.language and s.language != 'und' and languages.count(s.language) == 1
+        else f".track{s.audio_index}"
+        for s in streams
+    ]
@@ -0,0 +1,189 @@
+"""分阶段计时与指标
+
+用法：
+
+    with stage('segment', bytes_in=...) as record:
+        segments = ...
+        record['items'] = len(segments)
+
+每次阶段结束都会：
+- 计入进程内的 REGISTRY（Prometheus 风格的计数器和直方图，另保留最近的
+  若干次耗时用于计算 p50/p99）；
+- 追加到当前线程上下文中正在收集的 trace()（用于界面上展示单次运行）；
+- 以一行 JSON 写入 "whisper_subtitles.metrics" 日志（DEBUG 级别）。
+"""
+import contextvars
+import json
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+logger = logging.getLogger("whisper_subtitles.metrics")
+
+# 直方图桶的上界（秒），覆盖从毫秒级的分段到数分钟的转录请求
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+# 每个阶段保留的最近耗时样本数，用于计算分位数
+SAMPLE_WINDOW = 1024
+
+# 阶段记录中按数值累加的字段
+_COUNTED_FIELDS = ('bytes_in', 'bytes_out', 'items')
+
+_current_trace: contextvars.ContextVar = contextvars.ContextVar('metrics_trace', default=None)
+
+
+class StageStats:
+    """单个阶段的累计统计"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)
+        self.count = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.totals = dict.fromkeys(_COUNTED_FIELDS, 0)
+        self.samples = deque(maxlen=SAMPLE_WINDOW)
+
+    def observe(self, record: dict) -> None:
+        seconds = record['seconds']
+        self.count += 1
+        self.total_seconds += seconds
+        if not record['ok']:
+            self.errors += 1
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                self.bucket_counts[i] += 1
+        for field in _COUNTED_FIELDS:
+            self.totals[field] += record.get(field) or 0
+        self.samples.append(seconds)
+
+    def percentile(self, q: float) -> float:
+        """最近样本的 q 分位数（线性插值，与 numpy.percentile 默认方式一致）"""
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        rank = (len(ordered) - 1) * q / 100
+        low = int(rank)
+        high = min(low + 1, len(ordered) - 1)
+        return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+class MetricsRegistry:
+    """进程内的指标汇总，线程安全"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._stages: Dict[str, StageStats] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, record: dict) -> None:
+        with self._lock:
+            stats = self._stages.get(record['stage'])
+            if stats is None:
+                stats = self._stages[record['stage']] = StageStats(self.buckets)
+            stats.observe(record)
+
+    def summary(self) -> List[dict]:
+        """每个阶段一行：次数、失败数、p50/p99/平均耗时、累计字节和条目数"""
+        with self._lock:
+            rows = []
+            for name, stats in sorted(self._stages.items()):
+                rows.append({
+                    'stage': name,
+                    'count': stats.count,
+                    'errors': stats.errors,
+                    'p50_s': round(stats.percentile(50), 4),
+                    'p99_s': round(stats.percentile(99), 4),
+                    'mean_s': round(stats.total_seconds / stats.count, 4) if stats.count else 0.0,
+                    **stats.totals,
+                })
+            return rows
+
+    def to_prometheus(self, prefix: str = "whisper_subtitles") -> str:
+        """导出 Prometheus 文本格式"""
+        lines = [
+            f"# HELP {prefix}_stage_seconds Stage latency in seconds.",
+            f"# TYPE {prefix}_stage_seconds histogram",
+        ]
+        with self._lock:
+            stages = sorted(self._stages.items())
+            for name, stats in stages:
+                for bound, count in zip(stats.buckets, stats.bucket_counts):
+                    lines.append(f'{prefix}_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {count}')
+                lines.append(f'{prefix}_stage_seconds_bucket{{stage="{name}",le="+Inf"}} {stats.count}')
+                lines.append(f'{prefix}_stage_seconds_sum{{stage="{name}"}} {stats.total_seconds:.6f}')
+                lines.append(f'{prefix}_stage_seconds_count{{stage="{name}"}} {stats.count}')
+
+            counters = [('errors', 'Failed stage runs.', lambda s: s.errors)]
+            counters += [(field, f'Total {field.replace("_", " ")} processed by the stage.',
+                          lambda s, field=field: s.totals[field]) for field in _COUNTED_FIELDS]
+            for field, help_text, value in counters:
+                metric = f"{prefix}_stage_{field}_total"
+                lines.append(f"# HELP {metric} {help_text}")
+                lines.append(f"# TYPE {metric} counter")
+                for name, stats in stages:
+                    lines.append(f'{metric}{{stage="{name}"}} {value(stats)}')
+        return "\n".join(lines) + "\n"
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stages.clear()
+
+
+REGISTRY = MetricsRegistry()
+
+
+class Trace:
+    """收集一次运行中各阶段的记录"""
+
+    def __init__(self):
+        self.records: List[dict] = []
+        self._lock = threading.Lock()
+
+    def add(self, record: dict) -> None:
+        with self._lock:
+            self.records.append(record)
+
+
+@contextmanager
+def trace():
+    """在当前上下文中收集阶段记录；线程池中的任务需用 contextvars.copy_context() 传递"""
+    collected = Trace()
+    token = _current_trace.set(collected)
+    try:
+        yield collected
+    finally:
+        _current_trace.reset(token)
+
+
+def record_stage(record: dict, registry: Optional[MetricsRegistry] = None) -> None:
+    """登记一条已完成的阶段记录（也用于合并子进程中收集的记录）"""
+    (registry or REGISTRY).observe(record)
+    current = _current_trace.get()
+    if current is not None:
+        current.add(record)
+    logger.debug(json.dumps(record, ensure_ascii=False))
+
+
+@contextmanager
+def stage(name: str, registry: Optional[MetricsRegistry] = None, **fields):
+    """为一个阶段计时，fields 和 with 块内写入的字段一并记录
+
+    约定的数值字段：bytes_in、bytes_out、items（如段落数、单词数）。
+    阶段抛出异常时记录 ok=False 和错误类型，异常照常向外传播。
+    """
+    record = {'stage': name, **fields}
+    started = time.perf_counter()
+    try:
+        yield record
+        record['ok'] = True
+    except BaseException as e:
+        record['ok'] = False
+        record['error'] = type(e).__name__
+        raise
+    finally:
+        record['seconds'] = time.perf_counter() - started
+        record['ts'] = time.time()
+        record_stage(record, registry)
@@ -0,0 +1,106 @@
+"""基于 asyncio 队列的流水线：提取、转录、分段各阶段重叠执行
+
+每个阶段有自己的工作者数量和执行器（进程池、线程池），阶段之间用有界
+队列连接。上游快于下游时，队列满了上游就会等待（背压），避免提取出的
+音频文件在磁盘上堆积；稳态吞吐量由最慢的阶段决定，而不是各阶段耗时之和。
+"""
+import asyncio
+import time
+from concurrent.futures import Executor
+from typing import Any, Callable, Iterable, List, Optional
+
+# 队列结束标记
+_DONE = object()
+
+
+class Stage:
+    """流水线阶段：func 接收上一阶段的输出，返回交给下一阶段的值"""
+
+    def __init__(self, name: str, func: Callable[[Any], Any], workers: int = 1,
+                 executor: Optional[Executor] = None, queue_depth: int = 1):
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+        # None 表示使用事件循环默认的线程池
+        self.executor = executor
+        # 本阶段输入队列的容量
+        self.queue_depth = max(1, queue_depth)
+
+
+class PipelineJob:
+    """在流水线中流动的任务，记录当前值、错误和各阶段耗时"""
+
+    def __init__(self, index: int, source: Any):
+        self.index = index
+        self.source = source
+        self.value = source
+        self.error: Optional[BaseException] = None
+        self.failed_stage: Optional[str] = None
+        self.timings = {}
+
+
+async def _stage_worker(stage: Stage, inbox: asyncio.Queue, outbox: asyncio.Queue) -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        job = await inbox.get()
+        if job is _DONE:
+            return
+        # 前面阶段失败的任务直接向后传递
+        if job.error is None:
+            started = time.perf_counter()
+            try:
+                job.value = await loop.run_in_executor(stage.executor, stage.func, job.value)
+            except Exception as e:
+                job.error = e
+                job.failed_stage = stage.name
+            job.timings[stage.name] = time.perf_counter() - started
+        await outbox.put(job)
+
+
+async def _run_stage(stage: Stage, inbox: asyncio.Queue, outbox: asyncio.Queue, downstream_workers: int) -> None:
+    workers = [asyncio.create_task(_stage_worker(stage, inbox, outbox)) for _ in range(stage.workers)]
+    await asyncio.gather(*workers)
+    for _ in range(downstream_workers):
+        await outbox.put(_DONE)
+
+
+async def run_pipeline(items: Iterable[Any], stages: List[Stage], result_queue_depth: int = 1,
+                       on_result: Optional[Callable[[PipelineJob], None]] = None) -> List[PipelineJob]:
+    """让 items 依次流过各阶段，返回按完成顺序排列的 PipelineJob 列表
+
+    on_result 在每个任务走完全部阶段（或失败）时立即调用。
+    """
+    queues = [asyncio.Queue(maxsize=stage.queue_depth) for stage in stages]
+    results_queue = asyncio.Queue(maxsize=max(1, result_queue_depth))
+
+    stage_tasks = []
+    for i, stage in enumerate(stages):
+        outbox = queues[i + 1] if i + 1 < len(stages) else results_queue
+        downstream_workers = stages[i + 1].workers if i + 1 < len(stages) else 1
+        stage_tasks.append(asyncio.create_task(_run_stage(stage, queues[i], outbox, downstream_workers)))
+
+    async def feed():
+        for index, item in enumerate(items):
+            await queues[0].put(PipelineJob(index, item))
+        for _ in range(stages[0].workers):
+            await queues[0].put(_DONE)
+
+    feeder = asyncio.create_task(feed())
+
+    results = []
+    while True:
+        job = await results_queue.get()
+        if job is _DONE:
+            break
+        results.append(job)
+        if on_result:
+            on_result(job)
+
+    await asyncio.gather(feeder, *stage_tasks)
+    return results
+
+
+def run_pipeline_sync(items: Iterable[Any], stages: List[Stage], result_queue_depth: int = 1,
+                      on_result: Optional[Callable[[PipelineJob], None]] = None) -> List[PipelineJob]:
+    """run_pipeline 的同步包装，供命令行等非异步代码使用"""
+    return asyncio.run(run_pipeline(items, stages, result_queue_depth, on_result))
@@ -0,0 +1,159 @@
+"""上传后在后台预先提取音频，点击开始时音频通常已经就绪
+
+从上传完成到点击“开始生成字幕”之间往往隔着几秒到几分钟（检查设置、
+输入 API Key）。与 API 无关的准备工作可以在这段时间里完成：上传落盘、
+提取音频、探测时长、裁剪静音，以及计算任务指纹和音频哈希（转录缓存的键）。
+AudioPrefetch 在后台线程中完成这些工作，结果按上传文件和影响提取结果的
+参数标识；点击开始时标识一致就直接接管提取好的音频，否则照常提取。
+
+- 后台线程读取上传内容的独立视图（与上传文件共享同一块内存，不复制），
+  不会和界面线程争用读写位置；
+- 上传文件被替换、移除或相关设置改变时取消：当前步骤结束后不再继续，
+  已生成的文件随临时目录一起删除；
+- 与正式任务一样经过共享调度器的 ffmpeg 名额和临时空间配额；结果在
+  PREFETCH_TTL 秒内无人接管（例如页面已关闭）也会被删除。
+"""
+import io
+import logging
+import os
+import threading
+from typing import Optional
+
+from audio_extraction import extract_audio_from_video
+from journal import upload_fingerprint
+from metrics import trace
+from scheduler import SCHEDULER
+from scratch import SCRATCH, estimate_job_bytes
+from silence_trim import trim_silence
+from transcript_cache import hash_file
+from transcription import probe_duration
+
+logger = logging.getLogger(__name__)
+
+# 预先提取的结果最多保留多久（秒），超时无人接管则删除
+PREFETCH_TTL = float(os.getenv('WHISPER_PREFETCH_TTL', 1800))
+# 点击开始时最多等待仍在进行的预先提取多少秒，超时则改由工作进程从视频提取
+CLAIM_TIMEOUT = 3.0
+
+
+class _Cancelled(Exception):
+    pass
+
+
+class AudioPrefetch:
+    """一个上传文件的后台音频提取
+
+    key 由调用方给出，包含上传文件的标识和影响提取结果的参数，用于判断
+    结果是否还能使用。成功后可读取 fingerprint、audio_path、duration、
+    offset_map 和 audio_hash；records 为各阶段的耗时记录。
+    """
+
+    def __init__(self, key, upload, profile: str, language: Optional[str] = None,
+                 trim_silences: bool = False, ranges: int = 1, owner: str = 'prefetch',
+                 ttl: float = PREFETCH_TTL):
+        self.key = key
+        self.fingerprint: Optional[str] = None
+        self.audio_path: Optional[str] = None
+        self.duration: Optional[float] = None
+        self.offset_map = None
+        self.audio_hash: Optional[str] = None
+        self.error: Optional[BaseException] = None
+        self.records = []
+        self._scratch = None
+        self._claimed = False
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+        self._done = threading.Event()
+        # 被接管或取消后置位，后台线程随即清理
+        self._settled = threading.Event()
+        # BytesIO 以 bytes 初始化时共享内存，getvalue() 也不复制
+        data = upload.getvalue()
+        view = io.BytesIO(data)
+        view.name = getattr(upload, 'name', '')
+        self._thread = threading.Thread(
+            target=self._run, args=(view, len(data), profile, language, trim_silences, ranges, owner, ttl),
+            name=f"prefetch-{owner}", daemon=True
+        )
+        self._thread.start()
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    def _check(self) -> None:
+        if self._cancelled.is_set():
+            raise _Cancelled()
+
+    def _prepare(self, view, size: int, profile: str, language: Optional[str], trim_silences: bool,
+                 ranges: int, owner: str) -> None:
+        self.fingerprint = upload_fingerprint(view)
+        self._scratch = SCRATCH.acquire(estimate_job_bytes(size))
+        self._check()
+        with SCHEDULER.ffmpeg.slot(owner, weight=ranges):
+            self._check()
+            audio_path = extract_audio_from_video(
+                view, profile, language=language, scratch_dir=self._scratch.dir, ranges=ranges
+            )
+            duration = probe_duration(audio_path)
+            self._check()
+            if trim_silences:
+                audio_path, self.offset_map = trim_silence(audio_path, profile, duration,
+                                                           scratch_dir=self._scratch.dir)
+                if self.offset_map:
+                    duration = self.offset_map.compact_duration
+        self._check()
+        self.audio_hash = hash_file(audio_path)
+        self.duration = duration
+        self.audio_path = audio_path
+
+    def _run(self, view, size, profile, language, trim_silences, ranges, owner, ttl) -> None:
+        with trace() as prefetch_trace:
+            try:
+                self._prepare(view, size, profile, language, trim_silences, ranges, owner)
+                logger.info("预先提取音频完成: %s（%.1f 秒）", view.name, self.duration)
+            except _Cancelled:
+                logger.debug("预先提取已取消: %s", view.name)
+            except Exception as e:
+                # 点击开始时会照常重新提取，错误在那里展示
+                logger.warning("预先提取音频失败: %s", e)
+                self.error = e
+            finally:
+                view.close()
+        self.records = prefetch_trace.records
+        if self.audio_path is None:
+            # 失败或已取消，没有可接管的结果，立即清理
+            self._settled.set()
+        self._done.set()
+        self._settled.wait(ttl)
+        with self._lock:
+            if not self._settled.is_set():
+                logger.info("预先提取的音频 %.0f 秒内未被使用，已删除", ttl)
+            self._settled.set()
+            claimed = self._claimed
+        if not claimed:
+            self.release()
+
+    def claim(self, timeout: Optional[float] = None) -> bool:
+        """等待后台提取结束并接管结果，音频可用时返回 True
+
+        接管后临时目录不再自动删除，调用方用完（通常是把音频移入任务日志）
+        后调用 release。
+        """
+        if not self._done.wait(timeout):
+            return False
+        with self._lock:
+            if self.audio_path is None or self._settled.is_set():
+                return False
+            self._claimed = True
+            self._settled.set()
+        return True
+
+    def cancel(self) -> None:
+        """不再需要结果：当前步骤结束后停止，并删除已生成的文件"""
+        self._cancelled.set()
+        self._settled.set()
+
+    def release(self) -> None:
+        """删除临时目录，可重复调用"""
+        if self._scratch:
+            self._scratch.release()
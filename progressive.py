@@ -0,0 +1,38 @@
+"""边转录边输出字幕：每完成一段音频区域就分段，并追加到磁盘上的 SRT 文件"""
+from typing import List
+
+from segmentation import Segment, segment_transcript
+from subtitles import iter_segment_cues, write_subtitles
+from transcription import merge_chunk_transcripts, transcript_from_dict
+
+
+class ProgressiveSubtitles:
+    """按时间顺序接收 transcribe_audio 的 on_chunk 分块，增量生成字幕
+
+    每个分块只保留归属于它的单词和段落（与最终拼接的规则一致）后单独分段，
+    分块边界处会强制断开字幕段；分块切点落在静音处，与整体分段的结果
+    基本一致。path 处的 SRT 文件随时是一份完整、可下载的部分字幕。
+    """
+
+    def __init__(self, path: str, max_chars: int = 26):
+        self.path = path
+        self.max_chars = max_chars
+        self.segments: List[Segment] = []
+        # 已输出字幕覆盖到的时间（秒）
+        self.covered_until = 0.0
+        open(path, 'w', encoding='utf-8').close()
+
+    def add_chunk(self, chunk: tuple) -> List[Segment]:
+        """处理一个完成的分块，返回新增的字幕段"""
+        own_start, own_end, offset, data = chunk
+        region = transcript_from_dict(merge_chunk_transcripts([chunk]))
+        new_segments = segment_transcript(region, self.max_chars)
+        if new_segments:
+            write_subtitles(iter_segment_cues(new_segments), self.path, 'srt',
+                            append=True, start_index=len(self.segments) + 1)
+            self.segments.extend(new_segments)
+        if own_end != float('inf'):
+            self.covered_until = own_end
+        elif self.segments:
+            self.covered_until = self.segments[-1].end
+        return new_segments
@@ -0,0 +1,250 @@
+"""字幕重排：在单词级时间戳上用动态规划计算整体最优的分段和换行
+
+贪心分段逐个单词往当前字幕段里加、放不下才断开，容易留下只有一两个单词
+的尾巴，也不考虑阅读速度。这里把“在哪些单词之后断开”看作最短路径问题：
+每个候选字幕段（连续的若干单词）按排版规则计算代价，动态规划选出总代价
+最小的一组断点，再把每段在最均衡的位置折成不超过 max_lines 行。
+
+- 硬约束：每行不超过 max_chars 个字符，每段不超过 max_lines 行，首尾单词
+  跨度不超过 max_duration（单个单词除外），单词间停顿超过 max_gap 时必须断开；
+- 代价：每段的基础代价、断点不在句末或标点处、段中跨过句子结尾、字数
+  太少、显示时长短于 min_duration、阅读速度超过 max_cps。
+
+一个字幕段最多容纳的单词数由行宽和行数决定，候选字幕段的数量与单词数成
+线性关系：所有候选的代价用 NumPy 一次算出，动态规划每一步只在一小段
+列表上取最小值。结果只依赖单词数组和规则，修改规则后基于缓存的转录结果
+重新计算即可，不需要再调用 API。
+"""
+from operator import add
+from typing import List, Optional
+
+import numpy as np
+
+from metrics import stage
+from segmentation import PAUSE_SECONDS, Segment, build_word_arrays, sentence_ends
+from transcript_arrays import TranscriptArrays
+
+# 默认排版规则，参考常见的字幕规范；界面和命令行的默认值都取自这里
+DEFAULT_LINE_CHARS = 42
+DEFAULT_MAX_LINES = 2
+DEFAULT_MAX_CPS = 17.0
+# 最短显示时长：24 帧/秒下的 20 帧
+DEFAULT_MIN_DURATION = 5 / 6
+DEFAULT_MAX_DURATION = 7.0
+
+# 代价以“多出一个字幕段”为单位
+_CUE_COST = 1.0
+# 断点位置的代价：句子结尾为 0，以下依次递增
+_BREAK_AT_CLAUSE = 0.4
+_BREAK_AT_PAUSE = 0.4
+_BREAK_AT_SEGMENT = 0.6
+_BREAK_ANYWHERE = 2.0
+# 字幕段中间每跨过一个句子结尾的代价
+_SENTENCE_INSIDE = 1.5
+# 字数不足一行时按 (1 - 字数/行宽)^2 计算的代价
+_SHORT_WEIGHT = 1.0
+# 显示时长不足、阅读速度超出限制时，按差额的比例计算的代价
+_DURATION_WEIGHT = 3.0
+_CPS_WEIGHT = 4.0
+# 断点处单词间停顿超过该值（秒）视为自然停顿
+_SOFT_PAUSE = 0.4
+# 折行时断在标点后相当于少偏离均衡长度这么多个字符
+_LINE_PUNCT_BONUS = 4
+CLAUSE_CHARS = ',;:，；：、—'
+
+
+class LayoutRules:
+    """重排规则，默认值参考常见的字幕规范（每行 42 字符、两行、每秒 17 字符）"""
+
+    def __init__(self, max_chars: int = DEFAULT_LINE_CHARS, max_lines: int = DEFAULT_MAX_LINES,
+                 min_duration: float = DEFAULT_MIN_DURATION, max_duration: float = DEFAULT_MAX_DURATION,
+                 max_cps: float = DEFAULT_MAX_CPS, max_gap: float = PAUSE_SECONDS):
+        if max_chars < 1 or max_lines < 1:
+            raise ValueError("max_chars 和 max_lines 至少为 1")
+        self.max_chars = max_chars
+        self.max_lines = max_lines
+        self.min_duration = min_duration
+        self.max_duration = max_duration
+        self.max_cps = max_cps
+        self.max_gap = max_gap
+
+    def key(self) -> tuple:
+        """规则的元组表示，用作缓存键"""
+        return (self.max_chars, self.max_lines, self.min_duration, self.max_duration, self.max_cps, self.max_gap)
+
+    def __repr__(self):
+        return "LayoutRules(max_chars={}, max_lines={}, min_duration={}, max_duration={}, max_cps={}, max_gap={})".format(
+            *self.key())
+
+
+def _line_fit(arrays: TranscriptArrays, max_chars: int) -> np.ndarray:
+    """从每个单词开始的一行最多能放到第几个单词（单个单词超长时单独成行）"""
+    offsets = arrays.offsets
+    fit = np.searchsorted(offsets, offsets[:-1] + max_chars + 1, side='right') - 2
+    return np.maximum(fit, np.arange(len(arrays), dtype=np.int64))
+
+
+def _reach(fit: np.ndarray, lines: int) -> np.ndarray:
+    """从每个单词开始、贪心排满 lines 行最多能放到第几个单词
+
+    贪心每行尽量多放，得到的就是 lines 行内能容纳的最远单词；fit 单调不减，
+    结果也单调不减。
+    """
+    n = len(fit)
+    reach = fit
+    for _ in range(lines - 1):
+        reach = np.where(reach >= n - 1, n - 1, fit[np.minimum(reach + 1, n - 1)])
+    return reach
+
+
+def _break_penalties(arrays: TranscriptArrays, sentence_end: np.ndarray,
+                     segment_last: Optional[np.ndarray]) -> np.ndarray:
+    """在每个单词之后断开的代价"""
+    penalty = np.full(len(arrays), _BREAK_ANYWHERE)
+    penalty[arrays.gaps() >= _SOFT_PAUSE] = _BREAK_AT_PAUSE
+    if segment_last is not None:
+        penalty[segment_last] = np.minimum(penalty[segment_last], _BREAK_AT_SEGMENT)
+    clause = np.isin(arrays.last_chars(), [ord(c) for c in CLAUSE_CHARS])
+    penalty[clause] = np.minimum(penalty[clause], _BREAK_AT_CLAUSE)
+    penalty[sentence_end] = 0.0
+    penalty[-1] = 0.0
+    return penalty
+
+
+def _display_end(start: np.ndarray, end: np.ndarray, chars: np.ndarray, next_start: np.ndarray,
+                 rules: LayoutRules) -> np.ndarray:
+    """字幕的显示结束时间：太短或读不完时向后延长，但不超过下一个单词的开始和最长时长"""
+    wanted = np.maximum(start + rules.min_duration, start + chars / rules.max_cps)
+    limit = np.minimum(next_start, start + rules.max_duration)
+    return np.maximum(end, np.minimum(wanted, limit))
+
+
+def _choose_cues(arrays: TranscriptArrays, segment_last: Optional[np.ndarray],
+                 rules: LayoutRules, fit: np.ndarray, sentence_end: np.ndarray) -> List[tuple]:
+    """动态规划选出总代价最小的字幕段，返回 [(首单词, 末单词), ...]"""
+    n = len(arrays)
+    starts = np.arange(n, dtype=np.int64)
+    # 以第 j 个单词结尾的字幕段最早从第 lo[j] 个单词开始：能在 max_lines 行内放下、
+    # 跨度不超过 max_duration，且不跨过必须断开的停顿
+    lo = np.searchsorted(_reach(fit, rules.max_lines), starts, side='left')
+    lo = np.maximum(lo, np.minimum(np.searchsorted(arrays.start, arrays.end - rules.max_duration), starts))
+    forced = np.where(arrays.gaps() > rules.max_gap, starts, -1)
+    floor = np.zeros(n, dtype=np.int64)
+    floor[1:] = np.maximum.accumulate(forced)[:-1] + 1
+    lo = np.maximum(lo, floor)
+
+    # 展开所有候选字幕段 (i, j)，同一个 j 的候选按 i 递增排列
+    counts = starts - lo + 1
+    j = np.repeat(starts, counts)
+    i = np.arange(len(j)) - np.repeat(np.cumsum(counts) - counts - lo, counts)
+
+    offsets = arrays.offsets
+    chars = offsets[j + 1] - 1 - offsets[i]
+    next_start = np.append(arrays.start[1:], np.inf)[j]
+    start = arrays.start[i]
+    duration = np.maximum(_display_end(start, arrays.end[j], chars, next_start, rules) - start, 1e-3)
+    sentences_before = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(sentence_end, out=sentences_before[1:])
+
+    cost = (
+        _CUE_COST
+        + _break_penalties(arrays, sentence_end, segment_last)[j]
+        + _SENTENCE_INSIDE * (sentences_before[j] - sentences_before[i])
+        + _SHORT_WEIGHT * np.square(np.maximum(0.0, 1.0 - chars / rules.max_chars))
+        + _DURATION_WEIGHT * np.maximum(0.0, rules.min_duration - duration) / rules.min_duration
+        + _CPS_WEIGHT * np.maximum(0.0, chars / duration - rules.max_cps) / rules.max_cps
+    )
+
+    # best[k] 为前 k 个单词的最小总代价；第 j 步的候选与 best[lo[j]:j+1] 一一对应
+    flat = cost.tolist()
+    lo_list = lo.tolist()
+    best = [0.0]
+    back = []
+    append_best, append_back = best.append, back.append
+    position = 0
+    for last, first in enumerate(lo_list):
+        stop = position + last - first + 1
+        values = list(map(add, best[first:last + 1], flat[position:stop]))
+        position = stop
+        minimum = min(values)
+        append_best(minimum)
+        append_back(first + values.index(minimum))
+
+    cues = []
+    last = n - 1
+    while last >= 0:
+        cues.append((back[last], last))
+        last = back[last] - 1
+    cues.reverse()
+    return cues
+
+
+def _break_lines(arrays: TranscriptArrays, first: int, last: int, rules: LayoutRules,
+                 fit: List[int], offsets: List[int], line_break_ok: List[bool]) -> str:
+    """把一个字幕段折成不超过 max_lines 行，各行长度尽量均衡，优先断在标点后"""
+
+    def chars(a: int, b: int) -> int:
+        return offsets[b + 1] - 1 - offsets[a]
+
+    def lines_needed(a: int) -> int:
+        count = 1
+        while fit[a] < last:
+            a = fit[a] + 1
+            count += 1
+        return count
+
+    lines = []
+    lines_left = rules.max_lines
+    while chars(first, last) > rules.max_chars and lines_left > 1:
+        needed = min(lines_needed(first), lines_left)
+        target = (chars(first, last) - (needed - 1)) / needed
+        choice = None
+        for end in range(first, min(fit[first], last - 1) + 1):
+            if lines_needed(end + 1) > lines_left - 1:
+                continue
+            length = chars(first, end)
+            score = (abs(length - target) - (_LINE_PUNCT_BONUS if line_break_ok[end] else 0), length)
+            if choice is None or score < choice[0]:
+                choice = (score, end)
+        if choice is None:
+            break
+        lines.append(arrays.text(first, choice[1]))
+        first = choice[1] + 1
+        lines_left -= 1
+    lines.append(arrays.text(first, last))
+    return "\n".join(lines)
+
+
+def reflow_arrays(arrays: Optional[TranscriptArrays], segment_last: Optional[np.ndarray] = None,
+                  rules: Optional[LayoutRules] = None) -> List[Segment]:
+    """对 build_word_arrays 的结果重排，返回多行文本（以换行分隔）的字幕段"""
+    if arrays is None or len(arrays) == 0:
+        return []
+    rules = rules or LayoutRules()
+    with stage('reflow', bytes_in=len(arrays.buffer)) as record:
+        fit = _line_fit(arrays, rules.max_chars)
+        sentence_end = sentence_ends(arrays)
+        cues = _choose_cues(arrays, segment_last, rules, fit, sentence_end)
+
+        line_break_ok = (sentence_end | np.isin(arrays.last_chars(), [ord(c) for c in CLAUSE_CHARS])).tolist()
+        fit_list = fit.tolist()
+        offsets = arrays.offsets.tolist()
+        first_words = np.array([first for first, _ in cues], dtype=np.int64)
+        last_words = np.array([last for _, last in cues], dtype=np.int64)
+        chars = arrays.offsets[last_words + 1] - 1 - arrays.offsets[first_words]
+        next_start = np.append(arrays.start[first_words[1:]], np.inf)
+        ends = _display_end(arrays.start[first_words], arrays.end[last_words], chars, next_start, rules).tolist()
+        starts = arrays.start[first_words].tolist()
+
+        segments = [
+            Segment(_break_lines(arrays, first, last, rules, fit_list, offsets, line_break_ok), starts[k], ends[k])
+            for k, (first, last) in enumerate(cues)
+        ]
+        record['items'] = len(segments)
+    return segments
+
+
+def reflow_transcript(transcript, rules: Optional[LayoutRules] = None) -> List[Segment]:
+    """按排版规则重排转录结果"""
+    arrays, segment_last = build_word_arrays(transcript)
+    return reflow_arrays(arrays, segment_last, rules)
@@ -0,0 +1,356 @@
+"""进程内共享的调度器：所有会话共用 API 客户端、请求限流和 ffmpeg 并发名额
+
+Streamlit 的所有会话运行在同一个进程中。每个会话各自创建客户端、立即
+启动 ffmpeg 和转录时，多人同时上传会触发 API 限流（429），同时运行的
+ffmpeg 进程数也会远超 CPU 核数。这里提供进程级的共享资源：
+
+- 按 API Key 复用的 OpenAI 客户端，连接池在会话之间共享；
+- 令牌桶限流：每分钟请求数和每分钟上传的音频秒数，收到 429 时所有会话
+  一起暂停，而不是各自重试、同时再撞上限流；
+- 有界的公平队列：ffmpeg 提取、同时进行的请求数各有上限，等待者按会话
+  轮流获得名额，并能看到自己的排队位置。
+
+同时运行的任务数由后台任务服务的工作进程数限制（见 jobs.py）。工作进程
+通过 RemoteScheduler 使用服务进程中的这一份调度器（Scheduler.serve 在
+后台线程中提供）：令牌桶、429 暂停和各类名额在所有进程之间只有一份，
+客户端和连接池则在各个工作进程中创建。工作进程占用的名额按进程号记录，
+进程异常退出（如内存不足被结束）时由任务服务调用 Scheduler.reclaim 收回。
+
+可用环境变量调整上限，设为 0 表示不限制对应的速率。
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from multiprocessing.managers import BaseManager
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 每分钟最多发出的转录请求数（0 表示不限制）
+REQUESTS_PER_MINUTE = float(os.getenv('WHISPER_REQUESTS_PER_MINUTE', 50))
+# 每分钟最多上传的音频秒数（0 表示不限制）
+AUDIO_SECONDS_PER_MINUTE = float(os.getenv('WHISPER_AUDIO_SECONDS_PER_MINUTE', 0))
+# 同时进行的转录请求数
+MAX_CONCURRENT_REQUESTS = int(os.getenv('WHISPER_MAX_CONCURRENT_REQUESTS', 8))
+# 同时运行的 ffmpeg 解码进程数
+FFMPEG_SLOTS = int(os.getenv('WHISPER_FFMPEG_SLOTS', os.cpu_count() or 1))
+# 收到 429 但响应中没有 Retry-After 时，所有会话暂停的秒数
+RATE_LIMIT_PAUSE = 5.0
+# 令牌桶最多积攒多少秒的令牌，限制突发
+_BURST_SECONDS = 10.0
+_POLL = 0.5
+
+
+class TokenBucket:
+    """令牌桶：每分钟补充 per_minute 个令牌，最多积攒 _BURST_SECONDS 秒的量
+
+    reserve 立即扣除令牌并返回需要等待的秒数。令牌不足时余额为负（欠账），
+    之后的预约排在后面，等待时间按预约的先后依次增加，不会同时醒来。
+    """
+
+    def __init__(self, per_minute: float, clock=time.monotonic):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * _BURST_SECONDS)
+        self.tokens = self.capacity
+        self._clock = clock
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount: float = 1.0) -> float:
+        """预约 amount 个令牌，返回需要等待的秒数"""
+        with self._lock:
+            self._refill()
+            self.tokens -= amount
+            return max(0.0, -self.tokens / self.rate)
+
+    def pause(self, seconds: float) -> None:
+        """之后的预约至少再等待 seconds 秒（收到限流响应时调用）"""
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.tokens, -seconds * self.rate)
+
+
+class FairSemaphore:
+    """名额有限的资源，等待者按会话（owner）轮流获得名额
+
+    同一会话的请求按先后排队，不同会话之间轮转：一个会话排了很多请求，
+    其他会话也只需等它的一个请求。weight 为占用的名额数（不超过容量）。
+    """
+
+    def __init__(self, name: str, capacity: int):
+        self.name = name
+        self.capacity = max(1, capacity)
+        self.in_use = 0
+        self._cond = threading.Condition()
+        # 每个会话的等待队列；_rotation 为有等待者的会话，队首的会话下一个获得名额
+        self._queues: Dict[str, deque] = {}
+        self._rotation: deque = deque()
+
+    def _service_order(self) -> List[object]:
+        """当前所有等待者获得名额的先后顺序：各会话轮流取一个"""
+        queues = [self._queues[owner] for owner in self._rotation]
+        order = []
+        for depth in range(max((len(q) for q in queues), default=0)):
+            order.extend(q[depth] for q in queues if depth < len(q))
+        return order
+
+    def _leave(self, owner: str, ticket: object) -> None:
+        queue = self._queues[owner]
+        queue.remove(ticket)
+        self._rotation.remove(owner)
+        if queue:
+            # 刚获得名额的会话轮到队尾
+            self._rotation.append(owner)
+        else:
+            del self._queues[owner]
+
+    def acquire(self, owner: str, weight: int = 1, on_wait: Optional[Callable[[int], None]] = None) -> int:
+        """等待并占用 weight 个名额，返回实际占用数
+
+        需要等待时调用 on_wait(前面的等待者数)，排队位置变化时再次调用。
+        """
+        weight = min(max(1, weight), self.capacity)
+        ticket = object()
+        with self._cond:
+            if owner not in self._queues:
+                self._queues[owner] = deque()
+                self._rotation.append(owner)
+            self._queues[owner].append(ticket)
+            reported = None
+            try:
+                while True:
+                    ahead = self._service_order().index(ticket)
+                    if ahead == 0 and self.in_use + weight <= self.capacity:
+                        break
+                    if on_wait and ahead != reported:
+                        on_wait(ahead)
+                        reported = ahead
+                    self._cond.wait(_POLL)
+            finally:
+                self._leave(owner, ticket)
+                self._cond.notify_all()
+            self.in_use += weight
+        if reported is not None:
+            logger.debug("%s：会话 %s 排队后获得名额", self.name, owner)
+        return weight
+
+    def release(self, weight: int = 1) -> None:
+        with self._cond:
+            self.in_use -= weight
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, owner: str, weight: int = 1, on_wait: Optional[Callable[[int], None]] = None):
+        weight = self.acquire(owner, weight, on_wait)
+        try:
+            yield
+        finally:
+            self.release(weight)
+
+    def waiting(self) -> int:
+        with self._cond:
+            return sum(len(q) for q in self._queues.values())
+
+
+class RequestGate:
+    """一个会话的 API 请求闸门，交给 transcribe_audio 的 gate 参数"""
+
+    def __init__(self, scheduler: 'Scheduler', owner: str):
+        self.scheduler = scheduler
+        self.owner = owner
+
+    @contextmanager
+    def request(self, audio_seconds: Optional[float] = None):
+        """占用一个请求名额并按限流等待，with 块中发出请求"""
+        with self.scheduler.slot('requests', self.owner):
+            delay = self.scheduler.reserve(audio_seconds)
+            if delay > 0:
+                logger.debug("限流：会话 %s 的请求等待 %.1f 秒", self.owner, delay)
+                time.sleep(delay)
+            yield
+
+    def rate_limited(self, retry_after: Optional[float] = None) -> None:
+        """请求收到 429：所有会话暂停 retry_after 秒"""
+        self.scheduler.pause(retry_after or RATE_LIMIT_PAUSE)
+
+
+class _SchedulerManager(BaseManager):
+    """在进程之间提供调度器的 multiprocessing 管理器"""
+
+
+class Scheduler:
+    """进程内共享的客户端、限流器和并发名额
+
+    名额按资源名（'requests'、'ffmpeg'）通过 acquire/release/slot 使用，
+    这些方法和 reserve、pause 都可以经 RemoteScheduler 从其他进程调用。
+    其他进程占用名额时传入 holder（进程号），进程退出后用 reclaim 收回。
+    """
+
+    def __init__(self, requests_per_minute: float = REQUESTS_PER_MINUTE,
+                 audio_seconds_per_minute: float = AUDIO_SECONDS_PER_MINUTE,
+                 max_requests: int = MAX_CONCURRENT_REQUESTS, ffmpeg_slots: int = FFMPEG_SLOTS):
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        self.audio_bucket = TokenBucket(audio_seconds_per_minute) if audio_seconds_per_minute > 0 else None
+        self.requests = FairSemaphore('转录请求', max_requests)
+        self.ffmpeg = FairSemaphore('音频提取', ffmpeg_slots)
+        self._clients = {}
+        self._lock = threading.Lock()
+        self._address: Optional[Tuple[str, bytes]] = None
+        # 各进程占用的名额：holder -> [(资源名, 名额数)]；_reclaimed 为已收回名额的进程
+        self._leases: Dict[int, List[Tuple[str, int]]] = {}
+        self._reclaimed = set()
+
+    def client(self, api_key: str, **kwargs):
+        """按 API Key（和 base_url 等参数）复用的 OpenAI 客户端
+
+        SDK 自身不重试（max_retries=0），重试都经过 transcription.call_with_retries
+        和这里的限流。
+        """
+        key = (api_key, tuple(sorted(kwargs.items())))
+        with self._lock:
+            if key not in self._clients:
+                from openai import OpenAI
+                self._clients[key] = OpenAI(api_key=api_key, max_retries=0, **kwargs)
+            return self._clients[key]
+
+    def gate(self, owner: str) -> RequestGate:
+        return RequestGate(self, owner)
+
+    def acquire(self, resource: str, owner: str, weight: int = 1,
+                on_wait: Optional[Callable[[int], None]] = None, holder: Optional[int] = None) -> int:
+        """占用 resource（'requests' 或 'ffmpeg'）的 weight 个名额，见 FairSemaphore.acquire
+
+        holder 为占用名额的进程号，给出时记录下来，进程退出后由 reclaim 收回。
+        """
+        weight = getattr(self, resource).acquire(owner, weight, on_wait)
+        if holder is not None:
+            with self._lock:
+                if holder not in self._reclaimed:
+                    self._leases.setdefault(holder, []).append((resource, weight))
+                    return weight
+            # 排队期间进程已退出、名额已被收回，拿到的名额直接还回去
+            getattr(self, resource).release(weight)
+        return weight
+
+    def release(self, resource: str, weight: int = 1, holder: Optional[int] = None) -> None:
+        if holder is not None:
+            with self._lock:
+                leases = self._leases.get(holder, [])
+                if (resource, weight) not in leases:
+                    # 已经被 reclaim 收回
+                    return
+                leases.remove((resource, weight))
+                if not leases:
+                    del self._leases[holder]
+        getattr(self, resource).release(weight)
+
+    def reclaim(self, holder: int) -> int:
+        """收回进程 holder 占用的所有名额（进程异常退出时调用），返回收回的名额数
+
+        之后该进程再释放名额会被忽略，排队中拿到的名额也会立即还回。
+        """
+        with self._lock:
+            self._reclaimed.add(holder)
+            leases = self._leases.pop(holder, [])
+        for resource, weight in leases:
+            getattr(self, resource).release(weight)
+        reclaimed = sum(weight for _, weight in leases)
+        if reclaimed:
+            logger.warning("收回已退出的进程 %s 占用的 %d 个名额", holder, reclaimed)
+        return reclaimed
+
+    @contextmanager
+    def slot(self, resource: str, owner: str, weight: int = 1,
+             on_wait: Optional[Callable[[int], None]] = None):
+        weight = self.acquire(resource, owner, weight, on_wait)
+        try:
+            yield
+        finally:
+            self.release(resource, weight)
+
+    def reserve(self, audio_seconds: Optional[float] = None) -> float:
+        """为一个请求预约令牌，返回需要等待的秒数"""
+        delay = 0.0
+        if self.request_bucket:
+            delay = self.request_bucket.reserve(1)
+        if self.audio_bucket and audio_seconds:
+            delay = max(delay, self.audio_bucket.reserve(audio_seconds))
+        return delay
+
+    def pause(self, seconds: float) -> None:
+        logger.warning("⏸️ 收到 API 限流响应，所有请求暂停 %.1f 秒", seconds)
+        for bucket in (self.request_bucket, self.audio_bucket):
+            if bucket:
+                bucket.pause(seconds)
+
+    def snapshot(self) -> List[dict]:
+        """各类名额的占用和排队情况，用于界面展示"""
+        return [
+            {'资源': resource.name, '占用': resource.in_use, '上限': resource.capacity, '排队': resource.waiting()}
+            for resource in (self.ffmpeg, self.requests)
+        ]
+
+    def serve(self) -> Tuple[str, bytes]:
+        """在后台线程中把本调度器提供给其他进程，返回 (地址, 认证密钥)，可重复调用"""
+        with self._lock:
+            if self._address is None:
+                scheduler = self
+
+                class Manager(_SchedulerManager):
+                    pass
+
+                Manager.register('scheduler', callable=lambda: scheduler)
+                server = Manager(authkey=os.urandom(32)).get_server()
+                threading.Thread(target=server.serve_forever, name='scheduler-server', daemon=True).start()
+                self._address = (server.address, bytes(server.authkey))
+                logger.debug("调度器服务地址: %s", server.address)
+            return self._address
+
+
+class RemoteScheduler(Scheduler):
+    """其他进程中的调度器（见 Scheduler.serve）
+
+    名额、令牌桶和限流暂停都转发给服务进程中的调度器，所有进程共用；
+    名额按本进程的进程号记录，本进程异常退出后可以收回。OpenAI 客户端
+    在本进程中创建。排队时不能回调 on_wait。
+    """
+
+    def __init__(self, address: str, authkey: bytes):
+        self._clients = {}
+        self._lock = threading.Lock()
+        manager = _SchedulerManager(address=address, authkey=authkey)
+        manager.connect()
+        # 代理对象在每个线程中各用一个连接，可以被并发的分块请求同时使用
+        self._shared = manager.scheduler()
+
+    def acquire(self, resource: str, owner: str, weight: int = 1,
+                on_wait: Optional[Callable[[int], None]] = None) -> int:
+        return self._shared.acquire(resource, owner, weight, None, os.getpid())
+
+    def release(self, resource: str, weight: int = 1, holder: Optional[int] = None) -> None:
+        self._shared.release(resource, weight, os.getpid())
+
+    def reclaim(self, holder: int) -> int:
+        return self._shared.reclaim(holder)
+
+    def reserve(self, audio_seconds: Optional[float] = None) -> float:
+        return self._shared.reserve(audio_seconds)
+
+    def pause(self, seconds: float) -> None:
+        self._shared.pause(seconds)
+
+    def snapshot(self) -> List[dict]:
+        return self._shared.snapshot()
+
+
+_SchedulerManager.register('scheduler')
+
+SCHEDULER = Scheduler()
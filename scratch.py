@@ -0,0 +1,238 @@
+"""临时文件空间：每个任务一个临时目录，全局配额与准入控制，任何退出路径都会清理
+
+任务开始前按预估大小申请一个目录（ScratchSpace.job），上传落盘、提取出的
+音频、裁剪后的音频和分块音频都写在其中，任务结束（包括抛出异常）时整个
+目录删除。预估较小的任务放在内存盘（/dev/shm）上，其余放在磁盘上。
+
+配额在同一台机器的所有进程之间共享：每个任务目录中记录申请的字节数和
+进程号，申请时在文件锁保护下汇总仍在运行的任务；超出配额时等待其他任务
+释放，超时则报错。进程被强制结束后留下的目录，会在下次申请时清理。
+
+提取出的音频在转录前移入任务日志目录（见 journal.py），以便中断后续传；
+这部分不再属于某个临时目录，但仍占用同一块磁盘，因此任务日志目录中
+文件的实际大小也计入磁盘配额，直到任务完成或日志过期被清理。
+"""
+import atexit
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from journal import DEFAULT_JOURNAL_DIR
+
+try:
+    import fcntl
+except ImportError:  # Windows 上没有 fcntl，只在进程内加锁
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+_MB = 1024 * 1024
+
+DEFAULT_SCRATCH_DIR = os.getenv(
+    'WHISPER_SCRATCH_DIR', os.path.join(tempfile.gettempdir(), 'whisper_scratch')
+)
+# 所有任务目录合计的上限（按申请时的预估大小计算，另加任务日志目录的实际大小）
+DEFAULT_QUOTA_BYTES = int(os.getenv('WHISPER_SCRATCH_QUOTA_MB', 20 * 1024)) * _MB
+# 内存盘目录，设为空字符串则不使用内存盘
+DEFAULT_RAM_DIR = os.getenv(
+    'WHISPER_RAM_SCRATCH_DIR', '/dev/shm/whisper_scratch' if os.path.isdir('/dev/shm') else ''
+)
+# 预估不超过该大小的任务放在内存盘上
+RAM_JOB_MAX_BYTES = int(os.getenv('WHISPER_RAM_JOB_MAX_MB', 256)) * _MB
+# 内存盘上所有任务合计的上限
+RAM_QUOTA_BYTES = int(os.getenv('WHISPER_RAM_SCRATCH_QUOTA_MB', 1024)) * _MB
+# 等待配额的最长时间（秒）和检查间隔
+ADMISSION_TIMEOUT = 600.0
+_ADMISSION_POLL = 0.5
+_RESERVATION_FILE = '.reservation'
+_LOCK_FILE = '.lock'
+
+
+class ScratchSpaceFull(RuntimeError):
+    """等待超时仍没有足够的临时空间"""
+
+
+def estimate_job_bytes(video_bytes: int, spooled: bool = True) -> int:
+    """粗略估计一个任务需要的临时空间
+
+    上传文件需要先落盘（spooled），再加上提取出的音频、裁剪后的音频和
+    分块音频；压缩音频通常远小于视频，按视频大小的 1/4 留足余量。
+    """
+    return (video_bytes if spooled else 0) + video_bytes // 4 + 16 * _MB
+
+
+def pid_alive(pid: Optional[int]) -> bool:
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def directory_usage(path: str) -> int:
+    """目录中文件的实际总大小"""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class ScratchJob:
+    """一个任务的临时目录"""
+
+    def __init__(self, space: 'ScratchSpace', path: str, reserved_bytes: int, in_ram: bool):
+        self.space = space
+        self.dir = path
+        self.reserved_bytes = reserved_bytes
+        self.in_ram = in_ram
+
+    def usage(self) -> int:
+        """目录中文件的实际总大小"""
+        return directory_usage(self.dir)
+
+    def release(self) -> None:
+        """删除目录并归还配额，可重复调用"""
+        self.space._release(self)
+
+
+class ScratchSpace:
+    """按配额分配任务临时目录
+
+    journal_dir 中的文件（任务日志保存的音频）按实际大小计入磁盘配额，
+    设为 None 则不计入。
+    """
+
+    def __init__(self, root: str = DEFAULT_SCRATCH_DIR, quota_bytes: int = DEFAULT_QUOTA_BYTES,
+                 ram_root: Optional[str] = DEFAULT_RAM_DIR, ram_job_max_bytes: int = RAM_JOB_MAX_BYTES,
+                 ram_quota_bytes: int = RAM_QUOTA_BYTES, journal_dir: Optional[str] = DEFAULT_JOURNAL_DIR):
+        self.root = root
+        self.journal_dir = journal_dir
+        self.quota_bytes = quota_bytes
+        self.ram_root = ram_root or None
+        self.ram_job_max_bytes = ram_job_max_bytes
+        self.ram_quota_bytes = ram_quota_bytes
+        self._lock = threading.Lock()
+        self._active = {}
+        atexit.register(self.cleanup)
+
+    @contextmanager
+    def _locked(self):
+        """进程内加线程锁，进程间用根目录下的锁文件"""
+        with self._lock:
+            os.makedirs(self.root, exist_ok=True)
+            with open(os.path.join(self.root, _LOCK_FILE), 'a') as lock_file:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if fcntl:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _reserved(self, root: str) -> int:
+        """root 下仍在运行的任务申请的字节数之和，顺带删除进程已退出的任务目录"""
+        total = 0
+        if not os.path.isdir(root):
+            return 0
+        for name in os.listdir(root):
+            job_dir = os.path.join(root, name)
+            if not os.path.isdir(job_dir):
+                continue
+            try:
+                with open(os.path.join(job_dir, _RESERVATION_FILE), 'r', encoding='utf-8') as f:
+                    reservation = json.load(f)
+            except (OSError, ValueError):
+                # 刚创建尚未写入申请记录的目录不算；长时间没有记录的视为残留
+                try:
+                    if time.time() - os.path.getmtime(job_dir) > 3600:
+                        shutil.rmtree(job_dir, ignore_errors=True)
+                except OSError:
+                    pass
+                continue
+            if pid_alive(reservation['pid']):
+                total += reservation['bytes']
+            else:
+                logger.info("清理残留的临时目录: %s", job_dir)
+                shutil.rmtree(job_dir, ignore_errors=True)
+        return total
+
+    def _try_reserve(self, estimated_bytes: int) -> Optional[ScratchJob]:
+        with self._locked():
+            if self.ram_root and estimated_bytes <= self.ram_job_max_bytes:
+                if self._reserved(self.ram_root) + estimated_bytes <= self.ram_quota_bytes:
+                    return self._create(self.ram_root, estimated_bytes, in_ram=True)
+            reserved = self._reserved(self.root)
+            journal_bytes = directory_usage(self.journal_dir) if self.journal_dir else 0
+            # 单个任务超过整个配额时，只要没有其他任务也允许运行，否则永远无法开始；
+            # 任务日志只能等任务完成或过期才释放，不能让它把新任务永远挡在外面
+            if reserved + journal_bytes + estimated_bytes <= self.quota_bytes or reserved == 0:
+                return self._create(self.root, estimated_bytes, in_ram=False)
+        return None
+
+    def _create(self, root: str, estimated_bytes: int, in_ram: bool) -> ScratchJob:
+        os.makedirs(root, exist_ok=True)
+        path = tempfile.mkdtemp(prefix=f"job_{os.getpid()}_", dir=root)
+        with open(os.path.join(path, _RESERVATION_FILE), 'w', encoding='utf-8') as f:
+            json.dump({'pid': os.getpid(), 'bytes': estimated_bytes, 'created': time.time()}, f)
+        job = ScratchJob(self, path, estimated_bytes, in_ram)
+        self._active[path] = job
+        return job
+
+    def acquire(self, estimated_bytes: int, timeout: float = ADMISSION_TIMEOUT,
+                on_wait=None) -> ScratchJob:
+        """申请一个任务目录，配额不足时等待；on_wait 在第一次需要等待时调用"""
+        deadline = time.monotonic() + timeout
+        waited = False
+        while True:
+            job = self._try_reserve(estimated_bytes)
+            if job is not None:
+                logger.debug("临时目录 %s（预估 %.1f MB，%s）", job.dir, estimated_bytes / _MB,
+                             "内存盘" if job.in_ram else "磁盘")
+                return job
+            if time.monotonic() >= deadline:
+                raise ScratchSpaceFull(
+                    f"临时空间不足：等待 {timeout:.0f} 秒后仍无法分配 {estimated_bytes / _MB:.0f} MB"
+                )
+            if not waited and on_wait:
+                on_wait()
+            waited = True
+            time.sleep(_ADMISSION_POLL)
+
+    @contextmanager
+    def job(self, estimated_bytes: int, timeout: float = ADMISSION_TIMEOUT, on_wait=None):
+        """with 块结束（包括抛出异常）时删除目录"""
+        job = self.acquire(estimated_bytes, timeout, on_wait)
+        try:
+            yield job
+        finally:
+            job.release()
+
+    def _release(self, job: ScratchJob) -> None:
+        with self._lock:
+            if self._active.pop(job.dir, None) is None:
+                return
+        logger.debug("释放临时目录 %s（实际使用 %.1f MB，预估 %.1f MB）",
+                     job.dir, job.usage() / _MB, job.reserved_bytes / _MB)
+        shutil.rmtree(job.dir, ignore_errors=True)
+
+    def cleanup(self) -> None:
+        """删除本进程所有未释放的任务目录（进程退出时调用）"""
+        for job in list(self._active.values()):
+            job.release()
+
+
+SCRATCH = ScratchSpace()
@@ -0,0 +1,247 @@
+"""字幕分段：把转录结果切分成适合显示的字幕段"""
+import re
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from alignment import align_words_to_segments
+from metrics import stage
+from transcript_arrays import TranscriptArrays, codepoint_mask, select_boundaries
+
+# 句子结束标点后不分段的常见缩写词
+COMMON_ABBREVIATIONS = {'Dr.', 'Mr.', 'Mrs.', 'Ms.', 'Prof.', 'St.', 'Ave.', 'etc.', 'vs.', 'Inc.', 'Ltd.', 'Co.'}
+SENTENCE_ENDINGS = [ord(c) for c in '.!?']
+# 单词之间超过该停顿（秒）时分段
+PAUSE_SECONDS = 1.2
+# 仅有 words 时每段最多单词数
+MAX_WORDS_PER_SEGMENT = 12
+
+
+def split_text_at_punctuation(text: str) -> List[str]:
+    """在句号和感叹号后面分割文本"""
+    # 使用正则表达式在 ". " 和 "! " 处分割
+    segments = re.split(r'([.!] )', text)
+    
+    result = []
+    current_segment = ""
+    
+    for i, segment in enumerate(segments):
+        if i % 2 == 0:  # 实际文本
+            current_segment += segment
+        else:  # 标点符号
+            current_segment += segment.rstrip()  # 移除末尾空格
+            if current_segment.strip():
+                result.append(current_segment.strip())
+            current_segment = ""
+    
+    # 添加最后一个段落（如果有的话）
+    if current_segment.strip():
+        result.append(current_segment.strip())
+    
+    return result
+
+
+def split_text_by_length(text: str, max_length: int = 26) -> List[str]:
+    """按长度分割文本，确保单词不被截断"""
+    words = text.split()
+    segments = []
+    current_segment = ""
+    
+    for word in words:
+        # 检查添加新单词是否会超过长度限制
+        test_segment = current_segment + (" " if current_segment else "") + word
+        
+        if len(test_segment) <= max_length:
+            current_segment = test_segment
+        else:
+            # 如果当前段落不为空，保存它
+            if current_segment:
+                segments.append(current_segment)
+                current_segment = word
+            else:
+                # 如果单个单词就超过了限制，强制添加
+                segments.append(word)
+                current_segment = ""
+    
+    # 添加最后一个段落
+    if current_segment:
+        segments.append(current_segment)
+    
+    return segments
+
+
+def process_transcript_segments(segments, max_chars: int = 26) -> List[dict]:
+    """处理转录段落，按照指定规则分割"""
+    processed_segments = []
+    
+    for segment in segments:
+        text = segment.text.strip()
+        start_time = segment.start
+        end_time = segment.end
+        duration = end_time - start_time
+        
+        # 首先在标点符号处分割
+        punctuation_splits = split_text_at_punctuation(text)
+        
+        for i, punct_segment in enumerate(punctuation_splits):
+            # 然后按长度分割每个标点符号段落
+            length_splits = split_text_by_length(punct_segment, max_chars)
+            
+            # 为每个分割的段落计算时间
+            total_splits = len(length_splits)
+            segment_duration = duration / len(punctuation_splits)
+            
+            for j, split_text in enumerate(length_splits):
+                # 计算此子段落的开始和结束时间
+                subsegment_duration = segment_duration / total_splits
+                subsegment_start = start_time + (i * segment_duration) + (j * subsegment_duration)
+                subsegment_end = subsegment_start + subsegment_duration
+                
+                processed_segments.append({
+                    'text': split_text,
+                    'start': subsegment_start,
+                    'end': subsegment_end
+                })
+    
+    return processed_segments
+
+
+class Segment:
+    """字幕段，属性与 SDK 返回的 segment 一致，可直接传给 generate_srt"""
+
+    def __init__(self, text, start, end):
+        self.text = text
+        self.start = start
+        self.end = end
+
+
+def _build_segments(arrays: TranscriptArrays, ends: List[int]) -> List[Segment]:
+    """按边界下标生成字幕段，起止时间取首尾单词的精确时间戳"""
+    starts = arrays.start.tolist()
+    finishes = arrays.end.tolist()
+    buffer = arrays.buffer
+    offsets = arrays.offsets.tolist()
+    segments = []
+    first = 0
+    for last in ends:
+        segments.append(Segment(buffer[offsets[first]:offsets[last + 1] - 1], starts[first], finishes[last]))
+        first = last + 1
+    return segments
+
+
+def build_word_arrays(transcript) -> Tuple[Optional[TranscriptArrays], Optional[np.ndarray]]:
+    """把转录结果转换为数组表示
+
+    这是分段前的一次性开销，结果与分段参数无关，可以缓存复用。有 segments
+    时先把单词级时间戳对齐到 segment 文本，第二项为每个 API segment 最后
+    一个单词的掩码；只有 words 时第二项为 None。
+    """
+    segments = getattr(transcript, 'segments', [])
+    words = transcript.words if getattr(transcript, 'words', None) else []
+
+    if segments and len(segments) > 0:
+        # 为segment中的每个单词找到对应的时间戳
+        with stage('alignment', items=len(words)):
+            aligned_timings = align_words_to_segments(words, segments)
+        arrays = TranscriptArrays.from_timings(t for timings in aligned_timings for t in timings)
+        segment_lengths = np.array([len(timings) for timings in aligned_timings], dtype=np.int64)
+        segment_last = np.zeros(len(arrays), dtype=bool)
+        segment_last[np.cumsum(segment_lengths)[segment_lengths > 0] - 1] = True
+        return arrays, segment_last
+
+    if words:
+        return TranscriptArrays.from_words(words), None
+    return None, None
+
+
+def sentence_ends(arrays: TranscriptArrays) -> np.ndarray:
+    """每个单词是否为句子结尾：句子结束标点 + 下一个单词大写开头，排除常见缩写词"""
+    # 句子结束标点符号 + 下一个单词大写开头（真正的新句子）
+    next_upper = np.zeros(len(arrays), dtype=bool)
+    next_upper[:-1] = codepoint_mask(arrays.first_chars(), str.isupper)[1:]
+    sentence_end = np.isin(arrays.last_chars(), SENTENCE_ENDINGS) & next_upper
+    # 排除常见缩写词（只检查候选位置）
+    for i in np.flatnonzero(sentence_end):
+        if arrays.word(i) in COMMON_ABBREVIATIONS:
+            sentence_end[i] = False
+    return sentence_end
+
+
+def _segment_with_api_segments(arrays: TranscriptArrays, segment_last: np.ndarray,
+                               max_chars: int) -> List[int]:
+    """基于API返回的segments分段
+
+    分段条件：API segment 结束；句子结束标点 + 下一个单词大写开头（排除常见
+    缩写词）；超过最大字符数时在上一个单词处分段。
+    """
+    return select_boundaries(arrays, segment_last | sentence_ends(arrays), max_chars=max_chars)
+
+
+def _segment_with_words(arrays: TranscriptArrays, max_chars: int) -> List[int]:
+    """segments为空时，基于句子结构和标点符号用words重新构建字幕段
+
+    分段条件：单词包含句子结束标点；与下一个单词之间长时间停顿；下一个单词
+    是新句子开始（大写字母）且当前段至少2个单词；超过12个单词或最大字符数。
+    """
+    hard = arrays.contains_any('.!?') | (arrays.gaps() > PAUSE_SECONDS)
+
+    # 句子开始：首字母大写且不止一个字符
+    sentence_start = codepoint_mask(arrays.first_chars(), str.isupper) & (arrays.lengths() > 1)
+    soft = np.zeros(len(arrays), dtype=bool)
+    soft[:-1] = sentence_start[1:]
+
+    return select_boundaries(arrays, hard, soft, max_words=MAX_WORDS_PER_SEGMENT, max_chars=max_chars)
+
+
+def segment_arrays(arrays: Optional[TranscriptArrays], segment_last: Optional[np.ndarray],
+                   max_chars: int = 26) -> List[Segment]:
+    """对 build_word_arrays 的结果分段"""
+    if arrays is None or len(arrays) == 0:
+        return []
+    with stage('segmentation', bytes_in=len(arrays.buffer)) as record:
+        if segment_last is not None:
+            ends = _segment_with_api_segments(arrays, segment_last, max_chars)
+        else:
+            ends = _segment_with_words(arrays, max_chars)
+        segments = _build_segments(arrays, ends)
+        record['items'] = len(segments)
+    return segments
+
+
+def segment_transcript(transcript, max_chars: int = 26) -> List[Segment]:
+    """处理字幕段落：优先使用API返回的segments，否则用words重新构建"""
+    arrays, segment_last = build_word_arrays(transcript)
+    return segment_arrays(arrays, segment_last, max_chars)
+
+
+def build_raw_preview_segments(transcript, max_words: int = 20, max_segments: int = 3) -> List[dict]:
+    """为原始字幕预览创建单词级段落"""
+    raw_segments = []
+    if hasattr(transcript, 'words') and transcript.words and len(transcript.words) > 0:
+        # 使用精确的单词级时间戳
+        for word_info in transcript.words[:max_words]:
+            raw_segments.append({
+                'text': word_info.word,
+                'start': word_info.start,
+                'end': word_info.end
+            })
+    else:
+        # 回退到段落级处理
+        segments = getattr(transcript, 'segments', [])
+        if segments:
+            for segment in segments[:max_segments]:
+                words = segment.text.split()
+                if not words:
+                    continue
+                duration = segment.end - segment.start
+                word_duration = duration / len(words)
+
+                for i, word in enumerate(words):
+                    word_start = segment.start + (i * word_duration)
+                    word_end = word_start + word_duration
+                    raw_segments.append({
+                        'text': word,
+                        'start': word_start,
+                        'end': word_end
+                    })
+    return raw_segments
@@ -0,0 +1,183 @@
+"""上传前裁剪长静音：压缩音频并把转录时间戳映射回原视频时间
+
+用 ffmpeg silencedetect 找出长于 TRIM_MIN_SILENCE 的静音（片头、停顿、
+空白段），每段静音两侧各保留 TRIM_PADDING 秒，其余部分删除，生成紧凑
+音频和偏移表。转录后用偏移表把单词和段落的时间戳换算回原始时间，
+字幕不会因裁剪而错位。
+"""
+import bisect
+import logging
+import math
+import os
+import tempfile
+from typing import List, Optional, Tuple
+
+from audio_extraction import transcode_profile
+from ffmpeg_backends import get_ffmpeg_exe
+from metrics import stage
+from transcription import detect_silences
+
+logger = logging.getLogger(__name__)
+
+# 只删除长于该时长（秒）的静音；更短的停顿是正常语流，保留
+TRIM_MIN_SILENCE = 2.0
+# 删除静音时两侧各保留的时长（秒），避免切掉弱起的辅音，也让模型听到停顿
+TRIM_PADDING = 0.3
+TRIM_NOISE_DB = -35.0
+# 可删除的总时长低于原时长的该比例时不裁剪，省去重新编码
+TRIM_MIN_SAVING = 0.05
+# 裁剪边界对齐到 10ms：先重采样到 16kHz 并按 160 个采样分帧，偏移表与实际输出一致
+_GRID = 0.01
+_SAMPLE_RATE = 16000
+
+
+class OffsetMap:
+    """紧凑音频时间与原始时间之间的映射
+
+    regions 为按顺序保留下来的原始时间区间 [(开始, 结束), ...]，它们在
+    紧凑音频中首尾相接。
+    """
+
+    def __init__(self, regions: List[Tuple[float, float]], duration: float):
+        self.regions = [(float(start), float(end)) for start, end in regions]
+        self.duration = duration
+        self.compact_starts = []
+        position = 0.0
+        for start, end in self.regions:
+            self.compact_starts.append(position)
+            position += end - start
+        self.compact_duration = position
+
+    @property
+    def removed_seconds(self) -> float:
+        return self.duration - self.compact_duration
+
+    def to_original(self, t: float, is_end: bool = False) -> float:
+        """紧凑时间换算为原始时间
+
+        恰好落在两个区间接缝上的时间点，开始时间归入后一个区间，结束时间
+        归入前一个区间，字幕不会横跨被删除的静音开始或结束。
+        """
+        if not self.regions:
+            return t
+        if is_end:
+            index = bisect.bisect_left(self.compact_starts, t) - 1
+        else:
+            index = bisect.bisect_right(self.compact_starts, t) - 1
+        index = max(0, index)
+        start, end = self.regions[index]
+        original = start + t - self.compact_starts[index]
+        # 最后一个区间之后（编码误差）按原始时长截断
+        return min(original, end if index < len(self.regions) - 1 else self.duration)
+
+    def to_dict(self) -> dict:
+        return {'regions': [list(r) for r in self.regions], 'duration': self.duration}
+
+    @classmethod
+    def from_dict(cls, data: Optional[dict]) -> Optional['OffsetMap']:
+        return cls(data['regions'], data['duration']) if data else None
+
+
+def plan_speech_regions(duration: float, silences: List[Tuple[float, float]],
+                        min_silence: float = TRIM_MIN_SILENCE,
+                        padding: float = TRIM_PADDING) -> List[Tuple[float, float]]:
+    """根据静音区间计算要保留的区间，边界对齐到 10ms"""
+    regions = []
+    position = 0.0
+    for silence_start, silence_end in silences:
+        if silence_end - silence_start < max(min_silence, 2 * padding + _GRID):
+            continue
+        # 开头和结尾的静音整段删除，不必保留停顿
+        cut_start = 0.0 if silence_start <= 0 else math.ceil((silence_start + padding) / _GRID) * _GRID
+        cut_end = duration if silence_end >= duration - _GRID else math.floor((silence_end - padding) / _GRID) * _GRID
+        if cut_end <= cut_start:
+            continue
+        if cut_start > position:
+            regions.append((round(position, 2), round(cut_start, 2)))
+        position = cut_end
+    if position < duration:
+        regions.append((round(position, 2), duration))
+    return regions
+
+
+def _shift_and_map(items: List[dict], offset: float, offset_map: OffsetMap) -> List[dict]:
+    mapped = []
+    for item in items:
+        item = dict(item)
+        item['start'] = offset_map.to_original(item['start'] + offset)
+        item['end'] = max(item['start'], offset_map.to_original(item['end'] + offset, is_end=True))
+        mapped.append(item)
+    return mapped
+
+
+def remap_transcript(data: dict, offset_map: Optional[OffsetMap]) -> dict:
+    """把转录字典中单词和段落的时间戳从紧凑时间换算回原始时间"""
+    if offset_map is None:
+        return data
+    return {
+        **data,
+        'duration': offset_map.duration,
+        'words': _shift_and_map(data['words'], 0.0, offset_map),
+        'segments': _shift_and_map(data['segments'], 0.0, offset_map),
+    }
+
+
+def remap_chunk(chunk: tuple, offset_map: Optional[OffsetMap]) -> tuple:
+    """换算 transcribe_audio 交给 on_chunk 的分块，结果可直接交给 merge_chunk_transcripts"""
+    if offset_map is None:
+        return chunk
+    own_start, own_end, offset, data = chunk
+    data = {
+        **data,
+        'words': _shift_and_map(data['words'], offset, offset_map),
+        'segments': _shift_and_map(data['segments'], offset, offset_map),
+    }
+    own_end = own_end if own_end == float('inf') else offset_map.to_original(own_end, is_end=True)
+    return offset_map.to_original(own_start), own_end, 0.0, data
+
+
+def _select_expression(regions: List[Tuple[float, float]]) -> str:
+    # 帧时间落在网格点上，比较时偏移半帧以免浮点误差多选或漏选一帧
+    half = _GRID / 2
+    return "+".join(f"between(t,{start - half:.3f},{end - half:.3f})" for start, end in regions)
+
+
+def trim_silence(audio_path: str, profile: str, duration: float,
+                 min_silence: float = TRIM_MIN_SILENCE,
+                 padding: float = TRIM_PADDING,
+                 scratch_dir: Optional[str] = None) -> Tuple[str, Optional[OffsetMap]]:
+    """删除长静音，返回 (紧凑音频路径, 偏移表)
+
+    可删除的部分太少时不裁剪，返回 (audio_path, None)。profile 为
+    AUDIO_PROFILES 中的编码方案，紧凑音频按它重新编码并写在 scratch_dir
+    中；裁剪成功时删除原音频。
+    """
+    import ffmpeg
+
+    with stage('silence_trim', bytes_in=os.path.getsize(audio_path)) as record:
+        silences = detect_silences(audio_path, noise_db=TRIM_NOISE_DB, min_silence=min_silence)
+        offset_map = OffsetMap(plan_speech_regions(duration, silences, min_silence, padding), duration)
+        record['items'] = len(offset_map.regions)
+        if offset_map.removed_seconds < duration * TRIM_MIN_SAVING or not offset_map.regions:
+            record['bytes_out'] = record['bytes_in']
+            return audio_path, None
+
+        audio_profile = transcode_profile(profile)
+        with tempfile.NamedTemporaryFile(delete=False, suffix=audio_profile["suffix"],
+                                         dir=scratch_dir) as trimmed_file:
+            trimmed_path = trimmed_file.name
+        audio_filter = (
+            f"aresample={_SAMPLE_RATE},asetnsamples=n={int(_SAMPLE_RATE * _GRID)}:p=0,"
+            f"aselect='{_select_expression(offset_map.regions)}',asetpts=N/SR/TB"
+        )
+        stream = ffmpeg.output(ffmpeg.input(audio_path), trimmed_path, af=audio_filter, **audio_profile["ffmpeg"])
+        try:
+            ffmpeg.run(stream, cmd=get_ffmpeg_exe(), quiet=True, overwrite_output=True)
+        except BaseException:
+            os.unlink(trimmed_path)
+            raise
+        record['bytes_out'] = os.path.getsize(trimmed_path)
+
+    logger.debug("裁剪静音 %.1f 秒（%d 个保留区间）", offset_map.removed_seconds, len(offset_map.regions))
+    os.unlink(audio_path)
+    return trimmed_path, offset_map
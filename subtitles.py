@@ -0,0 +1,168 @@
+"""字幕文件序列化
+
+字幕段先转换成 (开始毫秒, 结束毫秒, 文本) 的字幕流（生成器），各格式的
+写入函数逐条消费字幕流并直接写入文件或缓冲区，不在内存中拼接整份字幕。
+同一个字幕流可以输出 SRT、WebVTT、ASS 和 JSON。
+"""
+import io
+import json
+from typing import Iterable, Iterator, TextIO, Tuple
+
+from metrics import stage
+
+# 字幕流中的一条字幕：(开始毫秒, 结束毫秒, 文本)
+Cue = Tuple[int, int, str]
+
+ASS_HEADER = """[Script Info]
+ScriptType: v4.00+
+PlayResX: 1920
+PlayResY: 1080
+WrapStyle: 0
+
+[V4+ Styles]
+Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding
+Style: Default,Arial,64,&H00FFFFFF,&H000000FF,&H00000000,&H80000000,0,0,0,0,100,100,0,0,1,3,1,2,60,60,50,1
+
+[Events]
+Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
+"""
+
+
+def to_ms(seconds: float) -> int:
+    return int(round(seconds * 1000))
+
+
+def _clock(ms: int, separator: str) -> str:
+    """毫秒转换为 HH:MM:SS{separator}mmm，只用整数运算"""
+    seconds, ms = divmod(ms, 1000)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}{separator}{ms:03d}"
+
+
+def format_timestamp(seconds: float) -> str:
+    """将秒数转换为SRT格式的时间戳"""
+    return _clock(to_ms(seconds), ",")
+
+
+def _ass_clock(ms: int) -> str:
+    """ASS 时间戳 H:MM:SS.cc（百分之一秒）"""
+    cs = (ms + 5) // 10
+    seconds, cs = divmod(cs, 100)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours:d}:{minutes:02d}:{seconds:02d}.{cs:02d}"
+
+
+def iter_segment_cues(segments) -> Iterator[Cue]:
+    """字幕段（对象或字典格式）转换为字幕流"""
+    for segment in segments:
+        if isinstance(segment, dict):
+            yield to_ms(segment['start']), to_ms(segment['end']), segment['text']
+        else:
+            yield to_ms(segment.start), to_ms(segment.end), segment.text
+
+
+def iter_word_cues(transcript) -> Iterator[Cue]:
+    """每个单词一条字幕，使用精确的单词级时间戳
+
+    没有单词级时间戳时回退到段落级处理：把段落时长平均分给其中的单词。
+    """
+    words = getattr(transcript, 'words', None)
+    if words:
+        for word_info in words:
+            yield to_ms(word_info.start), to_ms(word_info.end), word_info.word
+        return
+    for segment in getattr(transcript, 'segments', None) or []:
+        words = segment.text.split()
+        if not words:
+            continue
+        word_duration = (segment.end - segment.start) / len(words)
+        for i, word in enumerate(words):
+            word_start = segment.start + i * word_duration
+            yield to_ms(word_start), to_ms(word_start + word_duration), word
+
+
+def write_srt(cues: Iterable[Cue], out: TextIO, start_index: int = 1) -> int:
+    """写入 SRT，每条字幕后空一行；start_index 为第一条的序号（追加写入时使用）"""
+    count = 0
+    for index, (start, end, text) in enumerate(cues, start_index):
+        out.write(f"{index}\n{_clock(start, ',')} --> {_clock(end, ',')}\n{text}\n\n")
+        count += 1
+    return count
+
+
+def write_vtt(cues: Iterable[Cue], out: TextIO) -> int:
+    """写入 WebVTT，文本中的 & 和 < 需要转义"""
+    out.write("WEBVTT\n\n")
+    count = 0
+    for start, end, text in cues:
+        text = text.replace("&", "&amp;").replace("<", "&lt;")
+        out.write(f"{_clock(start, '.')} --> {_clock(end, '.')}\n{text}\n\n")
+        count += 1
+    return count
+
+
+def write_ass(cues: Iterable[Cue], out: TextIO) -> int:
+    """写入 ASS（Advanced SubStation Alpha），使用一个底部居中的默认样式"""
+    out.write(ASS_HEADER)
+    count = 0
+    for start, end, text in cues:
+        # 花括号是 ASS 的覆盖标签，换行写作 \N
+        text = text.replace("{", "(").replace("}", ")").replace("\n", "\\N")
+        out.write(f"Dialogue: 0,{_ass_clock(start)},{_ass_clock(end)},Default,,0,0,0,,{text}\n")
+        count += 1
+    return count
+
+
+def write_json(cues: Iterable[Cue], out: TextIO) -> int:
+    """写入 JSON 数组，每条字幕一行 {"start", "end", "text"}（秒）"""
+    out.write("[")
+    count = 0
+    for start, end, text in cues:
+        out.write(",\n" if count else "\n")
+        out.write(json.dumps({'start': start / 1000, 'end': end / 1000, 'text': text}, ensure_ascii=False))
+        count += 1
+    out.write("\n]\n")
+    return count
+
+
+# 输出格式：写入函数、扩展名和下载时的 MIME 类型
+SUBTITLE_FORMATS = {
+    'srt': {'label': 'SRT', 'writer': write_srt, 'extension': '.srt', 'mime': 'application/x-subrip'},
+    'vtt': {'label': 'WebVTT', 'writer': write_vtt, 'extension': '.vtt', 'mime': 'text/vtt'},
+    'ass': {'label': 'ASS', 'writer': write_ass, 'extension': '.ass', 'mime': 'text/x-ssa'},
+    'json': {'label': 'JSON', 'writer': write_json, 'extension': '.json', 'mime': 'application/json'},
+}
+
+
+def write_subtitles(cues: Iterable[Cue], path: str, fmt: str = 'srt', append: bool = False, **kwargs) -> int:
+    """把字幕流按 fmt 格式写入文件，返回字幕条数
+
+    append 用于 SRT 追加写入（配合 start_index 参数）。
+    """
+    with stage(f'serialize.{fmt}') as record, \
+            open(path, 'a' if append else 'w', encoding='utf-8') as out:
+        record['items'] = SUBTITLE_FORMATS[fmt]['writer'](cues, out, **kwargs)
+        record['bytes_out'] = out.tell()
+    return record['items']
+
+
+def _render(cues: Iterable[Cue], fmt: str, stage_name: str, **kwargs) -> str:
+    """写入内存缓冲区并返回字符串，供需要整份字幕文本的调用方使用"""
+    with stage(stage_name) as record:
+        out = io.StringIO()
+        record['items'] = SUBTITLE_FORMATS[fmt]['writer'](cues, out, **kwargs)
+        content = out.getvalue()
+        record['bytes_out'] = len(content)
+    return content
+
+
+def generate_raw_srt(transcript) -> str:
+    """生成原始SRT，每个单词一个字幕段，使用精确的单词级时间戳"""
+    return _render(iter_word_cues(transcript), 'srt', 'serialize.raw_srt')
+
+
+def generate_srt(segments, start_index: int = 1) -> str:
+    """生成标准SRT字幕文件，start_index 为第一个字幕段的序号（追加写入时使用）"""
+    return _render(iter_segment_cues(segments), 'srt', 'serialize.srt', start_index=start_index)
@@ -0,0 +1,148 @@
+"""数组化的单词级转录表示
+
+单词的起止时间存放在 NumPy float 数组中，单词文本以空格连接存放在一个
+字符串缓冲区里，通过偏移数组索引。分段时的停顿检测、长度累计和标点判断
+都可以直接在数组上完成，不再逐个访问 SDK 对象的属性。
+"""
+from typing import Iterable, List, Sequence
+
+import numpy as np
+
+
+class TranscriptArrays:
+    """紧凑的单词级转录结构
+
+    - start / end: 每个单词的起止时间（秒）
+    - buffer: 所有单词以单个空格连接成的字符串
+    - offsets: 长度为 n+1，第 i 个单词为 buffer[offsets[i]:offsets[i+1]-1]，
+      第 i..j 个单词以空格连接的文本为 buffer[offsets[i]:offsets[j+1]-1]
+    """
+
+    __slots__ = ('start', 'end', 'buffer', 'offsets', '_codepoints')
+
+    def __init__(self, words: Sequence[str], start, end):
+        self.start = np.asarray(start, dtype=np.float64)
+        self.end = np.asarray(end, dtype=np.float64)
+        self.buffer = ' '.join(words)
+        lengths = np.fromiter((len(w) for w in words), dtype=np.int64, count=len(words))
+        self.offsets = np.zeros(len(words) + 1, dtype=np.int64)
+        np.cumsum(lengths + 1, out=self.offsets[1:])
+        # UTF-32 编码后每个码点占 4 字节，下标与 Python 字符串下标一一对应
+        self._codepoints = np.frombuffer(self.buffer.encode('utf-32-le'), dtype='<u4')
+
+    @classmethod
+    def from_words(cls, words: Iterable) -> 'TranscriptArrays':
+        """从 SDK 返回的 words（含 word/start/end 属性）构建"""
+        words = list(words)
+        return cls(
+            [w.word for w in words],
+            [w.start for w in words],
+            [w.end for w in words],
+        )
+
+    @classmethod
+    def from_timings(cls, timings: Iterable[dict]) -> 'TranscriptArrays':
+        """从 {'word', 'start', 'end'} 字典列表构建"""
+        timings = list(timings)
+        return cls(
+            [t['word'] for t in timings],
+            [t['start'] for t in timings],
+            [t['end'] for t in timings],
+        )
+
+    def __len__(self) -> int:
+        return len(self.start)
+
+    def word(self, i: int) -> str:
+        return self.buffer[self.offsets[i]:self.offsets[i + 1] - 1]
+
+    def text(self, first: int, last: int) -> str:
+        """第 first..last 个单词（含两端）以空格连接的文本"""
+        return self.buffer[self.offsets[first]:self.offsets[last + 1] - 1]
+
+    def lengths(self) -> np.ndarray:
+        return np.diff(self.offsets) - 1
+
+    def gaps(self) -> np.ndarray:
+        """每个单词与下一个单词之间的停顿，最后一个单词为 0"""
+        gaps = np.zeros(len(self), dtype=np.float64)
+        gaps[:-1] = self.start[1:] - self.end[:-1]
+        return gaps
+
+    def first_chars(self) -> np.ndarray:
+        """每个单词首字符的码点，空单词为 0"""
+        chars = np.zeros(len(self), dtype=np.uint32)
+        nonempty = self.lengths() > 0
+        chars[nonempty] = self._codepoints[self.offsets[:-1][nonempty]]
+        return chars
+
+    def last_chars(self) -> np.ndarray:
+        """每个单词末字符的码点，空单词为 0"""
+        chars = np.zeros(len(self), dtype=np.uint32)
+        nonempty = self.lengths() > 0
+        chars[nonempty] = self._codepoints[self.offsets[1:][nonempty] - 2]
+        return chars
+
+    def contains_any(self, chars: str) -> np.ndarray:
+        """每个单词是否包含 chars 中的任一字符"""
+        hits = np.isin(self._codepoints, [ord(c) for c in chars])
+        counts = np.zeros(len(self._codepoints) + 1, dtype=np.int64)
+        np.cumsum(hits, out=counts[1:])
+        return counts[self.offsets[1:] - 1] > counts[self.offsets[:-1]]
+
+
+def codepoint_mask(codepoints: np.ndarray, predicate) -> np.ndarray:
+    """对码点数组按字符谓词（如 str.isupper）求掩码，只对去重后的字符调用谓词"""
+    unique, inverse = np.unique(codepoints, return_inverse=True)
+    flags = np.fromiter((c != 0 and predicate(chr(c)) for c in unique.tolist()),
+                        dtype=bool, count=len(unique))
+    return flags[inverse]
+
+
+def select_boundaries(arrays: TranscriptArrays, hard: np.ndarray, soft: np.ndarray = None,
+                      max_words: int = None, max_chars: int = None) -> List[int]:
+    """选择分段边界，返回每个字幕段最后一个单词的下标
+
+    - hard: 该单词之后必须分段
+    - soft: 该单词之后可以分段，但当前段至少要有 2 个单词
+    - max_words: 每段最多单词数
+    - max_chars: 每段最大字符数（单个单词超长时单独成段）
+
+    先对每个可能的段起点向量化地算出“该段最后一个单词”的下标（下一个
+    hard 边界、起点之后的下一个 soft 边界、单词数上限、字符数上限中最近
+    的一个），之后只需沿着这张跳转表走一遍，循环体只有一次列表索引。
+    """
+    n = len(arrays)
+    if n == 0:
+        return []
+    starts = np.arange(n, dtype=np.int64)
+
+    hard_idx = np.flatnonzero(hard)
+    if not len(hard_idx) or hard_idx[-1] != n - 1:
+        hard_idx = np.append(hard_idx, n - 1)
+    last = hard_idx[np.searchsorted(hard_idx, starts)]
+
+    if soft is not None:
+        soft_idx = np.flatnonzero(soft)
+        if len(soft_idx):
+            k = np.searchsorted(soft_idx, starts + 1)
+            candidate = soft_idx[np.minimum(k, len(soft_idx) - 1)]
+            last = np.where(k < len(soft_idx), np.minimum(last, candidate), last)
+
+    if max_words:
+        last = np.minimum(last, starts + max_words - 1)
+
+    if max_chars:
+        # 满足 offsets[j+1] - 1 - offsets[start] <= max_chars 的最大 j
+        offsets = arrays.offsets
+        fit = np.searchsorted(offsets, offsets[:-1] + max_chars + 1, side='right') - 2
+        last = np.minimum(last, np.maximum(fit, starts))
+
+    jump = last.tolist()
+    ends = []
+    first = 0
+    while first < n:
+        end = jump[first]
+        ends.append(end)
+        first = end + 1
+    return ends
@@ -0,0 +1,173 @@
+"""按内容寻址的转录结果磁盘缓存，超过容量上限时按 LRU 淘汰"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from typing import Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows 上没有 fcntl，只在进程内加锁
+    fcntl = None
+
+DEFAULT_CACHE_DIR = os.getenv(
+    'WHISPER_CACHE_DIR',
+    os.path.join(os.path.expanduser('~'), '.cache', 'whisper_subtitles')
+)
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+_HASH_BLOCK_SIZE = 1024 * 1024
+_STATS_FILE = 'stats.json'
+# 多个进程（界面、后台任务、命令行）共用缓存目录，统计计数的读改写在这个锁文件上串行
+_STATS_LOCK_FILE = 'stats.lock'
+
+
+def hash_file(path: str) -> str:
+    """分块计算文件的 SHA-256，避免把整个文件读入内存"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(_HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class TranscriptCache:
+    """转录结果缓存
+
+    键由音频内容哈希、模型和请求参数共同决定；每个条目是一个 JSON 文件，
+    文件的修改时间即最近访问时间，写入后若总大小超过上限则淘汰最久未用的条目。
+    """
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def make_key(self, audio_path: str, model: str, audio_hash: Optional[str] = None, **params) -> str:
+        """根据音频内容、模型和请求参数生成缓存键
+
+        audio_hash 为预先计算好的 hash_file(audio_path)，给出时不再读取音频。
+        """
+        payload = json.dumps(
+            {'audio': audio_hash or hash_file(audio_path), 'model': model, 'params': params},
+            sort_keys=True
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key: str) -> Optional[dict]:
+        """读取缓存，命中时刷新访问时间"""
+        path = self._entry_path(key)
+        with self._lock:
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                os.utime(path)
+            except (OSError, ValueError):
+                self._bump_stat('misses')
+                return None
+            self._bump_stat('hits')
+            return data
+
+    def put(self, key: str, data: dict) -> None:
+        """写入缓存（先写临时文件再原子替换），然后按容量上限淘汰"""
+        with self._lock:
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump(data, f, ensure_ascii=False)
+                os.replace(tmp_path, self._entry_path(key))
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+                raise
+            self._evict()
+
+    def _entries(self):
+        """返回 (访问时间, 大小, 路径) 列表"""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.json') or name == _STATS_FILE:
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _evict(self) -> None:
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        evicted = 0
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total -= size
+            evicted += 1
+        if evicted:
+            self._bump_stat('evictions', evicted)
+
+    def _read_stats(self) -> dict:
+        try:
+            with open(os.path.join(self.cache_dir, _STATS_FILE), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _bump_stat(self, name: str, amount: int = 1) -> None:
+        """在进程间文件锁内读改写计数，并先写临时文件再原子替换，读取方不会读到半个文件"""
+        with open(os.path.join(self.cache_dir, _STATS_LOCK_FILE), 'a') as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                stats = self._read_stats()
+                stats[name] = stats.get(name, 0) + amount
+                fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+                try:
+                    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                        json.dump(stats, f)
+                    os.replace(tmp_path, os.path.join(self.cache_dir, _STATS_FILE))
+                except BaseException:
+                    if os.path.exists(tmp_path):
+                        os.unlink(tmp_path)
+                    raise
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def stats(self) -> dict:
+        """返回命中/未命中/淘汰次数以及当前条目数和总大小"""
+        with self._lock:
+            stats = self._read_stats()
+            entries = self._entries()
+        hits = stats.get('hits', 0)
+        misses = stats.get('misses', 0)
+        return {
+            'hits': hits,
+            'misses': misses,
+            'evictions': stats.get('evictions', 0),
+            'hit_rate': hits / (hits + misses) if hits + misses else 0.0,
+            'entries': len(entries),
+            'size_bytes': sum(size for _, size, _ in entries),
+        }
+
+    def clear(self) -> None:
+        """清空所有缓存条目和统计"""
+        with self._lock:
+            for _, _, path in self._entries():
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+            stats_path = os.path.join(self.cache_dir, _STATS_FILE)
+            if os.path.exists(stats_path):
+                os.unlink(stats_path)
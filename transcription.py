@@ -0,0 +1,399 @@
+"""Whisper 转录：长音频按静音点分块，并发请求后拼接结果"""
+import contextvars
+import logging
+import os
+import random
+import re
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
+from types import SimpleNamespace
+from typing import Callable, List, Optional, Tuple
+
+from ffmpeg_backends import get_ffmpeg_exe
+from media_probe import probe_audio_streams, probe_media
+from metrics import stage
+
+logger = logging.getLogger(__name__)
+
+# OpenAI 转录接口单次上传上限为 25 MB，留出一些余量
+MAX_UPLOAD_BYTES = 24 * 1024 * 1024
+# 默认每块音频的目标时长（秒）
+DEFAULT_CHUNK_SECONDS = 600.0
+# 相邻分块之间的重叠时长（秒），用于避免切点处丢词
+CHUNK_OVERLAP_SECONDS = 1.0
+# 切分块时需要重新编码的源音频编码：(编码器, 码率上限 kbps)，其余编码（PCM、AAC）
+# 直接复制，见 cut_audio。libvorbis 只接受与采样率匹配的码率，Vorbis 改编码为 Opus
+# （同为 OGG 容器）；libopus 单声道码率最高 256 kbps
+_CHUNK_ENCODERS = {
+    'opus': ('libopus', 256),
+    'vorbis': ('libopus', 256),
+    'mp3': ('libmp3lame', 320),
+    'flac': ('flac', None),
+}
+# 在目标切点之前多长的窗口内寻找静音（秒）
+SILENCE_SEARCH_WINDOW = 30.0
+DEFAULT_MAX_WORKERS = 4
+# 自动模式下超过该时长（秒）也分块：单次请求越长越容易超时，失败时损失也越大
+MAX_UNCHUNKED_SECONDS = 30 * 60
+
+# 转录请求失败重试：第 n 次重试前等待 [0, min(上限, 基数 × 2^n)] 内的随机时长
+RETRY_ATTEMPTS = 5
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 30.0
+# 可重试的 openai SDK 异常（按类名判断，避免在这里导入 openai）
+RETRYABLE_ERRORS = {'APITimeoutError', 'APIConnectionError', 'RateLimitError', 'InternalServerError'}
+
+# 完整解码时 ffmpeg 进度行中的已处理时长
+_PROGRESS_TIME_RE = re.compile(r"time=\s*(\d+):(\d+):(\d+(?:\.\d+)?)")
+_SILENCE_START_RE = re.compile(r"silence_start:\s*(-?\d+(?:\.\d+)?)")
+_SILENCE_END_RE = re.compile(r"silence_end:\s*(-?\d+(?:\.\d+)?)")
+
+
+def _run_ffmpeg(args: List[str]) -> str:
+    """运行 ffmpeg 并返回 stderr 输出（ffmpeg 的信息都写在 stderr）"""
+    result = subprocess.run(
+        [get_ffmpeg_exe(), "-hide_banner", "-nostdin"] + args,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+    )
+    stderr = result.stderr.decode("utf-8", errors="replace")
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed ({result.returncode}): {stderr[-500:]}")
+    return stderr
+
+
+def probe_duration(audio_path: str) -> float:
+    """获取音频时长（秒）
+
+    优先读取文件头中的时长；文件头没有时长（例如不完整的流）时才完整解码一遍，
+    以解码到的最后时间为准。
+    """
+    duration, _ = probe_media(audio_path)
+    if duration is not None:
+        return duration
+    stderr = _run_ffmpeg(["-i", audio_path, "-f", "null", "-"])
+    matches = _PROGRESS_TIME_RE.findall(stderr)
+    if not matches:
+        raise RuntimeError(f"无法获取音频时长: {audio_path}")
+    hours, minutes, seconds = matches[-1]
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def detect_silences(audio_path: str, noise_db: float = -35.0,
+                    min_silence: float = 0.4) -> List[Tuple[float, float]]:
+    """使用 ffmpeg silencedetect 找出静音区间，返回 (开始, 结束) 列表"""
+    with stage('silence_detect', bytes_in=os.path.getsize(audio_path)) as record:
+        stderr = _run_ffmpeg([
+            "-i", audio_path,
+            "-af", f"silencedetect=noise={noise_db}dB:d={min_silence}",
+            "-f", "null", "-",
+        ])
+        record['items'] = stderr.count("silence_end")
+    silences = []
+    start = None
+    for line in stderr.splitlines():
+        start_match = _SILENCE_START_RE.search(line)
+        if start_match:
+            start = max(0.0, float(start_match.group(1)))
+            continue
+        end_match = _SILENCE_END_RE.search(line)
+        if end_match and start is not None:
+            silences.append((start, float(end_match.group(1))))
+            start = None
+    return silences
+
+
+def plan_chunks(duration: float, silences: List[Tuple[float, float]],
+                chunk_seconds: float = DEFAULT_CHUNK_SECONDS,
+                search_window: float = SILENCE_SEARCH_WINDOW) -> List[Tuple[float, float]]:
+    """规划分块边界：尽量在目标切点前最近的静音中点处切开，找不到静音时硬切"""
+    boundaries = []
+    chunk_start = 0.0
+    while duration - chunk_start > chunk_seconds:
+        target = chunk_start + chunk_seconds
+        cut = target
+        best_distance = None
+        for silence_start, silence_end in silences:
+            midpoint = (silence_start + silence_end) / 2
+            if target - search_window <= midpoint <= target and midpoint > chunk_start:
+                distance = target - midpoint
+                if best_distance is None or distance < best_distance:
+                    best_distance = distance
+                    cut = midpoint
+        boundaries.append((chunk_start, cut))
+        chunk_start = cut
+    boundaries.append((chunk_start, duration))
+    return boundaries
+
+
+def _get(obj, key, default=None):
+    """兼容字典和对象两种格式读取字段"""
+    if isinstance(obj, dict):
+        return obj.get(key, default)
+    return getattr(obj, key, default)
+
+
+def transcript_to_dict(transcript) -> dict:
+    """把 SDK 返回的 verbose_json 转录结果规范化为普通字典"""
+    words = [
+        {'word': _get(w, 'word'), 'start': float(_get(w, 'start')), 'end': float(_get(w, 'end'))}
+        for w in (_get(transcript, 'words') or [])
+    ]
+    segments = [
+        {'id': i, 'start': float(_get(s, 'start')), 'end': float(_get(s, 'end')), 'text': _get(s, 'text')}
+        for i, s in enumerate(_get(transcript, 'segments') or [])
+    ]
+    return {
+        'text': _get(transcript, 'text') or '',
+        'language': _get(transcript, 'language'),
+        'duration': _get(transcript, 'duration'),
+        'words': words,
+        'segments': segments,
+    }
+
+
+def transcript_from_dict(data: dict) -> SimpleNamespace:
+    """把字典格式的转录结果转换为可用属性访问的对象，与 SDK 返回值用法一致"""
+    return SimpleNamespace(
+        text=data.get('text', ''),
+        language=data.get('language'),
+        duration=data.get('duration'),
+        words=[SimpleNamespace(**w) for w in data.get('words', [])],
+        segments=[SimpleNamespace(**s) for s in data.get('segments', [])],
+    )
+
+
+def is_retryable(error: Exception) -> bool:
+    """超时、连接错误、限流和服务端错误可以重试，参数错误等直接失败"""
+    if type(error).__name__ in RETRYABLE_ERRORS:
+        return True
+    status = getattr(error, 'status_code', None)
+    return status is not None and (status in (408, 409, 429) or status >= 500)
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """429 响应头中建议的等待秒数（retry-after-ms 或 retry-after），没有时为 None"""
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+    for name, scale in (('retry-after-ms', 0.001), ('retry-after', 1.0)):
+        try:
+            return float(headers[name]) * scale
+        except (KeyError, TypeError, ValueError):
+            continue
+    return None
+
+
+def call_with_retries(func, attempts: int = RETRY_ATTEMPTS, base_delay: float = RETRY_BASE_DELAY,
+                      max_delay: float = RETRY_MAX_DELAY, sleep=time.sleep):
+    """调用 func，遇到可重试的错误时按指数退避加随机抖动重试"""
+    for attempt in range(attempts):
+        try:
+            return func()
+        except Exception as e:
+            if attempt == attempts - 1 or not is_retryable(e):
+                raise
+            delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+            logger.warning("转录请求失败（%s），%.1f 秒后第 %d 次重试", e, delay, attempt + 1)
+            sleep(delay)
+
+
+def request_transcription(client, audio_path: str, model: str = "whisper-1",
+                          gate=None, audio_seconds: Optional[float] = None) -> dict:
+    """对单个音频文件发起转录请求（失败时重试），items 记录返回的单词数
+
+    gate（scheduler.RequestGate）不为 None 时，每次尝试前先经过共享的并发
+    名额和限流；收到 429 时通知 gate，所有会话一起暂停。
+    """
+    def attempt() -> dict:
+        with gate.request(audio_seconds) if gate else nullcontext():
+            with stage('api_request', bytes_in=os.path.getsize(audio_path), model=model) as record:
+                try:
+                    with open(audio_path, 'rb') as audio_file:
+                        transcript = client.audio.transcriptions.create(
+                            file=audio_file,
+                            model=model,
+                            response_format="verbose_json",
+                            timestamp_granularities=["word", "segment"]
+                        )
+                except Exception as e:
+                    if gate and (type(e).__name__ == 'RateLimitError' or getattr(e, 'status_code', None) == 429):
+                        gate.rate_limited(retry_after_seconds(e))
+                    raise
+                data = transcript_to_dict(transcript)
+                record['items'] = len(data['words'])
+        return data
+
+    return call_with_retries(attempt)
+
+
+def cut_audio(audio_path: str, start: float, end: float, output_path: str,
+              codec: Optional[str] = None, bitrate_kbps: Optional[float] = None) -> str:
+    """截取 [start, end) 区间的音频，分块的第一个采样就是 start 处的采样
+
+    codec 为源音频的编码。流复制只能从包或 Ogg 页的边界开始：Opus/Vorbis
+    的分块会比 start 早出几百毫秒到 1 秒，MP3、FLAC 也差几到几十毫秒，
+    分块内的时间戳就整体错开了。这些编码先解码、从 start 精确截取后按
+    _CHUNK_ENCODERS 和 bitrate_kbps 重新编码；PCM 和 M4A（AAC，编辑列表
+    记录了精确起点）直接复制就是精确的。
+    """
+    if codec not in _CHUNK_ENCODERS:
+        codec_args = ["-c", "copy"]
+    else:
+        encoder, max_kbps = _CHUNK_ENCODERS[codec]
+        codec_args = ["-c:a", encoder]
+        if bitrate_kbps and max_kbps:
+            codec_args += ["-b:a", f"{min(max_kbps, max(8, round(bitrate_kbps)))}k"]
+    _run_ffmpeg([
+        "-ss", f"{start:.3f}", "-i", audio_path,
+        "-t", f"{end - start:.3f}",
+        "-vn", *codec_args, "-y", output_path,
+    ])
+    return output_path
+
+
+def merge_chunk_transcripts(results: List[Tuple[float, float, float, dict]]) -> dict:
+    """拼接各分块的转录结果
+
+    results 中每一项为 (归属开始, 归属结束, 音频偏移, 转录字典)。
+    时间戳加上音频偏移换算为全局时间；重叠区内的单词和段落按中点
+    只保留在其归属的分块中，以此去重。
+    """
+    words = []
+    segments = []
+    texts = []
+    for own_start, own_end, offset, data in results:
+        for w in data['words']:
+            start, end = w['start'] + offset, w['end'] + offset
+            if own_start <= (start + end) / 2 < own_end:
+                words.append({'word': w['word'], 'start': start, 'end': end})
+        chunk_texts = []
+        for s in data['segments']:
+            start, end = s['start'] + offset, s['end'] + offset
+            if own_start <= (start + end) / 2 < own_end:
+                segments.append({'id': len(segments), 'start': start, 'end': end, 'text': s['text']})
+                chunk_texts.append(s['text'].strip())
+        texts.append(' '.join(chunk_texts) if data['segments'] else data['text'].strip())
+
+    return {
+        'text': ' '.join(t for t in texts if t),
+        'language': results[0][3].get('language') if results else None,
+        'duration': results[-1][1] if results else 0.0,
+        'words': words,
+        'segments': segments,
+    }
+
+
+def transcribe_chunked(client, audio_path: str, model: str = "whisper-1",
+                       chunk_seconds: float = DEFAULT_CHUNK_SECONDS,
+                       max_workers: int = DEFAULT_MAX_WORKERS,
+                       overlap: float = CHUNK_OVERLAP_SECONDS,
+                       journal=None, duration: Optional[float] = None,
+                       on_chunk: Optional[Callable[[tuple], None]] = None,
+                       scratch_dir: Optional[str] = None, gate=None) -> dict:
+    """在静音处切分音频，用有界线程池并发转录各分块并拼接结果
+
+    传入 journal（journal.JobJournal）时沿用其中保存的分块计划，跳过已完成
+    的分块，每完成一块立即写入日志。on_chunk 按时间顺序、在调用线程中
+    接收每个完成的分块 (归属开始, 归属结束, 音频偏移, 转录字典)，用于
+    边转录边输出字幕。切出的分块音频写在 scratch_dir 下的临时目录中。
+    gate 见 request_transcription。
+    """
+    if duration is None:
+        duration = probe_duration(audio_path)
+    bytes_per_second = os.path.getsize(audio_path) / max(duration, 1e-6)
+    # 分块按源音频的编码和平均码率重新编码，体积与源文件中同样时长的一段相当
+    streams = probe_audio_streams(audio_path)
+    codec = streams[0].codec if streams else None
+    chunks = journal.chunks if journal else None
+    if chunks is None:
+        # 按实际码率限制分块时长，保证每块都不超过上传上限
+        max_chunk_seconds = MAX_UPLOAD_BYTES * 0.95 / bytes_per_second - 2 * overlap
+        chunk_seconds = max(1.0, min(chunk_seconds, max_chunk_seconds))
+
+        silences = detect_silences(audio_path)
+        chunks = plan_chunks(duration, silences, chunk_seconds)
+        if journal:
+            journal.plan(chunks)
+    done = journal.completed() if journal else {}
+    suffix = os.path.splitext(audio_path)[1]
+
+    with tempfile.TemporaryDirectory(prefix="whisper_chunks_", dir=scratch_dir) as chunk_dir:
+        def work(index: int) -> Tuple[float, float, float, dict]:
+            own_start, own_end = chunks[index]
+            audio_start = max(0.0, own_start - overlap)
+            if index in done:
+                audio_start, data = done[index]
+            else:
+                audio_end = min(duration, own_end + overlap)
+                chunk_path = os.path.join(chunk_dir, f"chunk_{index:04d}{suffix}")
+                cut_audio(audio_path, audio_start, audio_end, chunk_path, codec, bytes_per_second * 8 / 1000)
+                data = request_transcription(client, chunk_path, model, gate, audio_end - audio_start)
+                os.unlink(chunk_path)
+                if journal:
+                    journal.complete_chunk(index, audio_start, data)
+            # 最后一块的归属区间延伸到无穷，避免时长探测误差丢掉尾部
+            if index == len(chunks) - 1:
+                own_end = float('inf')
+            return own_start, own_end, audio_start, data
+
+        # 每个任务带上提交时的上下文，分块请求的计时才会归入当前的 metrics.trace()
+        contexts = [contextvars.copy_context() for _ in chunks]
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+            futures = {pool.submit(ctx.run, work, index): index for index, ctx in enumerate(contexts)}
+            results = [None] * len(chunks)
+            emitted = 0
+            try:
+                for future in as_completed(futures):
+                    results[futures[future]] = future.result()
+                    # 只按顺序交出连续完成的分块，字幕才能依次追加
+                    while emitted < len(results) and results[emitted] is not None:
+                        if on_chunk:
+                            on_chunk(results[emitted])
+                        emitted += 1
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+
+    merged = merge_chunk_transcripts(results)
+    merged['duration'] = duration
+    return merged
+
+
+def transcribe_audio(client, audio_path: str, model: str = "whisper-1",
+                     chunked: Optional[bool] = None,
+                     chunk_seconds: float = DEFAULT_CHUNK_SECONDS,
+                     max_workers: int = DEFAULT_MAX_WORKERS,
+                     journal=None, duration: Optional[float] = None,
+                     on_chunk: Optional[Callable[[tuple], None]] = None,
+                     scratch_dir: Optional[str] = None, gate=None) -> SimpleNamespace:
+    """转录音频文件
+
+    chunked 为 None 时自动判断：文件超过上传上限，或已知时长 duration 超过
+    MAX_UNCHUNKED_SECONDS 时分块；True 强制分块；False 始终单次请求。
+    journal 用于记录进度并从中断处恢复，on_chunk 用于边转录边输出，
+    见 transcribe_chunked；不分块时整段音频作为一块交给 on_chunk。gate 为
+    进程内共享的请求闸门（scheduler.RequestGate），见 request_transcription。
+    """
+    audio_size = os.path.getsize(audio_path)
+    if chunked is None:
+        chunked = audio_size > MAX_UPLOAD_BYTES or (duration or 0) > MAX_UNCHUNKED_SECONDS
+
+    with stage('transcribe', bytes_in=audio_size, chunked=chunked) as record:
+        if chunked:
+            data = transcribe_chunked(client, audio_path, model, chunk_seconds, max_workers,
+                                      journal=journal, duration=duration, on_chunk=on_chunk,
+                                      scratch_dir=scratch_dir, gate=gate)
+        else:
+            done = journal.completed() if journal else {}
+            if journal and journal.chunks is None:
+                journal.plan([(0.0, float('inf'))])
+            data = done[0][1] if 0 in done else request_transcription(client, audio_path, model, gate, duration)
+            if journal and 0 not in done:
+                journal.complete_chunk(0, 0.0, data)
+            if on_chunk:
+                on_chunk((0.0, float('inf'), 0.0, data))
+        record['items'] = len(data['words'])
+    return transcript_from_dict(data)
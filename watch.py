@@ -0,0 +1,228 @@
+"""监视目录的守护进程：服务器上的视频文件直接生成字幕，不经过浏览器上传
+
+用法：
+    python watch.py /mnt/share/videos /mnt/share/lectures -r --interval 10 --debounce 30
+
+每隔 --interval 秒扫描一次监视的目录；新出现或内容有变化的视频，在大小
+和修改时间连续 --debounce 秒不变（确认已写完）后，按批送入与 cli.py 相同
+的提取 → 转录 → 分段流水线，字幕写在视频旁边。处理结果记录在状态文件
+中，重启后不会重复处理；失败的文件按指数退避在之后的扫描中重试（第 n 次
+失败后至少等待 RETRY_BASE_DELAY × 2^(n-1) 秒），最多 MAX_ATTEMPTS 次。
+收到 SIGINT/SIGTERM 时处理完当前批次后退出。
+"""
+import json
+import logging
+import os
+import signal
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from cli import build_parser, collect_videos, has_subtitles, run_batch
+from pipeline import PipelineJob
+from transcript_cache import DEFAULT_CACHE_DIR
+
+logger = logging.getLogger("whisper_subtitles.watch")
+
+DEFAULT_STATE_FILE = os.path.join(DEFAULT_CACHE_DIR, 'watch_state.json')
+# 同一版本的文件最多尝试处理的次数
+MAX_ATTEMPTS = 3
+# 失败后重试的等待时间（秒）：第 n 次失败后等待 min(上限, 基数 × 2^(n-1))
+RETRY_BASE_DELAY = 300.0
+RETRY_MAX_DELAY = 3600.0
+
+# 文件签名：(大小, 修改时间纳秒)，任一变化都视为新版本
+Signature = Tuple[int, int]
+
+
+def file_signature(path: str) -> Optional[Signature]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def retry_delay(attempts: int) -> float:
+    """失败 attempts 次后，下一次重试前至少等待的秒数"""
+    return min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** max(attempts - 1, 0))
+
+
+class WatchState:
+    """已处理文件的状态存储：{路径: {signature, status, attempts, error, updated}}
+
+    updated 为最近一次处理（或尝试）的时间戳，失败重试的退避从这里算起。
+    每次更新后整体写回 JSON 文件（先写临时文件再原子替换）。
+    """
+
+    def __init__(self, path: str = DEFAULT_STATE_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                self.files: Dict[str, dict] = json.load(f)
+        except (OSError, ValueError):
+            self.files = {}
+
+    def needs_processing(self, path: str, signature: Signature, now: Optional[float] = None) -> bool:
+        """未处理过、内容有变化，或失败次数未达上限且已过退避时间"""
+        entry = self.files.get(path)
+        if entry is None or tuple(entry['signature']) != tuple(signature):
+            return True
+        if entry['status'] != 'failed' or entry['attempts'] >= MAX_ATTEMPTS:
+            return False
+        now = time.time() if now is None else now
+        return now - entry['updated'] >= retry_delay(entry['attempts'])
+
+    def mark(self, path: str, signature: Signature, status: str, error: Optional[str] = None) -> None:
+        with self._lock:
+            previous = self.files.get(path)
+            same_version = previous is not None and tuple(previous['signature']) == tuple(signature)
+            attempts = previous['attempts'] + 1 if same_version and status == 'failed' else int(status == 'failed')
+            self.files[path] = {
+                'signature': list(signature),
+                'status': status,
+                'attempts': attempts,
+                'error': error,
+                'updated': time.time(),
+            }
+            self._save()
+
+    def forget_missing(self) -> int:
+        """删除已不存在的文件的记录，返回删除的数量"""
+        with self._lock:
+            missing = [path for path in self.files if not os.path.exists(path)]
+            for path in missing:
+                del self.files[path]
+            if missing:
+                self._save()
+            return len(missing)
+
+    def _save(self) -> None:
+        directory = os.path.dirname(self.path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(self.files, f, ensure_ascii=False, indent=1)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+
+class FolderWatcher:
+    """轮询扫描目录，找出已写完（签名连续 debounce 秒不变）且需要处理的视频"""
+
+    def __init__(self, inputs: List[str], state: WatchState, recursive: bool = False,
+                 debounce: float = 30.0, formats: Optional[List[str]] = None, overwrite: bool = False,
+                 tracks: Optional[List[int]] = None):
+        self.inputs = inputs
+        self.state = state
+        self.recursive = recursive
+        self.debounce = debounce
+        self.formats = formats or ["srt"]
+        self.overwrite = overwrite
+        self.tracks = tracks
+        # 待确认的文件：{路径: (签名, 首次看到该签名的时间)}
+        self._pending: Dict[str, Tuple[Signature, float]] = {}
+
+    def scan(self, now: Optional[float] = None) -> List[Tuple[str, Signature]]:
+        """扫描一次，返回可以处理的 (路径, 签名) 列表"""
+        now = time.monotonic() if now is None else now
+        ready = []
+        seen = set()
+        for path in collect_videos(self.inputs, self.recursive):
+            signature = file_signature(path)
+            if signature is None or not self.state.needs_processing(path, signature):
+                continue
+            seen.add(path)
+            # 首次运行时已有字幕的文件视为已处理，与 cli.py 默认不覆盖一致
+            if (not self.overwrite and path not in self.state.files
+                    and has_subtitles(path, self.formats, self.tracks)):
+                self.state.mark(path, signature, 'skipped')
+                continue
+            pending = self._pending.get(path)
+            if pending is None or pending[0] != signature:
+                self._pending[path] = (signature, now)
+            elif now - pending[1] >= self.debounce:
+                ready.append((path, signature))
+        # 被删除或已处理的文件不再等待
+        self._pending = {path: value for path, value in self._pending.items() if path in seen}
+        for path, _ in ready:
+            del self._pending[path]
+        return ready
+
+
+def process_batch(ready: List[Tuple[str, Signature]], state: WatchState, args) -> int:
+    """把一批文件送入流水线并记录结果，返回失败的文件数"""
+    signatures = dict(ready)
+
+    def record(job: PipelineJob) -> None:
+        if job.error is not None:
+            state.mark(job.source, signatures[job.source], 'failed', f"{job.failed_stage}: {job.error}")
+        else:
+            state.mark(job.source, signatures[job.source], 'done')
+
+    return run_batch([path for path, _ in ready], args, on_done=record)
+
+
+def build_watch_parser():
+    parser = build_parser()
+    parser.description = "监视目录，为新增或更新的视频自动生成字幕"
+    parser.add_argument("--interval", type=float, default=10.0, help="扫描间隔（秒）")
+    parser.add_argument("--debounce", type=float, default=30.0,
+                        help="文件大小和修改时间连续多少秒不变才视为已写完")
+    parser.add_argument("--batch-size", type=int, default=16, help="每批最多处理的文件数")
+    parser.add_argument("--state-file", default=DEFAULT_STATE_FILE, help="已处理文件的状态存储")
+    parser.add_argument("--once", action="store_true", help="只处理当前已写完的文件，然后退出（不等待去抖）")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_watch_parser().parse_args(argv)
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        format="%(asctime)s %(message)s",
+        datefmt="%H:%M:%S",
+    )
+    if not args.api_key:
+        logger.error("❌ 未提供 API Key：请设置 OPENAI_API_KEY 环境变量或使用 --api-key")
+        return 2
+
+    state = WatchState(args.state_file)
+    watcher = FolderWatcher(args.inputs, state, recursive=args.recursive,
+                            debounce=0.0 if args.once else args.debounce,
+                            formats=args.formats, overwrite=args.overwrite, tracks=args.tracks)
+    stopping = threading.Event()
+
+    def stop(signum, frame):
+        logger.info("🛑 收到退出信号，处理完当前批次后退出")
+        stopping.set()
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    logger.info("👀 开始监视: %s（每 %.0f 秒扫描一次）", ", ".join(args.inputs), args.interval)
+    failed = 0
+    while not stopping.is_set():
+        # --once 时连续扫描两次，第二次即可确认签名未变
+        ready = watcher.scan() or (watcher.scan() if args.once else [])
+        for start in range(0, len(ready), args.batch_size):
+            if stopping.is_set():
+                break
+            batch = ready[start:start + args.batch_size]
+            logger.info("📥 发现 %d 个待处理的视频", len(batch))
+            failed += process_batch(batch, state, args)
+        if args.once:
+            break
+        state.forget_missing()
+        stopping.wait(args.interval)
+    return 1 if failed and args.once else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())